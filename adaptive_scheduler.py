@@ -0,0 +1,181 @@
+########
+##
+## Decide which bot pairs need more meetings in an adaptive tournament, and
+## when the ranking is settled enough to stop
+##
+########
+
+
+import math
+
+import tournament_results as tr
+
+
+def normal_quantile(p):
+    """
+    Inverse of the standard normal CDF, found by bisection on math.erf
+
+    ARGS:
+    - p: probability strictly between 0 and 1
+
+    RETURNS:
+    - z: the value with P(Z < z) = p for a standard normal Z
+    """
+    lo, hi = -40.0, 40.0
+    for _ in xrange(200):
+        mid = (lo+hi)/2.0
+        if 0.5*(1.0+math.erf(mid/math.sqrt(2.0))) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo+hi)/2.0
+
+
+class AdaptiveScheduler(object):
+    """
+    Tracks each bot's average score per turn and its standard error over the
+    meetings played so far, and picks the pairs whose extra meetings could
+    still change the ranking. The average weights every partner equally,
+    which is what TournamentResults reports once pairs have met different
+    numbers of times (and, while they haven't, the same as its average over
+    all turns), so the ranking settled here is the ranking reported.
+    """
+    def __init__(self, bot_ids, payoffs, confidence=0.95, top_k=None,
+                    max_turns=None):
+        """
+        ARGS:
+        - bot_ids: tournament ids of the participating bots
+        - payoffs: the tournament's payoffs, to score meetings with
+        - confidence: probability with which the ranking must hold (split
+        over all the neighbouring comparisons, Bonferroni style)
+        - top_k: if given, only the ordering of the k best bots (and the
+        boundary below them) has to be settled, otherwise the full ranking
+        - max_turns: budget of total turns simulated, or None for no budget
+        (runAdaptiveTournament plays its first round regardless)
+        """
+        self.bot_ids = list(bot_ids)
+        self.payoffs = payoffs
+        self.confidence = confidence
+        self.top_k = top_k
+        self.max_turns = max_turns
+
+        self.turns_played = 0
+
+        # (id_1, id_2) => scores of every meeting so far, as
+        # TournamentResults.interaction_scores, to hand on to the results
+        self.interaction_scores = {}
+        # bot id => partner id => running sums over the pair's meetings, as
+        # taken by tournament_results.ratio_stderr
+        self.partner_stats_by_id = {}
+        for bot_id in self.bot_ids:
+            self.partner_stats_by_id[bot_id] = {}
+        # bot id => (average, stderr), updated after each round
+        self.estimates_by_id = {}
+
+        num_comparisons = len(self.bot_ids)-1
+        if self.top_k is not None:
+            num_comparisons = min(self.top_k, num_comparisons)
+        self.num_comparisons = max(num_comparisons, 1)
+        alpha = (1.0-self.confidence)/self.num_comparisons
+        # one sided, since each comparison only checks the observed order
+        self.z = normal_quantile(1.0-alpha)
+
+    def add_round(self, round_interactions):
+        """
+        Score the meetings of one round, once, and fold them into the running
+        sums
+
+        ARGS:
+        - round_interactions: dictionary of (id_1, id_2) => meetings played
+        this round
+        """
+        changed = set()
+        for bot_pair, meetings in round_interactions.items():
+            scores = [tr.score_meeting(meeting, self.payoffs)
+             for meeting in meetings]
+            lengths = [len(meeting) for meeting in meetings]
+            self.interaction_scores.setdefault(bot_pair, []).extend(scores)
+            self.turns_played += sum(lengths)
+            bot_ids = bot_pair
+            if bot_pair[0] == bot_pair[1]:
+                bot_ids = bot_pair[:1]
+            for idx, bot_id in enumerate(bot_ids):
+                partner_id = bot_pair[1-idx]
+                round_stats = tr.meeting_stats(
+                    [meeting_scores[idx] for meeting_scores in scores],
+                    lengths
+                )
+                stats = self.partner_stats_by_id[bot_id].setdefault(
+                    partner_id, [0, 0, 0, 0, 0, 0]
+                )
+                for k in xrange(len(stats)):
+                    stats[k] += round_stats[k]
+                changed.add(bot_id)
+        for bot_id in changed:
+            self.estimates_by_id[bot_id] = tr.partner_average(
+                self.partner_stats_by_id[bot_id].values()
+            )
+
+    def get_mean_by_id(self, bot_id):
+        if bot_id not in self.estimates_by_id:
+            return 0.0
+        return self.estimates_by_id[bot_id][0]
+
+    def get_stderr_by_id(self, bot_id):
+        if bot_id not in self.estimates_by_id:
+            return float('inf')
+        return self.estimates_by_id[bot_id][1]
+
+    def get_ranking(self):
+        return sorted(self.bot_ids, key=self.get_mean_by_id, reverse=True)
+
+    def get_unsettled_ids(self):
+        """
+        Find the bots whose place in the ranking is not yet settled at the
+        chosen confidence
+
+        RETURNS:
+        - unsettled: set of tournament ids of bots in at least one
+        neighbouring comparison that does not hold yet
+        """
+        ranking = self.get_ranking()
+        unsettled = set()
+        for pos in xrange(self.num_comparisons):
+            upper, lower = ranking[pos], ranking[pos+1]
+            gap = self.get_mean_by_id(upper)-self.get_mean_by_id(lower)
+            spread = math.sqrt(self.get_stderr_by_id(upper)**2+\
+             self.get_stderr_by_id(lower)**2)
+            if spread == 0:
+                # both averages are exact, so more meetings change nothing
+                continue
+            if not gap > self.z*spread:
+                unsettled.add(upper)
+                unsettled.add(lower)
+        return unsettled
+
+    def get_next_pairs(self, all_pairs):
+        """
+        Pairs that get another meeting next round: every pair with at least
+        one unsettled bot
+
+        ARGS:
+        - all_pairs: list of every (id_1, id_2) pair in the tournament
+
+        RETURNS:
+        - pairs: the pairs to play next round, empty if the ranking is settled
+        """
+        unsettled = self.get_unsettled_ids()
+        return [pair for pair in all_pairs
+         if pair[0] in unsettled or pair[1] in unsettled]
+
+    def within_budget(self, next_turns):
+        """
+        Whether simulating next_turns more turns stays within max_turns
+        """
+        if self.max_turns is None:
+            return True
+        return self.turns_played+next_turns <= self.max_turns
+
+
+if __name__ == "__main__":
+    pass
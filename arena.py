@@ -7,7 +7,12 @@
 
 import random
 
+import adaptive_scheduler
 import bot_player as bp
+import checkpoint
+import history
+import rosters
+import sampling
 import tournament_results as tr
 import morality_calculator as mc
 
@@ -16,8 +21,30 @@ class Arena(object):
     """
     Hosts tournaments of bots
     """
-    def __init__(self):
-        pass
+    def __init__(self, windowed_history=False, keep_history=True,
+                    progress=None, run_length_history=False,
+                    turn_dynamics=None):
+        """
+        ARGS:
+        - windowed_history: if True, bots that declare a memory_depth are
+        handed a fixed-size MoveWindow of the last turns instead of the full
+        growing history, so memory per meeting stays flat
+        - keep_history: with windowed_history, whether meetings are kept in
+        full (as CompactMeetings) or only tallied (as MeetingTallys, enough
+        for scores and cooperation rates)
+        - progress: optional ProgressReporter told about every finished pair
+        - run_length_history: whether results store meetings run-length
+        encoded (see TournamentResults)
+        - turn_dynamics: optional dynamics.TurnDynamics that every turn played
+        is counted into, by bot and turn index; reset at the start of each
+        tournament and attached to its results (pairs read back from a
+        checkpoint by resumeTournament are not counted)
+        """
+        self.windowed_history = windowed_history
+        self.keep_history = keep_history
+        self.progress = progress
+        self.run_length_history = run_length_history
+        self.turn_dynamics = turn_dynamics
 
     def generate_interaction_lengths(self, w, numMeetings):
         """
@@ -63,6 +90,10 @@ class Arena(object):
         - past_moves: list of every move that occurred during the
         interaction
         """
+        if self.windowed_history:
+            return self.windowed_bot_interaction(bot1, bot2,
+             interaction_length, payoffs=payoffs, w=w)
+        dynamics = self.turn_dynamics
         past_moves_1 = []
         past_moves_2 = []
         i = 0
@@ -75,9 +106,50 @@ class Arena(object):
             next_moves_2 = (bot2_move, bot1_move)
             past_moves_1.append(next_moves_1)
             past_moves_2.append(next_moves_2)
+            if dynamics is not None:
+                dynamics.add_turn(bot1.tournament_id, bot2.tournament_id, i,
+                 next_moves_1)
             i += 1
         return past_moves_1
 
+    def windowed_bot_interaction(self, bot1, bot2, interaction_length,
+                    payoffs={'T': 5,'R': 3,'P': 1,'S': 0}, w=0.995):
+        """
+        Same as bot_interaction, but bots with a memory_depth only ever see a
+        MoveWindow, and the meeting is recorded compactly
+
+        RETURNS:
+        - meeting: CompactMeeting (or MeetingTally if not keep_history) of
+        the interaction from bot1's point of view
+        """
+        def history_for(bot):
+            if bot.memory_depth is None:
+                return []
+            return history.MoveWindow(bot.memory_depth)
+        past_moves_1 = history_for(bot1)
+        past_moves_2 = history_for(bot2)
+        if self.keep_history:
+            meeting = history.CompactMeeting()
+        else:
+            meeting = history.MeetingTally()
+        dynamics = self.turn_dynamics
+        i = 0
+        while i < interaction_length:
+            bot1_move = bot1.getNextMove(past_moves_1,
+                payoffs=payoffs, w=w)
+            bot2_move = bot2.getNextMove(past_moves_2,
+                payoffs=payoffs, w=w)
+            next_moves_1 = (bot1_move, bot2_move)
+            next_moves_2 = (bot2_move, bot1_move)
+            past_moves_1.append(next_moves_1)
+            past_moves_2.append(next_moves_2)
+            meeting.append(next_moves_1)
+            if dynamics is not None:
+                dynamics.add_turn(bot1.tournament_id, bot2.tournament_id, i,
+                 next_moves_1)
+            i += 1
+        return meeting
+
     def validate_tournament_inputs(self, botList, numMeetings, payoffs, w):
         """
         Make sure the inputs to runTournament make sense and if they do not,
@@ -95,11 +167,15 @@ class Arena(object):
         with the inputs, if anything
         """
         errors = []
-        # botList has to be a list of BotPlayer instances
-        for bot in botList:
-            if not isinstance(bot, bp.BotPlayer):
-                errors.append("botList must be a list of BotPlayer objects")
-                break
+        # botList has to be a list of BotPlayer instances (a Roster only
+        # holds registered BotPlayer classes, and isn't built to check)
+        if not isinstance(botList, rosters.Roster):
+            for bot in botList:
+                if not isinstance(bot, bp.BotPlayer):
+                    errors.append(
+                        "botList must be a list of BotPlayer objects"
+                    )
+                    break
         if int(numMeetings) != numMeetings:
             errors.append("numMeetings must represent an integer")
         if numMeetings < 1:
@@ -112,8 +188,27 @@ class Arena(object):
             errors.append("w must be a number between 0 and 1")
         return errors
 
+    def assign_tournament_ids(self, botList):
+        """
+        Give every bot its position in botList as its tournament id. A
+        Roster numbers its bots as it builds them, so it is left unbuilt.
+        """
+        if isinstance(botList, rosters.Roster):
+            return
+        for t_id, bot in enumerate(botList):
+            bot.tournament_id = t_id
+
+    def start_tournament(self):
+        """
+        Forget whatever was recorded during the previous tournament.
+        Subclasses override this to reset their own per-tournament state.
+        """
+        if self.turn_dynamics is not None:
+            self.turn_dynamics.reset()
+
     def runTournament(self, botList, numMeetings,
-                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995,
+                    checkpoint_path=None, checkpoint_every=50):
         """
         Main method, partners each bot with each other bot with
         w probability of ending each turn (length of interactions
@@ -126,6 +221,10 @@ class Arena(object):
         - numMeetings: number of times each bot is paired with each
         other bot
         - payoffs: defines the scores for each Prisoner's Dilemma situation
+        - checkpoint_path: if given, finished pairs are written to this
+        checkpoint file (overwritten if it exists) so the run can be picked
+        up by resumeTournament
+        - checkpoint_every: number of pairs per checkpoint batch
 
         RETURNS:
         - tourney_res: TournamentResults object with all the info
@@ -138,33 +237,335 @@ class Arena(object):
             print(error_messages)
             return -1
 
-        # dictionary of interactions to pass to TournamentResults
-        interactions = {}
-
         # determine length of each interaction based on w
         interaction_lengths =\
          self.generate_interaction_lengths(w, numMeetings)
 
         # assign each bot a tournament id number
-        for t_id, bot in enumerate(botList):
-            bot.tournament_id = t_id
+        self.assign_tournament_ids(botList)
+        self.start_tournament()
 
         # pair each bot with each other bot and save the results
         num_bots = len(botList)
-        for i in xrange(num_bots):
-            for j in xrange(i, num_bots):
-                bot1 = botList[i]
-                bot2 = botList[j]
-                meeting_results_list = []
-                for m in xrange(numMeetings):
-                    interaction_length = interaction_lengths[m]
-                    meeting_results =\
-                     self.bot_interaction(bot1, bot2, interaction_length,\
-                     payoffs=payoffs, w=w)
-                    meeting_results_list.append(meeting_results)
-                interactions[(bot1.tournament_id, bot2.tournament_id)] =\
-                 meeting_results_list
-        tourney_res = tr.TournamentResults(botList, interactions, payoffs)
+        pairs = [(i, j) for i in xrange(num_bots) for j in xrange(i, num_bots)]
+        self.start_progress(len(pairs), interaction_lengths)
+        if checkpoint_path is None:
+            interactions = self.play_pairs(botList, pairs,
+             interaction_lengths, payoffs=payoffs, w=w)
+        else:
+            writer = checkpoint.CheckpointWriter(checkpoint_path)
+            writer.write_header(botList, numMeetings, payoffs, w,
+             interaction_lengths)
+            interactions = self.play_pairs_with_checkpoints(botList, pairs,
+             interaction_lengths, payoffs, w, writer, checkpoint_every)
+        self.finish_progress()
+        tourney_res = self.build_results(botList, interactions, payoffs)
+        return tourney_res
+
+    def resumeTournament(self, checkpoint_path, botList, checkpoint_every=50):
+        """
+        Finish a tournament started by runTournament with a checkpoint_path,
+        skipping the pairs already in the checkpoint. The result is the same
+        as that of an uninterrupted run.
+
+        ARGS:
+        - checkpoint_path: the checkpoint file, which gets appended to as the
+        remaining pairs finish (after cutting off anything past its last
+        mark)
+        - botList: the same roster, in the same order, as the original run
+        - checkpoint_every: number of pairs per checkpoint batch
+
+        RETURNS:
+        - tourney_res: TournamentResults object with all the info
+        """
+        header, interactions, rng_state, offset = checkpoint.read_checkpoint(
+            checkpoint_path, compact=self.windowed_history
+        )
+        roster = [[bot.name, bot.__class__.__name__] for bot in botList]
+        if roster != header['roster']:
+            print(["botList does not match the checkpointed roster"])
+            return -1
+        payoffs = dict(
+            [(str(k), v) for k, v in header['payoffs'].items()]
+        )
+        w = header['w']
+        interaction_lengths = header['interaction_lengths']
+
+        self.assign_tournament_ids(botList)
+        self.start_tournament()
+
+        random.setstate(rng_state)
+        num_bots = len(botList)
+        pairs = [(i, j) for i in xrange(num_bots)
+         for j in xrange(i, num_bots) if (i, j) not in interactions]
+        writer = checkpoint.CheckpointWriter(checkpoint_path,
+         resume_offset=offset)
+        self.start_progress(len(pairs), interaction_lengths)
+        interactions.update(
+            self.play_pairs_with_checkpoints(botList, pairs,
+             interaction_lengths, payoffs, w, writer, checkpoint_every)
+        )
+        self.finish_progress()
+        tourney_res = self.build_results(botList, interactions, payoffs)
+        return tourney_res
+
+    def play_pairs_with_checkpoints(self, botList, pairs, interaction_lengths,
+                    payoffs, w, writer, checkpoint_every):
+        """
+        Play the pairs in batches of checkpoint_every through play_pairs,
+        appending each finished batch (and the RNG state after it) to the
+        checkpoint
+
+        RETURNS:
+        - interactions: as for play_pairs
+        """
+        interactions = {}
+        try:
+            for start in xrange(0, len(pairs), checkpoint_every):
+                batch = pairs[start:start+checkpoint_every]
+                batch_interactions = self.play_pairs(botList, batch,
+                 interaction_lengths, payoffs=payoffs, w=w)
+                for pair in batch:
+                    writer.write_pair(pair, batch_interactions[pair])
+                writer.write_mark()
+                interactions.update(batch_interactions)
+        finally:
+            writer.close()
+        return interactions
+
+    def play_pairs(self, botList, pairs, interaction_lengths,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+        """
+        Play every given pair of bots for each of the interaction lengths.
+        Subclasses override this to change how the pairs get simulated.
+
+        ARGS:
+        - botList: list of bots, indexed by tournament id
+        - pairs: list of (id_1, id_2) tuples to play
+        - interaction_lengths: list of meeting lengths, one per meeting
+
+        RETURNS:
+        - interactions: dictionary of (id_1, id_2) => meeting results list,
+        as TournamentResults expects
+        """
+        interactions = {}
+        for i, j in pairs:
+            interactions[(i, j)] =\
+             self.play_pair(botList[i], botList[j], interaction_lengths,
+             payoffs=payoffs, w=w)
+            self.report_pairs_finished(1)
+        return interactions
+
+    def start_progress(self, num_pairs, interaction_lengths):
+        if self.progress is not None:
+            self.progress.start(num_pairs, interaction_lengths)
+
+    def report_pairs_finished(self, num_pairs):
+        if self.progress is not None:
+            self.progress.pairs_finished(num_pairs)
+
+    def finish_progress(self):
+        if self.progress is not None:
+            self.progress.finish()
+
+    def build_results(self, botList, interactions, payoffs, **kwargs):
+        """
+        Wrap up the interactions of a finished tournament. Subclasses override
+        this to attach whatever else they recorded while playing.
+
+        ARGS:
+        - botList, interactions, payoffs: as for TournamentResults
+        - kwargs: passed on to TournamentResults
+
+        RETURNS:
+        - tourney_res: TournamentResults object
+        """
+        if self.run_length_history:
+            kwargs['run_length'] = True
+        if self.turn_dynamics is not None:
+            # a copy, so the next tournament's counts don't show up here
+            kwargs['turn_dynamics'] = self.turn_dynamics.copy()
+        return tr.TournamentResults(botList, interactions, payoffs, **kwargs)
+
+    def play_pair(self, bot1, bot2, interaction_lengths,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+        """
+        Have two bots meet once for each of the given interaction lengths
+
+        ARGS:
+        - bot1, bot2: the paired bots
+        - interaction_lengths: list of meeting lengths, one per meeting
+
+        RETURNS:
+        - meeting_results_list: list of the moves of each meeting, from bot1's
+        point of view
+        """
+        meeting_results_list = []
+        for interaction_length in interaction_lengths:
+            meeting_results =\
+             self.bot_interaction(bot1, bot2, interaction_length,\
+             payoffs=payoffs, w=w)
+            meeting_results_list.append(meeting_results)
+        return meeting_results_list
+
+    def runSampledTournament(self, botList, numMeetings, numOpponents,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995,
+                    stratify=None, allocation='even', include_self=False):
+        """
+        Partial round-robin: partners each bot with numOpponents randomly
+        chosen other bots instead of every other bot, so the number of pairs
+        grows linearly with the number of bots
+
+        ARGS:
+        - botList: list of bots to participate in the tournament
+        - numMeetings: number of times each sampled pair meets
+        - numOpponents: number of opponents sampled for each bot (a bot can
+        end up with more partners, since other bots sample it too)
+        - payoffs: defines the scores for each Prisoner's Dilemma situation
+        - w: probability of interaction continuing at each step
+        - stratify, allocation, include_self: see
+        sampling.sample_opponent_pairs
+
+        RETURNS:
+        - tourney_res: TournamentResults object holding only the sampled
+        pairs, whose average scores and standard errors are estimates of the
+        full round-robin ones
+        """
+
+        # validate inputs
+        error_messages =\
+         self.validate_tournament_inputs(botList, numMeetings, payoffs, w)
+        if int(numOpponents) != numOpponents:
+            error_messages.append("numOpponents must represent an integer")
+        if not (1 <= numOpponents <= len(botList)-1):
+            error_messages.append(
+                "numOpponents must be between 1 and the number of bots minus 1"
+            )
+        if allocation not in sampling.ALLOCATIONS:
+            error_messages.append(
+                "allocation must be one of "+str(sampling.ALLOCATIONS)
+            )
+        if error_messages:
+            print(error_messages)
+            return -1
+
+        interaction_lengths =\
+         self.generate_interaction_lengths(w, numMeetings)
+
+        self.assign_tournament_ids(botList)
+        self.start_tournament()
+
+        pairs = sampling.sample_opponent_pairs(botList, int(numOpponents),
+         stratify=stratify, allocation=allocation, include_self=include_self)
+        self.start_progress(len(pairs), interaction_lengths)
+        interactions = self.play_pairs(botList, pairs, interaction_lengths,
+         payoffs=payoffs, w=w)
+        self.finish_progress()
+        tourney_res = self.build_results(botList, interactions, payoffs)
+        return tourney_res
+
+
+    def runAdaptiveTournament(self, botList,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995,
+                    confidence=0.95, top_k=None, max_turns=None,
+                    initialMeetings=2, meetingsPerRound=1, maxRounds=100):
+        """
+        Round-robin that adds meetings in rounds, only to pairs involving a
+        bot whose place in the ranking is not yet settled, and stops once the
+        ranking holds at the chosen confidence or the turn budget runs out
+
+        ARGS:
+        - botList: list of bots to participate in the tournament
+        - payoffs: defines the scores for each Prisoner's Dilemma situation
+        - w: probability of interaction continuing at each step
+        - confidence, top_k, max_turns: see AdaptiveScheduler
+        - initialMeetings: number of meetings every pair plays in the first
+        round (at least 2, so that standard errors exist)
+        - meetingsPerRound: number of meetings added to each unsettled pair
+        per later round
+        - maxRounds: hard limit on the number of rounds
+
+        RETURNS:
+        - tourney_res: TournamentResults object where each pair holds however
+        many meetings it actually got, and whose schedule_info records the
+        rounds played and why the tournament stopped
+        """
+
+        # validate inputs
+        error_messages =\
+         self.validate_tournament_inputs(botList, initialMeetings, payoffs, w)
+        if initialMeetings < 2:
+            error_messages.append("initialMeetings must be at least 2")
+        if int(meetingsPerRound) != meetingsPerRound or meetingsPerRound < 1:
+            error_messages.append(
+                "meetingsPerRound must be a positive integer"
+            )
+        if not (0 < confidence < 1):
+            error_messages.append("confidence must be between 0 and 1")
+        if top_k is not None and not (1 <= top_k < len(botList)):
+            error_messages.append(
+                "top_k must be between 1 and the number of bots minus 1"
+            )
+        if error_messages:
+            print(error_messages)
+            return -1
+
+        self.assign_tournament_ids(botList)
+        self.start_tournament()
+
+        num_bots = len(botList)
+        all_pairs = [(i, j) for i in xrange(num_bots)
+         for j in xrange(i, num_bots)]
+        scheduler = adaptive_scheduler.AdaptiveScheduler(range(num_bots),
+         payoffs, confidence=confidence, top_k=top_k, max_turns=max_turns)
+
+        interactions = {}
+        all_interaction_lengths = []
+        pairs = all_pairs
+        num_meetings = int(initialMeetings)
+        stop_reason = 'max_rounds'
+        rounds = 0
+        while rounds < maxRounds:
+            # every pair playing this round shares the same meeting lengths
+            interaction_lengths =\
+             self.generate_interaction_lengths(w, num_meetings)
+            # the first round is always played, so there are results to
+            # return however small the budget
+            if rounds > 0 and not scheduler.within_budget(
+             len(pairs)*sum(interaction_lengths)):
+                stop_reason = 'budget'
+                break
+            # the rounds' pairs aren't known ahead, so progress is per round
+            self.start_progress(len(pairs), interaction_lengths)
+            round_interactions = self.play_pairs(botList, pairs,
+             interaction_lengths, payoffs=payoffs, w=w)
+            for pair in pairs:
+                interactions.setdefault(pair, []).extend(
+                    round_interactions[pair]
+                )
+            all_interaction_lengths.extend(interaction_lengths)
+            scheduler.add_round(round_interactions)
+            rounds += 1
+
+            pairs = scheduler.get_next_pairs(all_pairs)
+            if not pairs:
+                stop_reason = 'settled'
+                break
+            num_meetings = int(meetingsPerRound)
+        self.finish_progress()
+
+        schedule_info = {
+            'mode': 'adaptive',
+            'rounds': rounds,
+            'stop_reason': stop_reason,
+            'turns_played': scheduler.turns_played,
+            'confidence': confidence,
+            'top_k': top_k
+        }
+        tourney_res = self.build_results(botList, interactions, payoffs,
+         interaction_lengths=all_interaction_lengths,
+         schedule_info=schedule_info,
+         interaction_scores=scheduler.interaction_scores)
         return tourney_res
 
 
@@ -176,6 +577,7 @@ class Arena(object):
 
 if __name__ == "__main__":
     
+    import sys
     import the_bots
     
     a = Arena()
@@ -207,6 +609,10 @@ if __name__ == "__main__":
     bot_list = [b1, b2, b3, b4, b5, b6, b7, b8, b9, b10, b11, b12, b13,\
      b14, b15, b16, b17, b18, b19, b20]
 
+    # or play a roster file instead, e.g. example_roster.json
+    if len(sys.argv) > 1:
+        bot_list = rosters.load_roster(sys.argv[1])
+
     t = a.runTournament(bot_list, num_meetings)
     print(t)
 
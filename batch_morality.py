@@ -0,0 +1,192 @@
+########
+##
+## Make the morality calculations of MoralityCalculator on many tournaments
+## at once, using stacked numpy arrays
+##
+########
+
+
+import numpy as np
+
+import tournament_results as tr
+
+
+#####
+# Batched calculation functions
+#####
+
+def cooperation_matrix(tourney_res):
+    """
+    Build the cooperation matrix of a single tournament
+
+    ARGS:
+    - tourney_res: TournamentResults object
+
+    RETURNS:
+    - coop_matrix: numpy array, coop_matrix[i][j] is i's cooperation rate
+    when partnered with j
+    """
+    num_bots = len(tourney_res.get_bot_list())
+    coop_matrix = np.zeros((num_bots, num_bots))
+    for (bot1_id, bot2_id), interactions in tourney_res.interactions.items():
+        total_turns = sum([len(meeting) for meeting in interactions])
+        bot1_coops, bot2_coops = 0.0, 0.0
+        for meeting in interactions:
+            meeting_coops = tr.cooperation_counts(meeting)
+            bot1_coops += meeting_coops[0]
+            bot2_coops += meeting_coops[1]
+        coop_matrix[bot1_id][bot2_id] = bot1_coops/total_turns
+        coop_matrix[bot2_id][bot1_id] = bot2_coops/total_turns
+    return coop_matrix
+
+def batched_cooperation_stuff(coop_matrices):
+    """
+    Calculate cooperation rates and bigger man scores for a stack of
+    cooperation matrices
+
+    ARGS:
+    - coop_matrices: numpy array of shape (T, N, N), coop_matrices[t][i][j]
+    is i's cooperation rate when partnered with j in tournament t
+
+    RETURNS:
+    - cooperation_rates: numpy array of shape (T, N), the fraction of each
+    bot's total moves that are cooperations
+    - bigger_man_scores: numpy array of shape (T, N), the fraction of
+    partnerships in which each bot cooperated at least as much as its partner
+    """
+    num_bots = coop_matrices.shape[1]
+    cooperation_rates = coop_matrices.mean(axis=2)
+    not_worse = coop_matrices >= coop_matrices.transpose(0, 2, 1)
+    # don't include the case where a bot partners with its own clone
+    diagonal = np.arange(num_bots)
+    not_worse[:, diagonal, diagonal] = False
+    bigger_man_scores = not_worse.sum(axis=2)/float(num_bots-1)
+    return cooperation_rates, bigger_man_scores
+
+def batched_principal_eigenvector(C, iters):
+    """
+    Batched version of MoralityCalculator.principal_eigenvector, iterating
+    every matrix in the stack at once
+
+    ARGS:
+    - C: numpy array of shape (T, N, N) with values in [0, 1] (or [-1, 1])
+    where C[t] holds the 'votes' between nodes of tournament t
+    - iters: number of power iterations
+
+    RETURNS:
+    - pev: numpy array of shape (T, N), the principal eigenvector of each
+    C[t], normalized to add to N (or all ones if it adds to 0)
+    """
+    num_mats, num_vals = C.shape[0], C.shape[1]
+    current_vals = np.ones((num_mats, num_vals))
+    i = 0
+    while i < iters:
+        current_vals = np.einsum('tij,tj->ti', C, current_vals)
+        i += 1
+    total_vals = current_vals.sum(axis=1)
+    pev = np.ones((num_mats, num_vals))
+    nonzero = total_vals != 0
+    pev[nonzero] = (num_vals/total_vals[nonzero])[:, None]*\
+     current_vals[nonzero]
+    return pev
+
+def batched_network_morality(coop_matrices, iters=100):
+    """
+    Calculate eigenjesus and eigenmoses scores for a stack of cooperation
+    matrices
+
+    RETURNS:
+    - eigenjesus_scores, eigenmoses_scores: numpy arrays of shape (T, N)
+    """
+    eigenjesus_scores = batched_principal_eigenvector(coop_matrices, iters)
+    coop_def_matrices = (coop_matrices-0.5)*2
+    eigenmoses_scores = batched_principal_eigenvector(coop_def_matrices, iters)
+    return eigenjesus_scores, eigenmoses_scores
+
+
+class BatchMoralityCalculator(object):
+    """
+    Computes every MoralityCalculator metric for a list of tournaments in one
+    pass over stacked cooperation matrices
+    """
+    def __init__(self, tourney_res_list, iters=100):
+        """
+        Stack the cooperation matrices of the given tournament results and
+        calculate all the morality metrics for them
+
+        ARGS:
+        - tourney_res_list: list of TournamentResults objects, all with the
+        same number of bots
+        - iters: number of power iterations for the eigenvector metrics
+        """
+        self.tourney_res_list = tourney_res_list
+        self.iters = iters
+
+        num_bots_set = set(
+            [len(t.get_bot_list()) for t in self.tourney_res_list]
+        )
+        if len(num_bots_set) != 1:
+            raise ValueError(
+                "all tournaments must have the same number of bots"
+            )
+
+        self.cooperation_matrices = np.array(
+            [cooperation_matrix(t) for t in self.tourney_res_list]
+        )
+
+        self.cooperation_rates = None
+        self.bigger_man_scores = None
+        self.eigenjesus_scores = None
+        self.eigenmoses_scores = None
+        self.calculate_all()
+
+    def calculate_all(self):
+        """
+        Calculate and store every metric for every tournament
+
+        STORES:
+        - cooperation_rates, bigger_man_scores, eigenjesus_scores,
+        eigenmoses_scores: numpy arrays of shape (T, N), where row t holds the
+        scores of tournament t indexed by tournament id
+        """
+        self.cooperation_rates, self.bigger_man_scores =\
+         batched_cooperation_stuff(self.cooperation_matrices)
+        self.eigenjesus_scores, self.eigenmoses_scores =\
+         batched_network_morality(self.cooperation_matrices, self.iters)
+
+
+    #####
+    # Getter methods
+    #####
+
+    def get_num_tournaments(self):
+        return len(self.tourney_res_list)
+
+    def get_coop_rate_by_id(self, t_idx, bot_id):
+        return self.cooperation_rates[t_idx][bot_id]
+
+    def get_good_partner_by_id(self, t_idx, bot_id):
+        return self.bigger_man_scores[t_idx][bot_id]
+
+    def get_eigenjesus_by_id(self, t_idx, bot_id):
+        return self.eigenjesus_scores[t_idx][bot_id]
+
+    def get_eigenmoses_by_id(self, t_idx, bot_id):
+        return self.eigenmoses_scores[t_idx][bot_id]
+
+    def get_metrics(self, t_idx):
+        """
+        Get every metric of one tournament, keyed like the MoralityCalculator
+        instance variables
+        """
+        return {
+            'cooperation_matrix': self.cooperation_matrices[t_idx],
+            'cooperation_rates': self.cooperation_rates[t_idx],
+            'bigger_man_scores': self.bigger_man_scores[t_idx],
+            'eigenjesus_scores': self.eigenjesus_scores[t_idx],
+            'eigenmoses_scores': self.eigenmoses_scores[t_idx]
+        }
+
+
+if __name__ == "__main__":
+    pass
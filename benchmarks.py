@@ -0,0 +1,407 @@
+########
+##
+## Fixed-seed performance baselines for the tournament pipeline, tracked in a
+## history file so slowdowns get flagged, and checks that the faster engines
+## agree with the reference one
+##
+########
+
+
+import collections
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+import arena
+import compiled_bots as cb
+import parallel
+import progress
+import rosters
+import tournament_results as tr
+import morality_calculator as mc
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+## workload name => how to play it; every workload is seeded, so it plays
+## the same tournament every time
+WORKLOADS = collections.OrderedDict([
+    # the 20 bots of the example in arena.py
+    ('example_20', {
+        'roster': {'path': os.path.join(HERE, 'example_roster.json')},
+        'numMeetings': 5, 'w': 0.995, 'seed': 20
+    }),
+    # many bots, short meetings: dominated by per-pair overhead
+    ('grid_200', {
+        'roster': {'bots': [
+            {'class': 'GENEROUS_TIT_FOR_TAT',
+             'grid': {'p_generous': {'start': 0, 'stop': 0.99, 'step': 0.01}}},
+            {'class': 'JOSS',
+             'grid': {'p_sneaky': {'start': 0.01, 'stop': 1, 'step': 0.01}}}
+        ]},
+        'numMeetings': 1, 'w': 0.9, 'seed': 200
+    }),
+    # few bots, very long meetings: dominated by per-turn cost
+    ('high_w', {
+        'roster': {'bots': [
+            {'class': 'TIT_FOR_TAT'}, {'class': 'PAVLOV'},
+            {'class': 'JOSS', 'params': {'p_sneaky': 0.1}},
+            {'class': 'MAJORITY', 'params': {'soft': True}},
+            {'class': 'TESTER'}, {'class': 'CHAMPION'},
+            {'class': 'RANDOM', 'params': {'p_cooperate': 0.5}},
+            {'class': 'ALL_D'}
+        ]},
+        'numMeetings': 2, 'w': 0.9995, 'seed': 9995
+    })
+])
+
+ENGINES = ['reference', 'windowed', 'compiled', 'parallel']
+
+## measurement => whether bigger is better
+MEASUREMENTS = collections.OrderedDict([
+    ('turns_per_second', True),
+    ('scoring_seconds', False),
+    ('morality_seconds', False),
+    ('peak_memory_bytes', False)
+])
+
+
+def make_arena(engine, seed=None):
+    """
+    ARGS:
+    - seed: for the engines with random generators of their own, the seed of
+    those (the global one is seeded by the caller)
+    """
+    if engine == 'reference':
+        return arena.Arena()
+    if engine == 'windowed':
+        return arena.Arena(windowed_history=True)
+    if engine == 'compiled':
+        return cb.CompiledArena(seed=seed)
+    if engine == 'parallel':
+        return parallel.ParallelArena()
+    raise ValueError("engine must be one of "+str(ENGINES))
+
+def load_workload(name):
+    """
+    RETURNS:
+    - roster: Roster object of the workload's bots
+    - workload: the workload's entry of WORKLOADS
+    """
+    if name not in WORKLOADS:
+        raise ValueError("workload must be one of "+
+         str(list(WORKLOADS.keys())))
+    workload = WORKLOADS[name]
+    if 'path' in workload['roster']:
+        roster = rosters.load_roster(workload['roster']['path'])
+    else:
+        roster = rosters.parse_roster(workload['roster'])
+    return roster, workload
+
+
+#####
+# Measuring
+#####
+
+def run_workload(name, engine='reference'):
+    """
+    Play a workload and time each stage of the pipeline
+
+    RETURNS:
+    - record: dictionary of the workload, engine, when it ran, the turns
+    simulated and each of MEASUREMENTS (peak memory is the process's, so
+    see run_isolated)
+    """
+    botList, workload = load_workload(name)
+    tourney_arena = make_arena(engine, seed=workload['seed'])
+    random.seed(workload['seed'])
+    start = time.time()
+    tourney_res = tourney_arena.runTournament(botList,
+     workload['numMeetings'], w=workload['w'])
+    play_seconds = time.time()-start
+    num_bots = len(botList)
+    turns = num_bots*(num_bots+1)/2*sum(tourney_res.interaction_lengths)
+
+    # score the same interactions again on their own, to time just that
+    start = time.time()
+    tr.TournamentResults(botList, tourney_res.interactions,
+     tourney_res.payoffs)
+    scoring_seconds = time.time()-start
+
+    start = time.time()
+    mc.MoralityCalculator(tourney_res)
+    morality_seconds = time.time()-start
+
+    return {
+        'workload': name,
+        'engine': engine,
+        'time': time.time(),
+        'turns': turns,
+        'play_seconds': play_seconds,
+        'turns_per_second': turns/play_seconds,
+        'scoring_seconds': scoring_seconds,
+        'morality_seconds': morality_seconds,
+        'peak_memory_bytes': progress.peak_memory_bytes()
+    }
+
+def run_isolated(name, engine='reference'):
+    """
+    Same as run_workload, but in a fresh process, so the peak memory is the
+    workload's own and not left over from whatever ran before
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        record = pool.apply(run_workload, (name, engine))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return record
+
+
+#####
+# History
+#####
+
+class BaselineHistory(object):
+    """
+    Records of past runs, one JSON object per line of a history file, and
+    the comparison of a new run against them
+    """
+    def __init__(self, path, window=5):
+        """
+        ARGS:
+        - path: the history file, created on the first append
+        - window: number of most recent runs of the same workload and engine
+        whose median makes the baseline
+        """
+        self.path = path
+        self.window = window
+        self.records = []
+        if os.path.exists(path):
+            f = open(path)
+            try:
+                self.records = [json.loads(line) for line in f
+                 if line.strip()]
+            finally:
+                f.close()
+
+    def append(self, record):
+        self.records.append(record)
+        f = open(self.path, 'a')
+        try:
+            f.write(json.dumps(record, sort_keys=True)+"\n")
+        finally:
+            f.close()
+
+    def get_baseline(self, workload, engine):
+        """
+        RETURNS:
+        - baseline: dictionary of measurement => median over the last window
+        runs, or None if there are no earlier runs
+        """
+        runs = [r for r in self.records
+         if r['workload'] == workload and r['engine'] == engine]
+        runs = runs[-self.window:]
+        if not runs:
+            return None
+        baseline = {}
+        for measurement in MEASUREMENTS:
+            values = [r[measurement] for r in runs
+             if r.get(measurement) is not None]
+            if values:
+                baseline[measurement] = float(np.median(values))
+        return baseline
+
+    def check(self, record, threshold=0.2):
+        """
+        Compare a run (not yet appended) against the baseline of its workload
+        and engine
+
+        ARGS:
+        - threshold: relative change counted as a regression, e.g. 0.2 for
+        20% slower or bigger
+
+        RETURNS:
+        - regressions: list of dictionaries with the 'measurement', its
+        'baseline' and 'value', and the relative 'change' for the worse
+        """
+        baseline = self.get_baseline(record['workload'], record['engine'])
+        regressions = []
+        if baseline is None:
+            return regressions
+        for measurement, bigger_is_better in MEASUREMENTS.items():
+            value = record.get(measurement)
+            if value is None or not baseline.get(measurement):
+                continue
+            change = (value-baseline[measurement])/baseline[measurement]
+            if bigger_is_better:
+                change = -change
+            if change > threshold:
+                regressions.append({
+                    'measurement': measurement,
+                    'baseline': baseline[measurement],
+                    'value': value,
+                    'change': change
+                })
+        return regressions
+
+
+def run_baselines(history_path, workloads=None, engines=('reference',),
+                    threshold=0.2, window=5, isolate=True):
+    """
+    Run workloads, flag regressions against the history, then add the runs
+    to it
+
+    ARGS:
+    - history_path: see BaselineHistory
+    - workloads: names of WORKLOADS to run, default all
+    - engines: names of ENGINES to run each workload with
+    - threshold: see BaselineHistory.check
+    - window: see BaselineHistory
+    - isolate: whether each run gets a fresh process (see run_isolated)
+
+    RETURNS:
+    - records: list of the new runs
+    - regressions: dictionary of (workload, engine) => regressions, for the
+    runs that had any
+    """
+    history = BaselineHistory(history_path, window=window)
+    if workloads is None:
+        workloads = list(WORKLOADS.keys())
+    run = run_isolated if isolate else run_workload
+    records = []
+    regressions = {}
+    for name in workloads:
+        for engine in engines:
+            record = run(name, engine)
+            found = history.check(record, threshold=threshold)
+            if found:
+                regressions[(name, engine)] = found
+            history.append(record)
+            records.append(record)
+    return records, regressions
+
+
+#####
+# Equivalence
+#####
+
+class DrawCounter(object):
+    """
+    Stands in for random.random, passing draws through and counting them
+    """
+    def __init__(self, real_random):
+        self.real_random = real_random
+        self.draws = 0
+
+    def __call__(self):
+        self.draws += 1
+        return self.real_random()
+
+
+def check_equivalence(name, engines=('windowed', 'compiled', 'parallel'),
+                    tolerance=0.05, num_stderrs=4.0, seed=None):
+    """
+    Play a workload's pairs with the reference engine and with each other
+    engine on the same meeting lengths. The engines draw their random moves
+    differently, so only pairs that drew no random numbers in the reference
+    must match turn for turn; for the rest, every bot's average score per
+    turn must be within tolerance plus num_stderrs standard errors (of the
+    difference, treating meetings as samples) of the reference's.
+
+    RETURNS:
+    - mismatches: dictionary of engine => list of descriptions of what
+    didn't match, empty if it all did
+    """
+    botList, workload = load_workload(name)
+    if seed is None:
+        seed = workload['seed']
+    payoffs = {'T':5,'R':3,'P':1,'S':0}
+    w = workload['w']
+    random.seed(seed)
+    reference = arena.Arena()
+    interaction_lengths =\
+     reference.generate_interaction_lengths(w, workload['numMeetings'])
+    reference.assign_tournament_ids(botList)
+    num_bots = len(botList)
+    pairs = [(i, j) for i in xrange(num_bots) for j in xrange(i, num_bots)]
+
+    # the reference, a pair at a time, noting which pairs are deterministic
+    interactions = {}
+    fixed_pairs = []
+    real_random = random.random
+    for i, j in pairs:
+        counter = DrawCounter(real_random)
+        random.random = counter
+        try:
+            interactions[(i, j)] = reference.play_pair(botList[i],
+             botList[j], interaction_lengths, payoffs=payoffs, w=w)
+        finally:
+            random.random = real_random
+        if counter.draws == 0:
+            fixed_pairs.append((i, j))
+    expected = tr.TournamentResults(botList, interactions, payoffs)
+
+    mismatches = {}
+    for engine in engines:
+        found = []
+        random.seed(seed)
+        got = tr.TournamentResults(botList, make_arena(engine, seed).play_pairs(
+            botList, pairs, interaction_lengths, payoffs=payoffs, w=w
+        ), payoffs)
+        for pair in fixed_pairs:
+            if got.get_interaction_scores(*pair) !=\
+             expected.get_interaction_scores(*pair):
+                found.append("pair "+str(pair)+" played differently")
+        for t_id in xrange(num_bots):
+            diff = abs(got.get_avg_score_by_id(t_id)-
+             expected.get_avg_score_by_id(t_id))
+            stderr = (got.get_score_stderr_by_id(t_id)**2+
+             expected.get_score_stderr_by_id(t_id)**2)**0.5
+            if diff > tolerance+num_stderrs*stderr:
+                found.append("bot "+str(t_id)+" average score off by "+
+                 "{0:.3f}".format(diff))
+        mismatches[engine] = found
+    return mismatches
+
+
+if __name__ == "__main__":
+
+    # python benchmarks.py [history file] [threshold]
+    # (the default history file is kept next to this module, and ignored by
+    # git, so it is the same one wherever this is run from)
+    history_path = os.path.join(HERE, "benchmark_history.jsonl")
+    if len(sys.argv) > 1:
+        history_path = sys.argv[1]
+    threshold = 0.2
+    if len(sys.argv) > 2:
+        threshold = float(sys.argv[2])
+
+    records, regressions = run_baselines(history_path, threshold=threshold)
+    for record in records:
+        print("{0:<12} {1:<10} {2:>10.0f} turns/s  scoring {3:.3f}s  "
+         "morality {4:.3f}s  peak mem {5:.1f}MB".format(record['workload'],
+         record['engine'], record['turns_per_second'],
+         record['scoring_seconds'], record['morality_seconds'],
+         (record['peak_memory_bytes'] or 0)/1e6))
+    for (name, engine), found in sorted(regressions.items()):
+        for r in found:
+            print("REGRESSION {0} {1}: {2} {3:.3g} -> {4:.3g} "
+             "({5:+.0%})".format(name, engine, r['measurement'],
+             r['baseline'], r['value'], r['change']))
+
+    failed = bool(regressions)
+    for name in WORKLOADS:
+        for engine, found in sorted(check_equivalence(name).items()):
+            status = "ok" if not found else "; ".join(found[:5])
+            print("equivalence {0} {1}: {2}".format(name, engine, status))
+            failed = failed or bool(found)
+
+    if failed:
+        sys.exit(1)
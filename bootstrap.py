@@ -0,0 +1,217 @@
+########
+##
+## Bootstrap confidence intervals for the morality metrics, resampling the
+## meetings of every pair and recomputing the metrics for all resamples at
+## once
+##
+########
+
+
+import random
+
+import numpy as np
+
+import batch_morality as bm
+import tournament_results as tr
+
+
+## metric names, as keyed in BatchMoralityCalculator.get_metrics
+METRICS = ['cooperation_rates', 'bigger_man_scores', 'eigenjesus_scores',
+ 'eigenmoses_scores']
+
+
+def meeting_cooperation_arrays(tourney_res):
+    """
+    Per meeting cooperation counts of every pair, padded to the largest
+    number of meetings
+
+    ARGS:
+    - tourney_res: TournamentResults object (its meetings can be lists of
+    moves or anything with a joint_move_counts method)
+
+    RETURNS:
+    - pairs: numpy array of shape (P, 2) of the played pairs
+    - coops: numpy array of shape (P, M, 2), each bot's cooperations in each
+    meeting of the pair
+    - lengths: numpy array of shape (P, M), the length of each meeting (0
+    past the pair's last one)
+    - num_meetings: numpy array of shape (P,), meetings played by each pair
+    """
+    pairs = sorted(tourney_res.get_played_pairs())
+    max_meetings = max([tourney_res.get_num_meetings(i, j)
+     for i, j in pairs])
+    coops = np.zeros((len(pairs), max_meetings, 2))
+    lengths = np.zeros((len(pairs), max_meetings))
+    num_meetings = np.zeros(len(pairs), dtype=np.intp)
+    for p, (i, j) in enumerate(pairs):
+        meetings = tourney_res.get_interactions(i, j)
+        num_meetings[p] = len(meetings)
+        for m, meeting in enumerate(meetings):
+            coops[p, m] = tr.cooperation_counts(meeting)
+            lengths[p, m] = len(meeting)
+    return np.array(pairs, dtype=np.intp), coops, lengths, num_meetings
+
+
+class BootstrapMorality(object):
+    """
+    Percentile bootstrap intervals for every MoralityCalculator metric of
+    every bot. Each resample redraws, for every pair, as many meetings as the
+    pair played from its own meetings with replacement; the resampled
+    cooperation matrices are stacked and the metrics recomputed with the
+    batched functions of batch_morality.
+    """
+    def __init__(self, tourney_res, num_resamples=1000, confidence=0.95,
+                    iters=100, chunk_size=100, seed=None):
+        """
+        ARGS:
+        - tourney_res: TournamentResults object of a round-robin
+        - num_resamples: number of bootstrap resamples B
+        - confidence: coverage of the intervals
+        - iters: number of power iterations for the eigenvector metrics
+        - chunk_size: number of resamples stacked at once, to bound memory
+        - seed: seed for the resampling, default drawn from the global
+        generator
+        """
+        if not tourney_res.is_round_robin():
+            raise ValueError("bootstrapping needs a round-robin tournament")
+        if not (0 < confidence < 1):
+            raise ValueError("confidence must be between 0 and 1")
+        self.tourney_res = tourney_res
+        self.num_resamples = num_resamples
+        self.confidence = confidence
+        self.iters = iters
+        self.chunk_size = chunk_size
+        if seed is None:
+            seed = random.randint(0, 2**31-1)
+        self.rng = np.random.RandomState(seed)
+        self.num_bots = len(tourney_res.get_bot_list())
+
+        self.pairs, self.coops, self.lengths, self.num_meetings =\
+         meeting_cooperation_arrays(tourney_res)
+
+        # metric => numpy array of shape (N,) from the actual meetings
+        self.estimates = None
+        # metric => numpy array of shape (B, N), one row per resample
+        self.samples = None
+        # metric => numpy array of shape (N, 2) of (low, high)
+        self.intervals = None
+        self.calculate_all()
+
+    def metrics_from_sums(self, turns, coops):
+        """
+        Calculate every metric for a stack of resampled tournaments
+
+        ARGS:
+        - turns: numpy array of shape (B, P), turns played by each pair in
+        each resample
+        - coops: numpy array of shape (B, P, 2), each bot's cooperations over
+        those turns
+
+        RETURNS:
+        - metrics: dictionary of metric => numpy array of shape (B, N)
+        """
+        num_stack = turns.shape[0]
+        rates = coops/turns[:, :, None]
+        coop_matrices = np.zeros((num_stack, self.num_bots, self.num_bots))
+        # the second bot's rate goes in last, so for a bot paired with its
+        # own clone the entry ends up as in MoralityCalculator
+        coop_matrices[:, self.pairs[:, 0], self.pairs[:, 1]] = rates[:, :, 0]
+        coop_matrices[:, self.pairs[:, 1], self.pairs[:, 0]] = rates[:, :, 1]
+        coop_rates, bigger_man = bm.batched_cooperation_stuff(coop_matrices)
+        eigenjesus, eigenmoses =\
+         bm.batched_network_morality(coop_matrices, self.iters)
+        return {
+            'cooperation_rates': coop_rates,
+            'bigger_man_scores': bigger_man,
+            'eigenjesus_scores': eigenjesus,
+            'eigenmoses_scores': eigenmoses
+        }
+
+    def resample_sums(self, num_stack):
+        """
+        Draw num_stack resamples
+
+        RETURNS:
+        - turns, coops: as taken by metrics_from_sums
+        """
+        num_pairs, max_meetings = self.lengths.shape
+        # draw a meeting for every slot, each pair drawing only among its own
+        # meetings; slots past a pair's number of meetings draw its padding,
+        # which adds nothing
+        draws = (self.rng.random_sample((num_stack, num_pairs, max_meetings))*
+         self.num_meetings[None, :, None]).astype(np.intp)
+        draws[:, self.slot_unused] = max_meetings
+        flat = draws+self.pair_starts[None, :, None]
+        # one gather per slot adds up faster than summing over the slot axis
+        sums = np.zeros((num_stack, num_pairs, 3))
+        for m in xrange(max_meetings):
+            sums += self.padded_meetings[flat[:, :, m]]
+        return sums[:, :, 0], sums[:, :, 1:]
+
+    def calculate_all(self):
+        """
+        STORES:
+        - estimates, samples, intervals: see __init__
+        """
+        num_pairs, max_meetings = self.lengths.shape
+        # (length, bot1 coops, bot2 coops) of every pair's meetings followed
+        # by one empty meeting, flattened, so a resample is a gather of
+        # pair_starts[p]+meeting index
+        meetings = np.concatenate([self.lengths[:, :, None], self.coops],
+         axis=2)
+        self.padded_meetings = np.concatenate(
+            [meetings, np.zeros((num_pairs, 1, 3))], axis=1
+        ).reshape((-1, 3))
+        self.pair_starts = np.arange(num_pairs)*(max_meetings+1)
+        self.slot_unused = np.arange(max_meetings)[None, :] >=\
+         self.num_meetings[:, None]
+
+        self.estimates = dict([(metric, values[0]) for metric, values in
+         self.metrics_from_sums(self.lengths.sum(axis=1)[None],
+         self.coops.sum(axis=1)[None]).items()])
+        chunks = []
+        done = 0
+        while done < self.num_resamples:
+            num_stack = min(self.chunk_size, self.num_resamples-done)
+            chunks.append(
+                self.metrics_from_sums(*self.resample_sums(num_stack))
+            )
+            done += num_stack
+        self.samples = dict([(metric, np.concatenate(
+         [chunk[metric] for chunk in chunks])) for metric in METRICS])
+        tail = 100*(1-self.confidence)/2.0
+        self.intervals = dict([(metric, np.percentile(self.samples[metric],
+         [tail, 100-tail], axis=0).T) for metric in METRICS])
+
+
+    #####
+    # Getter methods
+    #####
+
+    def get_estimate_by_id(self, metric, bot_id):
+        return self.estimates[metric][bot_id]
+
+    def get_interval_by_id(self, metric, bot_id):
+        """
+        RETURNS:
+        - (low, high): the bootstrap interval of the bot's metric
+        """
+        low, high = self.intervals[metric][bot_id]
+        return low, high
+
+    def get_stderr_by_id(self, metric, bot_id):
+        return self.samples[metric][:, bot_id].std(ddof=1)
+
+    def get_intervals(self, metric):
+        """
+        RETURNS:
+        - intervals: dictionary of bot id => (estimate, low, high)
+        """
+        return dict([(bot_id, (self.estimates[metric][bot_id],
+         self.intervals[metric][bot_id][0],
+         self.intervals[metric][bot_id][1]))
+         for bot_id in xrange(self.num_bots)])
+
+
+if __name__ == "__main__":
+    pass
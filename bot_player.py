@@ -12,7 +12,13 @@ class BotPlayer(object):
     self.name is the name of the strategy employed
     self.description is an explanation of the strategy
     self.tournament_id can be assigned upon beginning each tournament
+    memory_depth is how many of the most recent turns getNextMove looks at,
+    or None if it may look at the whole history. A bot with memory_depth k
+    must decide only from the last k turns (and from how many turns there have
+    been, while there are fewer than k)
     """
+    memory_depth = None
+
     def __init__(self, name, description=None):
         self.name = name
         self.description = description
@@ -0,0 +1,193 @@
+########
+##
+## Append-only checkpoints of a running tournament, so a crashed run can be
+## resumed where it left off
+##
+########
+
+
+import json
+import os
+import random
+
+import history
+
+
+## A checkpoint file is JSON lines, only ever appended to:
+## - one "header" record with the roster, the tournament settings, the
+##   interaction lengths and the RNG state right after they were drawn
+## - "pair" records, each with a pair and its encoded meetings
+## - after every batch of pairs, a "mark" record with the RNG state at that
+##   point, written together with the batch and then flushed
+## Pairs after the last mark (from a write cut short by a crash) are ignored
+## on resume and played again, and cut off the file before it is appended to.
+
+
+#####
+# Meeting encoding
+#####
+
+def encode_meeting(meeting):
+    """
+    Encode a meeting as a string of joint move codes (one character per
+    turn), or as its counts if it is a MeetingTally
+    """
+    if isinstance(meeting, history.MeetingTally):
+        return {'counts': list(meeting.joint_move_counts())}
+    if isinstance(meeting, history.CompactMeeting):
+        return ''.join([str(c) for c in bytearray(meeting.codes)])
+    return ''.join([str(history.JOINT_CODES[turn]) for turn in meeting])
+
+def decode_meeting(encoded, compact=False):
+    """
+    Inverse of encode_meeting
+
+    ARGS:
+    - encoded: the encoded meeting
+    - compact: whether to rebuild a CompactMeeting instead of a list of
+    move tuples
+    """
+    if isinstance(encoded, dict):
+        meeting = history.MeetingTally()
+        meeting.counts = list(encoded['counts'])
+        meeting.num_turns = sum(meeting.counts)
+        return meeting
+    codes = bytearray([int(c) for c in encoded])
+    if compact:
+        return history.CompactMeeting(codes)
+    return [history.JOINT_MOVES[c] for c in codes]
+
+def encode_rng_state(state):
+    return [state[0], list(state[1]), state[2]]
+
+def decode_rng_state(state):
+    return (state[0], tuple(state[1]), state[2])
+
+
+class CheckpointWriter(object):
+    """
+    Buffers finished pairs in memory and appends them to the checkpoint file
+    one batch at a time
+    """
+    def __init__(self, path, resume_offset=None, fsync=False):
+        """
+        ARGS:
+        - path: checkpoint file
+        - resume_offset: to resume a run, the offset read_checkpoint returned:
+        the file is cut off there and appended to. By default the file is
+        started over.
+        - fsync: whether to force each batch to disk (safer, but slower)
+        """
+        self.path = path
+        self.fsync = fsync
+        if resume_offset is None:
+            self.f = open(path, 'wb')
+        else:
+            self.f = open(path, 'r+b')
+            self.f.truncate(resume_offset)
+            self.f.seek(0, os.SEEK_END)
+        self.buffer = []
+
+    def write_record(self, record):
+        self.buffer.append(json.dumps(record)+"\n")
+
+    def write_header(self, botList, numMeetings, payoffs, w,
+                    interaction_lengths):
+        self.write_record({
+            'type': 'header',
+            'roster': [[bot.name, bot.__class__.__name__] for bot in botList],
+            'num_meetings': numMeetings,
+            'payoffs': payoffs,
+            'w': w,
+            'interaction_lengths': interaction_lengths,
+            'rng_state': encode_rng_state(random.getstate())
+        })
+        self.flush()
+
+    def write_pair(self, pair, meetings):
+        self.write_record({
+            'type': 'pair',
+            'pair': list(pair),
+            'meetings': [encode_meeting(m) for m in meetings]
+        })
+
+    def write_mark(self):
+        """
+        Close off the batch of pairs written since the last mark, recording
+        the RNG state to resume from, and flush it
+        """
+        self.write_record({
+            'type': 'mark',
+            'rng_state': encode_rng_state(random.getstate())
+        })
+        self.flush()
+
+    def flush(self):
+        self.f.write(''.join(self.buffer))
+        self.buffer = []
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def read_checkpoint(path, compact=False):
+    """
+    Read a checkpoint file up to its last mark
+
+    ARGS:
+    - path: checkpoint file
+    - compact: whether to decode meetings as CompactMeetings
+
+    RETURNS:
+    - header: the header record
+    - interactions: dictionary of (id_1, id_2) => decoded meetings, for every
+    pair up to the last mark (after the last header, if the file was started
+    over more than once)
+    - rng_state: RNG state to resume from
+    - offset: where in the file the last mark (or the header, before any)
+    ends, so where to carry on writing from
+    """
+    header = None
+    interactions = {}
+    pending = {}
+    rng_state = None
+    offset = 0
+    read_to = 0
+    f = open(path, 'rb')
+    try:
+        for line in f:
+            if not line.endswith("\n"):
+                # the tail of a write cut short by a crash
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            read_to += len(line)
+            if record['type'] == 'header':
+                header = record
+                interactions = {}
+                pending = {}
+                rng_state = decode_rng_state(record['rng_state'])
+                offset = read_to
+            elif record['type'] == 'pair':
+                pending[tuple(record['pair'])] =\
+                 [decode_meeting(m, compact) for m in record['meetings']]
+            elif record['type'] == 'mark':
+                interactions.update(pending)
+                pending = {}
+                rng_state = decode_rng_state(record['rng_state'])
+                offset = read_to
+    finally:
+        f.close()
+    if header is None:
+        raise ValueError("no checkpoint header in "+path)
+    return header, interactions, rng_state, offset
+
+
+if __name__ == "__main__":
+    pass
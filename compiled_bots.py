@@ -0,0 +1,370 @@
+########
+##
+## Compile bots with a bounded memory into decision tables, and play
+## tournaments between them without calling getNextMove every turn
+##
+########
+
+
+import random
+
+import numpy as np
+
+import arena
+import history
+
+
+## joint moves are coded as in history, from one bot's point of view
+JOINT_MOVES = history.JOINT_MOVES
+
+## the same joint move seen from the partner's side
+SWAPPED_CODES = np.array([0, 2, 1, 3], dtype=np.intp)
+
+
+#####
+# State space
+#####
+
+def state_offsets(depth):
+    """
+    A state is the number of turns played so far (capped at depth) together
+    with the codes of the last min(turns, depth) joint moves. States with m
+    remembered turns take up indices offsets[m] to offsets[m]+4^m-1.
+
+    RETURNS:
+    - offsets: list of depth+2 integers, the last one being the number of
+    states
+    """
+    offsets = [0]
+    for m in xrange(depth+1):
+        offsets.append(offsets[-1]+4**m)
+    return offsets
+
+def num_states(depth):
+    return state_offsets(depth)[-1]
+
+def state_histories(depth):
+    """
+    Yield (state index, past_moves) for every state, where past_moves is a
+    list of joint move tuples that leads to that state
+    """
+    offsets = state_offsets(depth)
+    for m in xrange(depth+1):
+        for code in xrange(4**m):
+            past_moves = []
+            rest = code
+            for _ in xrange(m):
+                past_moves.append(JOINT_MOVES[rest % 4])
+                rest //= 4
+            past_moves.reverse()
+            yield offsets[m]+code, past_moves
+
+def next_state_table(depth):
+    """
+    RETURNS:
+    - next_state: numpy array of shape (num_states, 4), next_state[s][c] is
+    the state after joint move c is played in state s
+    """
+    offsets = state_offsets(depth)
+    next_state = np.zeros((num_states(depth), 4), dtype=np.intp)
+    for m in xrange(depth+1):
+        for code in xrange(4**m):
+            for c in xrange(4):
+                if m < depth:
+                    next_state[offsets[m]+code][c] = offsets[m+1]+code*4+c
+                else:
+                    next_state[offsets[m]+code][c] =\
+                     offsets[m]+(code*4+c) % 4**depth
+    return next_state
+
+
+#####
+# Compilation
+#####
+
+class RandomProbe(object):
+    """
+    Stands in for random.random while probing a bot, feeding it a chosen
+    value and counting how many draws it makes
+    """
+    def __init__(self, value):
+        self.value = value
+        self.draws = 0
+
+    def __call__(self):
+        self.draws += 1
+        return self.value
+
+def probe_move(bot, past_moves, payoffs, w, value):
+    real_random = random.random
+    probe = RandomProbe(value)
+    random.random = probe
+    try:
+        move = bot.getNextMove(list(past_moves), payoffs=payoffs, w=w)
+    finally:
+        random.random = real_random
+    return move, probe.draws
+
+def cooperation_probability(bot, past_moves, payoffs, w, samples):
+    """
+    Find the probability that bot cooperates after past_moves
+
+    Bots that draw at most one random number and compare it against a
+    threshold (as RANDOM, GENEROUS_TIT_FOR_TAT and JOSS do) are bisected for
+    the exact threshold. Any other use of randomness falls back to sampling.
+    """
+    low_move, low_draws = probe_move(bot, past_moves, payoffs, w, 0.0)
+    high_value = 1.0-2.0**-53
+    high_move, high_draws =\
+     probe_move(bot, past_moves, payoffs, w, high_value)
+    if low_draws == 0 and high_draws == 0:
+        # deterministic in this state
+        return float(low_move == 'C')
+    if low_draws == 1 and high_draws == 1:
+        if low_move == high_move:
+            return float(low_move == 'C')
+        # find where the decision flips, between lo and hi
+        lo, hi = 0.0, high_value
+        for _ in xrange(60):
+            mid = (lo+hi)/2.0
+            if probe_move(bot, past_moves, payoffs, w, mid)[0] == low_move:
+                lo = mid
+            else:
+                hi = mid
+        if low_move == 'C':
+            return hi
+        return 1.0-hi
+    coops = 0
+    for _ in xrange(samples):
+        if bot.getNextMove(list(past_moves), payoffs=payoffs, w=w) == 'C':
+            coops += 1
+    return coops/float(samples)
+
+
+class DecisionTable(object):
+    """
+    A bot's cooperation probability in every state of its bounded memory
+    """
+    def __init__(self, depth, coop_probs):
+        """
+        ARGS:
+        - depth: the bot's memory depth
+        - coop_probs: numpy array with the cooperation probability for each
+        state index
+        """
+        self.depth = depth
+        self.coop_probs = coop_probs
+
+    def is_deterministic(self):
+        return bool(np.all((self.coop_probs == 0) | (self.coop_probs == 1)))
+
+    def lift(self, depth):
+        """
+        Re-express the table over the states of a deeper memory, so tables of
+        different depths can be stacked
+
+        RETURNS:
+        - coop_probs: numpy array with a probability per state of depth
+        """
+        offsets = state_offsets(self.depth)
+        lifted = []
+        for m in xrange(depth+1):
+            m_own = min(m, self.depth)
+            for code in xrange(4**m):
+                lifted.append(
+                    self.coop_probs[offsets[m_own]+code % 4**m_own]
+                )
+        return np.array(lifted)
+
+def compile_bot(bot, payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995,
+                    samples=10000):
+    """
+    Probe bot.getNextMove over all 4^k recent histories (and the shorter
+    ones of the first k turns) to build its DecisionTable
+
+    ARGS:
+    - bot: a BotPlayer with memory_depth k declared
+    - payoffs, w: the tournament settings the table is compiled for
+    - samples: number of calls used to estimate a probability when the bot's
+    randomness can't be probed exactly
+
+    RETURNS:
+    - table: DecisionTable for the bot, or None if it has no memory_depth
+    """
+    depth = bot.memory_depth
+    if depth is None:
+        return None
+    coop_probs = np.zeros(num_states(depth))
+    for state, past_moves in state_histories(depth):
+        coop_probs[state] =\
+         cooperation_probability(bot, past_moves, payoffs, w, samples)
+    return DecisionTable(depth, coop_probs)
+
+
+#####
+# Table engine
+#####
+
+class TableEngine(object):
+    """
+    Plays meetings between compiled bots, all pairs at once, by looking up
+    every bot's move in a stacked table of cooperation probabilities
+    """
+    def __init__(self, tables, seed=None):
+        """
+        ARGS:
+        - tables: list of DecisionTable objects, indexed like the bots
+        - seed: seed for the engine's random draws
+        """
+        self.depth = max([t.depth for t in tables])
+        self.coop_probs = np.array([t.lift(self.depth) for t in tables])
+        self.next_state = next_state_table(self.depth)
+        self.rng = np.random.RandomState(seed)
+
+    def play_meeting_codes(self, idx1, idx2, interaction_length):
+        """
+        Play one meeting for every pair at once
+
+        ARGS:
+        - idx1, idx2: numpy arrays of table indices, one entry per pair
+        - interaction_length: number of turns in the meeting
+
+        RETURNS:
+        - codes: numpy array of shape (interaction_length, num_pairs) holding
+        the joint move codes from the first bot's point of view
+        """
+        num_pairs = len(idx1)
+        codes = np.zeros((interaction_length, num_pairs), dtype=np.uint8)
+        state1 = np.zeros(num_pairs, dtype=np.intp)
+        state2 = np.zeros(num_pairs, dtype=np.intp)
+        for t in xrange(interaction_length):
+            defect1 = self.rng.random_sample(num_pairs) >=\
+             self.coop_probs[idx1, state1]
+            defect2 = self.rng.random_sample(num_pairs) >=\
+             self.coop_probs[idx2, state2]
+            code1 = 2*defect1+defect2
+            codes[t] = code1
+            state1 = self.next_state[state1, code1]
+            state2 = self.next_state[state2, SWAPPED_CODES[code1]]
+        return codes
+
+    def play_meeting_counts(self, idx1, idx2, interaction_length):
+        """
+        Same as play_meeting_codes, but keeps only how many turns of each
+        joint move every pair played, so memory doesn't grow with the meeting
+
+        RETURNS:
+        - counts: numpy array of shape (num_pairs, 4) of (CC, CD, DC, DD)
+        counts from the first bot's point of view
+        """
+        num_pairs = len(idx1)
+        counts = np.zeros((num_pairs, 4), dtype=np.int64)
+        rows = np.arange(num_pairs)
+        state1 = np.zeros(num_pairs, dtype=np.intp)
+        state2 = np.zeros(num_pairs, dtype=np.intp)
+        for t in xrange(interaction_length):
+            defect1 = self.rng.random_sample(num_pairs) >=\
+             self.coop_probs[idx1, state1]
+            defect2 = self.rng.random_sample(num_pairs) >=\
+             self.coop_probs[idx2, state2]
+            code1 = 2*defect1+defect2
+            counts[rows, code1] += 1
+            state1 = self.next_state[state1, code1]
+            state2 = self.next_state[state2, SWAPPED_CODES[code1]]
+        return counts
+
+    def play_pairs(self, pairs, interaction_lengths):
+        """
+        RETURNS:
+        - interactions: dictionary of pair => list of CompactMeetings, one per
+        meeting
+        """
+        interactions = dict([(pair, []) for pair in pairs])
+        if not pairs:
+            return interactions
+        idx1 = np.array([pair[0] for pair in pairs], dtype=np.intp)
+        idx2 = np.array([pair[1] for pair in pairs], dtype=np.intp)
+        for interaction_length in interaction_lengths:
+            codes = self.play_meeting_codes(idx1, idx2, interaction_length)
+            # one contiguous row of codes per pair
+            codes = np.ascontiguousarray(codes.T)
+            for p, pair in enumerate(pairs):
+                interactions[pair].append(
+                    history.CompactMeeting(bytearray(codes[p].tobytes()))
+                )
+        return interactions
+
+
+class CompiledArena(arena.Arena):
+    """
+    Arena that compiles every bot declaring a memory_depth and plays the
+    pairs of compiled bots with a TableEngine. Pairs involving any other bot
+    are played the usual way.
+    """
+    def __init__(self, samples=10000, seed=None, **kwargs):
+        """
+        ARGS:
+        - samples: see compile_bot
+        - seed: seed for the table engines' draws, which come from a
+        generator of the arena's own so that the pairs played the usual way
+        draw the same numbers from the global generator as in a plain Arena
+        (default seeded from the system, so pass one for reproducible
+        compiled pairs)
+        - kwargs: passed on to Arena
+        """
+        arena.Arena.__init__(self, **kwargs)
+        self.samples = samples
+        self.rng = random.Random(seed)
+        # (id(bot), payoffs, w) => (bot, DecisionTable), so a roster is
+        # compiled once even over several tournaments. The bot is kept so
+        # its id can't be reused by another bot while the entry exists.
+        self.tables = {}
+
+    def get_table(self, bot, payoffs, w):
+        if bot.memory_depth is None:
+            return None
+        key = (id(bot), tuple(sorted(payoffs.items())), w)
+        entry = self.tables.get(key)
+        if entry is None or entry[0] is not bot:
+            # bots that fall back to sampling draw from the global generator,
+            # so put it back as it was
+            state = random.getstate()
+            try:
+                table = compile_bot(bot, payoffs=payoffs, w=w,
+                 samples=self.samples)
+            finally:
+                random.setstate(state)
+            entry = self.tables[key] = (bot, table)
+        return entry[1]
+
+    def play_pairs(self, botList, pairs, interaction_lengths,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+        tables = [self.get_table(bot, payoffs, w) for bot in botList]
+        compiled_pairs = [pair for pair in pairs
+         if tables[pair[0]] is not None and tables[pair[1]] is not None]
+        other_pairs = [pair for pair in pairs
+         if tables[pair[0]] is None or tables[pair[1]] is None]
+
+        interactions = arena.Arena.play_pairs(self, botList, other_pairs,
+         interaction_lengths, payoffs=payoffs, w=w)
+        if compiled_pairs:
+            # bots that didn't compile still need a row in the stacked table
+            placeholder = DecisionTable(0, np.ones(1))
+            engine = TableEngine(
+                [t if t is not None else placeholder for t in tables],
+                seed=self.rng.randint(0, 2**31-1)
+            )
+            compiled_interactions =\
+             engine.play_pairs(compiled_pairs, interaction_lengths)
+            if self.turn_dynamics is not None:
+                for pair, meetings in compiled_interactions.items():
+                    for meeting in meetings:
+                        self.turn_dynamics.add_meeting_codes(pair[0],
+                         pair[1], meeting.codes)
+            interactions.update(compiled_interactions)
+            self.report_pairs_finished(len(compiled_pairs))
+        return interactions
+
+
+if __name__ == "__main__":
+    pass
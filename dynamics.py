@@ -0,0 +1,165 @@
+########
+##
+## How cooperation and scores go over the course of a meeting, tallied per
+## bot and turn while the tournament is played
+##
+########
+
+
+import numpy as np
+
+import history
+
+
+## a joint move code from the other bot's point of view
+SWAPPED_CODES = (0, 2, 1, 3)
+
+
+class TurnDynamics(object):
+    """
+    Counts of each joint move (CC, CD, DC, DD, from the bot's point of view)
+    at each turn of a meeting, summed over all of every bot's meetings. Turns
+    are binned: turn t falls in bin t/bin_width, and every turn past the last
+    bin's start falls in the last bin, so the counts take the same memory
+    however long the meetings get.
+    """
+    def __init__(self, num_bins=100, bin_width=1):
+        """
+        ARGS:
+        - num_bins: number of bins per bot
+        - bin_width: number of turns per bin
+        """
+        if int(num_bins) != num_bins or num_bins < 1:
+            raise ValueError("num_bins must be a positive integer")
+        if int(bin_width) != bin_width or bin_width < 1:
+            raise ValueError("bin_width must be a positive integer")
+        self.num_bins = int(num_bins)
+        self.bin_width = int(bin_width)
+        # bot id => flat list, counts[4*bin+code]
+        self.counts = {}
+
+    def reset(self):
+        self.counts = {}
+
+    def copy(self):
+        dynamics = self.empty_copy()
+        dynamics.counts = dict([(bot_id, list(counts))
+         for bot_id, counts in self.counts.items()])
+        return dynamics
+
+    def empty_copy(self):
+        """
+        RETURNS:
+        - a TurnDynamics with the same bins and no counts, e.g. for a worker
+        process whose counts get merged back
+        """
+        return TurnDynamics(num_bins=self.num_bins, bin_width=self.bin_width)
+
+    def get_bot_counts(self, bot_id):
+        counts = self.counts.get(bot_id)
+        if counts is None:
+            counts = self.counts[bot_id] = [0]*(4*self.num_bins)
+        return counts
+
+    def add_turn(self, id_1, id_2, turn_index, turn):
+        """
+        Count one turn of a meeting, for both bots (only once for a bot
+        paired with its clone, as its total score counts it)
+
+        ARGS:
+        - id_1, id_2: tournament ids of the bots
+        - turn_index: which turn of the meeting it was, from 0
+        - turn: the joint move (id_1's move, id_2's move)
+        """
+        code = history.JOINT_CODES[turn]
+        b = turn_index//self.bin_width
+        if b >= self.num_bins:
+            b = self.num_bins-1
+        self.get_bot_counts(id_1)[4*b+code] += 1
+        if id_2 != id_1:
+            self.get_bot_counts(id_2)[4*b+SWAPPED_CODES[code]] += 1
+
+    def add_meeting_codes(self, id_1, id_2, codes):
+        """
+        Count a whole meeting at once, from its joint move codes
+
+        ARGS:
+        - codes: numpy array (or bytes-like object) of id_1's joint move
+        codes, one per turn
+        """
+        codes = np.frombuffer(codes, dtype=np.uint8)
+        bins = np.minimum(np.arange(len(codes))//self.bin_width,
+         self.num_bins-1)
+        for bot_id, bot_codes in ((id_1, codes),
+         (id_2, np.array(SWAPPED_CODES, dtype=np.uint8)[codes])):
+            meeting_counts = np.bincount(4*bins+bot_codes,
+             minlength=4*self.num_bins)
+            counts = self.get_bot_counts(bot_id)
+            for k in np.nonzero(meeting_counts)[0]:
+                counts[k] += int(meeting_counts[k])
+            if id_2 == id_1:
+                break
+
+    def merge(self, other):
+        """
+        Add another TurnDynamics' counts (with the same bins) into these
+        """
+        if (other.num_bins, other.bin_width) !=\
+         (self.num_bins, self.bin_width):
+            raise ValueError("can only merge TurnDynamics with the same bins")
+        for bot_id, other_counts in other.counts.items():
+            counts = self.get_bot_counts(bot_id)
+            for k, c in enumerate(other_counts):
+                counts[k] += c
+
+
+    #####
+    # Getter methods
+    #####
+
+    def get_bin_starts(self):
+        """
+        RETURNS:
+        - numpy array of the first turn of each bin
+        """
+        return np.arange(self.num_bins)*self.bin_width
+
+    def get_counts_by_id(self, bot_id):
+        """
+        RETURNS:
+        - counts: numpy array of shape (num_bins, 4) of the bot's (CC, CD,
+        DC, DD) counts in each bin
+        """
+        return np.array(self.get_bot_counts(bot_id),
+         dtype=np.int64).reshape((self.num_bins, 4))
+
+    def get_turns_by_id(self, bot_id):
+        return self.get_counts_by_id(bot_id).sum(axis=1)
+
+    def get_cooperation_curve_by_id(self, bot_id):
+        """
+        RETURNS:
+        - numpy array of the bot's cooperation rate in each bin, NaN for a
+        bin none of its meetings reached
+        """
+        counts = self.get_counts_by_id(bot_id)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (counts[:, 0]+counts[:, 1])/counts.sum(axis=1).astype(
+                float
+            )
+
+    def get_score_curve_by_id(self, bot_id, payoffs):
+        """
+        RETURNS:
+        - numpy array of the bot's average score per turn in each bin, NaN
+        for a bin none of its meetings reached
+        """
+        counts = self.get_counts_by_id(bot_id)
+        scores = np.array([payoffs['R'], payoffs['S'], payoffs['T'],
+         payoffs['P']], dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return counts.dot(scores)/counts.sum(axis=1)
+
+
+if __name__ == "__main__":
+    pass
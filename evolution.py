@@ -0,0 +1,285 @@
+########
+##
+## Evolve the parameters of parameterized bots against a fixed roster of
+## opponents, for both score and morality
+##
+########
+
+
+import multiprocessing
+import random
+
+import numpy as np
+
+import arena
+import history
+import the_bots
+import tournament_results as tr
+import morality_calculator as mc
+
+
+## family name => (bot class, number of parameters); a candidate is a
+## vector of parameters in [0, 1] passed to the class in order
+FAMILIES = {
+    'RANDOM': (the_bots.RANDOM, 1),
+    'GENEROUS_TIT_FOR_TAT': (the_bots.GENEROUS_TIT_FOR_TAT, 1),
+    'JOSS': (the_bots.JOSS, 1),
+    'MEMORY_ONE': (the_bots.MEMORY_ONE, 5)
+}
+
+## fitness terms other than score, by name => MoralityCalculator getter
+MORALITY_METRICS = {
+    'coop_rate': mc.MoralityCalculator.get_coop_rate_by_id,
+    'good_partner': mc.MoralityCalculator.get_good_partner_by_id,
+    'eigenjesus': mc.MoralityCalculator.get_eigenjesus_by_id,
+    'eigenmoses': mc.MoralityCalculator.get_eigenmoses_by_id
+}
+
+
+def make_bot(family, params):
+    """
+    Build the bot a candidate stands for
+
+    ARGS:
+    - family: key of FAMILIES
+    - params: sequence of parameters in [0, 1]
+    """
+    cls, _ = FAMILIES[family]
+    return cls(*[round(float(p), 6) for p in params])
+
+def compact_meetings(meetings):
+    """
+    Store meetings as CompactMeetings with their counts, so scoring them
+    again for every candidate costs O(1) per meeting
+    """
+    compact = []
+    for meeting in meetings:
+        codes = bytearray([history.JOINT_CODES[turn] for turn in meeting])
+        compact.append(history.CompactMeeting(codes,
+         counts=tuple([codes.count(b) for b in history.CODE_BYTES])))
+    return compact
+
+
+#####
+# Fitness
+#####
+
+class FitnessEvaluator(object):
+    """
+    Scores candidates by putting each one into a tournament with the fixed
+    roster. The roster's games against each other don't depend on the
+    candidate, so they are played once and reused; only the candidate's own
+    pairs are played per evaluation. Every evaluation uses the same
+    interaction lengths, so candidates are compared on equal terms.
+    """
+    def __init__(self, roster, numMeetings=5,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995,
+                    score_weight=1.0, metric_weights=None):
+        """
+        ARGS:
+        - roster: list of opponent bots
+        - numMeetings: meetings per pair
+        - payoffs, w: as for Arena.runTournament
+        - score_weight: weight of the candidate's average score per turn,
+        divided by R so full mutual cooperation counts as 1
+        - metric_weights: dictionary of MORALITY_METRICS name => weight
+        """
+        self.roster = roster
+        self.payoffs = payoffs
+        self.w = w
+        self.score_weight = score_weight
+        self.metric_weights = dict(metric_weights or {})
+        for name in self.metric_weights:
+            if name not in MORALITY_METRICS:
+                raise ValueError("metric_weights keys must be among "+
+                 str(sorted(MORALITY_METRICS.keys())))
+
+        self.arena = arena.Arena()
+        self.interaction_lengths =\
+         self.arena.generate_interaction_lengths(w, numMeetings)
+        for t_id, bot in enumerate(roster):
+            bot.tournament_id = t_id
+        n = len(roster)
+        pairs = [(i, j) for i in xrange(n) for j in xrange(i, n)]
+        self.roster_interactions = dict([(pair, compact_meetings(meetings))
+         for pair, meetings in self.arena.play_pairs(roster, pairs,
+         self.interaction_lengths, payoffs=payoffs, w=w).items()])
+
+    def evaluate(self, family, params, seed=None):
+        """
+        RETURNS:
+        - fitness: the weighted sum of score and morality metrics
+        - terms: dictionary of 'score' and each weighted metric => value
+        """
+        candidate = make_bot(family, params)
+        botList = self.roster+[candidate]
+        c_id = len(self.roster)
+        for t_id, bot in enumerate(botList):
+            bot.tournament_id = t_id
+        interactions = dict(self.roster_interactions)
+        # the bots draw from the global generator, so a seed is only applied
+        # while they play, and the caller's state is put back afterwards
+        if seed is not None:
+            state = random.getstate()
+            random.seed(seed)
+        try:
+            for j in xrange(c_id+1):
+                interactions[(j, c_id)] = compact_meetings(
+                    self.arena.play_pair(botList[j], candidate,
+                     self.interaction_lengths, payoffs=self.payoffs, w=self.w)
+                )
+        finally:
+            if seed is not None:
+                random.setstate(state)
+        tourney_res = tr.TournamentResults(botList, interactions,
+         self.payoffs)
+        terms = {
+            'score': tourney_res.get_avg_score_by_id(c_id)/\
+             float(self.payoffs['R'])
+        }
+        fitness = self.score_weight*terms['score']
+        if self.metric_weights:
+            morality = mc.MoralityCalculator(tourney_res)
+            for name, weight in self.metric_weights.items():
+                terms[name] = float(MORALITY_METRICS[name](morality, c_id))
+                fitness += weight*terms[name]
+        return fitness, terms
+
+
+## the evaluator of each worker process, set once by init_worker
+_worker = {}
+
+def init_worker(evaluator):
+    _worker['evaluator'] = evaluator
+
+def evaluate_candidate(args):
+    family, params, seed = args
+    return _worker['evaluator'].evaluate(family, params, seed=seed)
+
+
+#####
+# Search
+#####
+
+class GeneticSearch(object):
+    """
+    Evolves a population of parameter vectors of one family: tournament
+    selection, uniform crossover, gaussian mutation clipped to [0, 1], and
+    the best few kept unchanged each generation
+    """
+    def __init__(self, evaluator, family, population_size=32, elite=2,
+                    tournament_size=3, mutation_rate=0.2, mutation_scale=0.1,
+                    num_workers=1, seed=None):
+        """
+        ARGS:
+        - evaluator: FitnessEvaluator to score candidates with
+        - family: key of FAMILIES to search over
+        - population_size: number of candidates per generation
+        - elite: number of best candidates carried over unchanged
+        - tournament_size: number of candidates compared to pick each parent
+        - mutation_rate: chance of mutating each parameter
+        - mutation_scale: standard deviation of a mutation
+        - num_workers: number of processes evaluating candidates (1 to
+        evaluate in this process)
+        - seed: seed for the search's random draws, default drawn from the
+        global generator
+        """
+        if family not in FAMILIES:
+            raise ValueError("family must be one of "+
+             str(sorted(FAMILIES.keys())))
+        self.evaluator = evaluator
+        self.family = family
+        self.num_params = FAMILIES[family][1]
+        self.population_size = population_size
+        self.elite = elite
+        self.tournament_size = tournament_size
+        self.mutation_rate = mutation_rate
+        self.mutation_scale = mutation_scale
+        self.num_workers = num_workers
+        if seed is None:
+            seed = random.randint(0, 2**31-1)
+        self.rng = np.random.RandomState(seed)
+        # generation => dictionary of best, mean and the best candidate
+        self.history = []
+
+    def evaluate_population(self, population, pool):
+        tasks = [(self.family, list(params), self.rng.randint(2**31-1))
+         for params in population]
+        if pool is None:
+            results = [self.evaluator.evaluate(*task) for task in tasks]
+        else:
+            results = pool.map(evaluate_candidate, tasks)
+        return results
+
+    def select_parent(self, population, fitnesses):
+        picks = self.rng.randint(len(population), size=self.tournament_size)
+        return population[picks[np.argmax(fitnesses[picks])]]
+
+    def next_population(self, population, fitnesses):
+        order = np.argsort(-fitnesses)
+        children = [population[i].copy() for i in order[:self.elite]]
+        while len(children) < self.population_size:
+            mother = self.select_parent(population, fitnesses)
+            father = self.select_parent(population, fitnesses)
+            from_father = self.rng.random_sample(self.num_params) < 0.5
+            child = np.where(from_father, father, mother)
+            mutate = self.rng.random_sample(self.num_params) <\
+             self.mutation_rate
+            child = child+mutate*self.rng.normal(0, self.mutation_scale,
+             self.num_params)
+            children.append(np.clip(child, 0.0, 1.0))
+        return np.array(children)
+
+    def run(self, generations, initial=None):
+        """
+        ARGS:
+        - generations: number of generations to evolve
+        - initial: optional array of starting parameter vectors, default
+        uniformly random
+
+        RETURNS:
+        - best: dictionary with the best candidate's 'params', 'fitness',
+        'terms' and 'bot'
+        """
+        if initial is None:
+            population = self.rng.random_sample(
+                (self.population_size, self.num_params)
+            )
+        else:
+            population = np.clip(np.array(initial, dtype=float), 0.0, 1.0)
+        pool = None
+        if self.num_workers > 1:
+            pool = multiprocessing.Pool(self.num_workers,
+             initializer=init_worker, initargs=(self.evaluator,))
+        best = None
+        try:
+            for g in xrange(generations+1):
+                results = self.evaluate_population(population, pool)
+                fitnesses = np.array([fitness for fitness, _ in results])
+                b = int(np.argmax(fitnesses))
+                if best is None or fitnesses[b] > best['fitness']:
+                    best = {
+                        'params': population[b].tolist(),
+                        'fitness': float(fitnesses[b]),
+                        'terms': results[b][1]
+                    }
+                self.history.append({
+                    'generation': g,
+                    'best_fitness': float(fitnesses[b]),
+                    'mean_fitness': float(fitnesses.mean()),
+                    'best_params': population[b].tolist()
+                })
+                if g < generations:
+                    population = self.next_population(population, fitnesses)
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        best['bot'] = make_bot(self.family, best['params'])
+        return best
+
+
+if __name__ == "__main__":
+    pass
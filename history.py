@@ -0,0 +1,247 @@
+########
+##
+## Memory-light stand-ins for the lists of move tuples that make up a
+## meeting's history
+##
+########
+
+
+import array
+import bisect
+
+
+## joint moves from one bot's point of view are coded as
+## 2*(my move is 'D') + (their move is 'D')
+JOINT_MOVES = [('C', 'C'), ('C', 'D'), ('D', 'C'), ('D', 'D')]
+JOINT_CODES = dict([(turn, code) for code, turn in enumerate(JOINT_MOVES)])
+CODE_BYTES = [b'\x00', b'\x01', b'\x02', b'\x03']
+
+
+class MoveWindow(object):
+    """
+    Ring buffer holding only the last few turns of a history, for bots that
+    declare a memory_depth. len() is still the number of turns played, so
+    bots that check how far into the meeting they are keep working, but only
+    the last size turns can be indexed.
+    """
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self.turns = [None]*self.size
+        self.num_turns = 0
+
+    def __len__(self):
+        return self.num_turns
+
+    def __nonzero__(self):
+        return self.num_turns > 0
+
+    __bool__ = __nonzero__
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.num_turns
+        if not (self.num_turns-self.size <= idx < self.num_turns) or idx < 0:
+            raise IndexError("turn "+str(idx)+" is outside the history window")
+        return self.turns[idx % self.size]
+
+    def __iter__(self):
+        for idx in xrange(max(self.num_turns-self.size, 0), self.num_turns):
+            yield self.turns[idx % self.size]
+
+    def append(self, turn):
+        self.turns[self.num_turns % self.size] = turn
+        self.num_turns += 1
+
+
+class CompactMeeting(object):
+    """
+    A meeting's full history stored as one byte per turn (the joint move code
+    from the first bot's point of view). Reads like the list of move tuples it
+    replaces.
+    """
+    def __init__(self, codes=None, counts=None):
+        """
+        ARGS:
+        - codes: optional bytearray (or other bytes-like object, such as a
+        numpy view of a shared buffer) of joint move codes to start from
+        - counts: optional joint move counts of codes, already known, so
+        joint_move_counts needn't scan them
+        """
+        if codes is None:
+            codes = bytearray()
+        self.codes = codes
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [JOINT_MOVES[c] for c in bytearray(self.codes[idx])]
+        return JOINT_MOVES[self.codes[idx]]
+
+    def __iter__(self):
+        for c in bytearray(self.codes):
+            yield JOINT_MOVES[c]
+
+    def __eq__(self, other):
+        if len(self) != len(other):
+            return False
+        for turn, other_turn in zip(self, other):
+            if turn != tuple(other_turn):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "CompactMeeting("+repr(list(self))+")"
+
+    def append(self, turn):
+        self.codes.append(JOINT_CODES[turn])
+        self.counts = None
+
+    def joint_move_counts(self):
+        """
+        RETURNS:
+        - counts: tuple (CC, CD, DC, DD) of how many turns had each joint move
+        """
+        if self.counts is not None:
+            return tuple(self.counts)
+        return tuple([self.codes.count(b) for b in CODE_BYTES])
+
+
+class MeetingTally(object):
+    """
+    Keeps only a meeting's length and how often each joint move happened, for
+    when the full history isn't wanted. Enough for TournamentResults and
+    MoralityCalculator, but the individual turns are gone.
+    """
+    def __init__(self):
+        self.counts = [0, 0, 0, 0]
+        self.num_turns = 0
+
+    def __len__(self):
+        return self.num_turns
+
+    def __iter__(self):
+        raise TypeError("a MeetingTally does not keep the individual turns")
+
+    def append(self, turn):
+        self.counts[JOINT_CODES[turn]] += 1
+        self.num_turns += 1
+
+    def joint_move_counts(self):
+        return tuple(self.counts)
+
+
+class RunLengthMeeting(object):
+    """
+    A meeting's full history stored as runs of the same joint move, as
+    (code, length) pairs in two arrays. Histories that settle into mutual
+    cooperation or mutual defection take a few runs however long they are.
+    Reads like the list of move tuples it replaces.
+    """
+    def __init__(self, run_codes=None, run_lengths=None):
+        """
+        ARGS:
+        - run_codes: optional sequence of the joint move code of each run
+        - run_lengths: optional sequence of the length of each run
+        """
+        self.run_codes = array.array('B', run_codes or [])
+        self.run_lengths = array.array('l', run_lengths or [])
+        self.num_turns = sum(self.run_lengths)
+        # turn each run starts on, built on the first indexing
+        self.run_starts = None
+
+    def __len__(self):
+        return self.num_turns
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return list(self)[idx]
+        if idx < 0:
+            idx += self.num_turns
+        if not 0 <= idx < self.num_turns:
+            raise IndexError("meeting index out of range")
+        if self.run_starts is None:
+            self.run_starts = []
+            start = 0
+            for length in self.run_lengths:
+                self.run_starts.append(start)
+                start += length
+        return JOINT_MOVES[
+            self.run_codes[bisect.bisect_right(self.run_starts, idx)-1]
+        ]
+
+    def __iter__(self):
+        for code, length in zip(self.run_codes, self.run_lengths):
+            turn = JOINT_MOVES[code]
+            for _ in xrange(length):
+                yield turn
+
+    def __eq__(self, other):
+        if len(self) != len(other):
+            return False
+        for turn, other_turn in zip(self, other):
+            if turn != tuple(other_turn):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "RunLengthMeeting("+repr(self.runs())+")"
+
+    def append(self, turn):
+        code = JOINT_CODES[turn]
+        if self.run_codes and self.run_codes[-1] == code:
+            self.run_lengths[-1] += 1
+        else:
+            self.run_codes.append(code)
+            self.run_lengths.append(1)
+            self.run_starts = None
+        self.num_turns += 1
+
+    def runs(self):
+        """
+        RETURNS:
+        - runs: list of (code, length) tuples
+        """
+        return zip(self.run_codes, self.run_lengths)
+
+    def joint_move_counts(self):
+        counts = [0, 0, 0, 0]
+        for code, length in zip(self.run_codes, self.run_lengths):
+            counts[code] += length
+        return tuple(counts)
+
+
+def run_length_encode(meeting):
+    """
+    Encode a meeting (list of move tuples or CompactMeeting) as a
+    RunLengthMeeting
+    """
+    if isinstance(meeting, RunLengthMeeting):
+        return meeting
+    if isinstance(meeting, MeetingTally):
+        raise TypeError("a MeetingTally does not keep the individual turns")
+    if isinstance(meeting, CompactMeeting):
+        codes = bytearray(meeting.codes)
+    else:
+        codes = bytearray([JOINT_CODES[turn] for turn in meeting])
+    run_codes = []
+    run_lengths = []
+    for code in codes:
+        if run_codes and run_codes[-1] == code:
+            run_lengths[-1] += 1
+        else:
+            run_codes.append(code)
+            run_lengths.append(1)
+    return RunLengthMeeting(run_codes, run_lengths)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,144 @@
+########
+##
+## Answer questions about the course of meetings from their runs of joint
+## moves, without walking every turn
+##
+########
+
+
+import history
+
+
+## codes in which the first or second bot defected
+BOT1_DEFECTS = (2, 3)
+BOT2_DEFECTS = (1, 3)
+CC = 0
+CD = 1
+DC = 2
+
+
+def meeting_summary(meeting):
+    """
+    Summarize a meeting in one pass over its runs
+
+    ARGS:
+    - meeting: RunLengthMeeting (other meetings are encoded first)
+
+    RETURNS:
+    - summary: dictionary with
+        'first_defection': (turn bot1 first defected, turn bot2 first
+        defected), None for a bot that never did
+        'longest_cc': the longest streak of mutual cooperation
+        'retaliations': (bot1's, bot2's) number of retaliation episodes,
+        where a retaliation is cooperating while the partner defects and
+        then defecting on the next turn
+        'num_runs': number of runs
+    """
+    meeting = history.run_length_encode(meeting)
+    first_1 = None
+    first_2 = None
+    longest_cc = 0
+    retaliations_1 = 0
+    retaliations_2 = 0
+    turn = 0
+    prev_code = None
+    for code, length in meeting.runs():
+        if first_1 is None and code in BOT1_DEFECTS:
+            first_1 = turn
+        if first_2 is None and code in BOT2_DEFECTS:
+            first_2 = turn
+        if code == CC and length > longest_cc:
+            longest_cc = length
+        # a run boundary is the only place a bot can change its move
+        if prev_code == CD and code in BOT1_DEFECTS:
+            retaliations_1 += 1
+        if prev_code == DC and code in BOT2_DEFECTS:
+            retaliations_2 += 1
+        prev_code = code
+        turn += length
+    return {
+        'first_defection': (first_1, first_2),
+        'longest_cc': longest_cc,
+        'retaliations': (retaliations_1, retaliations_2),
+        'num_runs': len(meeting.run_codes)
+    }
+
+
+class HistoryIndex(object):
+    """
+    Summaries of every meeting of a tournament, computed once from the
+    meetings' runs, so each question costs a lookup instead of a walk over
+    the turns
+    """
+    def __init__(self, tourney_res):
+        """
+        ARGS:
+        - tourney_res: TournamentResults object whose meetings keep their
+        turns (not MeetingTallys)
+        """
+        self.tourney_res = tourney_res
+        # (id_1, id_2) => list of meeting summaries
+        self.summaries = {}
+        for pair in tourney_res.get_played_pairs():
+            self.summaries[pair] = [meeting_summary(meeting)
+             for meeting in tourney_res.get_interactions(*pair)]
+
+    def get_summaries(self, id_1, id_2):
+        return self.summaries[(id_1, id_2)]
+
+    def get_first_defection(self, id_1, id_2):
+        """
+        RETURNS:
+        - (turn, meeting) of the pair's first defection by either bot, in
+        meeting order, or None if neither bot ever defected
+        """
+        for m, summary in enumerate(self.summaries[(id_1, id_2)]):
+            turns = [t for t in summary['first_defection'] if t is not None]
+            if turns:
+                return min(turns), m
+        return None
+
+    def get_first_defections_by_meeting(self, id_1, id_2):
+        """
+        RETURNS:
+        - list of (turn id_1 first defected, turn id_2 first defected), one
+        per meeting, None for a bot that didn't
+        """
+        return [summary['first_defection']
+         for summary in self.summaries[(id_1, id_2)]]
+
+    def get_longest_cooperation_streak(self, id_1, id_2):
+        return max([summary['longest_cc']
+         for summary in self.summaries[(id_1, id_2)]])
+
+    def get_retaliation_episodes(self, id_1, id_2):
+        """
+        RETURNS:
+        - (id_1's, id_2's) retaliation episodes over all the pair's meetings
+        """
+        summaries = self.summaries[(id_1, id_2)]
+        return (sum([s['retaliations'][0] for s in summaries]),
+         sum([s['retaliations'][1] for s in summaries]))
+
+    def get_retaliation_episodes_by_id(self, bot_id):
+        """
+        RETURNS:
+        - the bot's retaliation episodes over all its meetings (only once for
+        a bot paired with its clone, as its total score counts it)
+        """
+        total = 0
+        for (id_1, id_2), summaries in self.summaries.items():
+            for summary in summaries:
+                if id_1 == bot_id:
+                    total += summary['retaliations'][0]
+                elif id_2 == bot_id:
+                    total += summary['retaliations'][1]
+        return total
+
+    def get_num_runs(self, id_1, id_2):
+        return sum([summary['num_runs']
+         for summary in self.summaries[(id_1, id_2)]])
+
+
+if __name__ == "__main__":
+    pass
@@ -9,6 +9,14 @@
 import copy
 import numpy as np
 
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import report_writers as rw
+import tournament_results
+
 
 class MoralityCalculator(object):
     """
@@ -35,44 +43,10 @@ class MoralityCalculator(object):
         self.calculate_network_morality()
 
     def __str__(self):
-        # get the bots in order of their score
-        sorted_bots = self.tourney_res.get_sorted_bot_list()
-
-        headers = [
-            "Tournament ID",
-            "Bot Name",
-            "Cooperation Rate",
-            "Not Worse Partner",
-            "Recursive Jesus",
-            "Recursive Moses"
-        ]
-        num_cols = len(headers)
-
-        # find a good column width to use for formatting the output
-        long_header = max([len(h) for h in headers])
-        long_name = max(
-            [len(bot.name) for bot in self.tourney_res.get_bot_list()]
-        )+1
-        col = max([long_header, long_name])
-        col_str = str(col)
-        format_str = (("{: <"+col_str+"} ")*num_cols)[:-1]
-        hr = "-"*(num_cols*col)
-
-        # construct output string
-        headers_str = format_str.format(*headers)
-        output = "\n"+hr+"\n"+headers_str+"\n"+hr+"\n"
-        for bot in sorted_bots:
-            t_id = bot.tournament_id
-            name = self.tourney_res.get_name_by_id(t_id)
-            coop_rate = self.cooperation_rates[t_id]
-            big_man_score = self.bigger_man_scores[t_id]
-            eigenjesus = self.eigenjesus_scores[t_id]
-            eigenmoses = self.eigenmoses_scores[t_id]
-            row = format_str.format(str(t_id), name,\
-             str(coop_rate), str(big_man_score),
-             str(eigenjesus), eigenmoses)
-            output += row+"\n"
-        return output
+        output = StringIO()
+        rw.ReportWriter(self.tourney_res, self, out=output)\
+         .write_morality_table()
+        return output.getvalue()
 
 
     #####
@@ -86,7 +60,8 @@ class MoralityCalculator(object):
 
         STORES:
         - cooperation_matrix: numpy array, cooperation_matrix[i][j] is i's
-        cooperation rate when partnered with j
+        cooperation rate when partnered with j (a SparseCooperationMatrix
+        holding only the played pairs if not every pair played)
         - bigger_man_scores: a bot's bigger_man_score is the fraction of
         partnerships in which that bot cooperated at least as much as its
         partner
@@ -97,44 +72,56 @@ class MoralityCalculator(object):
         bot_list = tr.get_bot_list()
         bot_id_list = [bot.tournament_id for bot in bot_list]
         num_bots = len(bot_list)
-        coop_matrix = [[0 for _ in xrange(num_bots)] for _ in xrange(num_bots)]
+        coop_entries = {}
         big_man_scores = {}
+        num_partners = {}
         for bot_id in bot_id_list:
             big_man_scores[bot_id] = 0.0
+            num_partners[bot_id] = 0
         coop_rates = {}
         # for each bot pair, count the times each bot cooperates and divide by
-        # the total number of turns, and store this rate in coop_matrix
-        for i in xrange(num_bots):
-            bot1_id = bot_list[i].tournament_id
-            for j in xrange(i, num_bots):
-                bot2_id = bot_list[j].tournament_id
-                interactions = tr.get_interactions(bot1_id, bot2_id)
-                total_turns = sum([len(meeting) for meeting in interactions])
-                bot1_coops, bot2_coops = 0.0, 0.0
-                for meeting in interactions:
-                    for turn in meeting:
-                        if turn[0] == 'C':
-                            bot1_coops += 1.0
-                        if turn[1] == 'C':
-                            bot2_coops += 1.0
-                bot1_rate = bot1_coops/total_turns
-                bot2_rate = bot2_coops/total_turns
-                coop_matrix[bot1_id][bot2_id] = bot1_rate
-                coop_matrix[bot2_id][bot1_id] = bot2_rate
-                # don't include the case where a bot partners with its own clone
-                if bot1_id != bot2_id:
-                    if bot1_rate >= bot2_rate:
-                        big_man_scores[bot1_id] += 1.0
-                    if bot2_rate >= bot1_rate:
-                        big_man_scores[bot2_id] += 1.0
-        for i in xrange(num_bots):
-            bot_id = bot_list[i].tournament_id
-            bot_coop_rates = coop_matrix[bot_id]
-            coop_rates[bot_id] = sum(bot_coop_rates)/len(bot_coop_rates)
-            big_man_scores[bot_id] = big_man_scores[bot_id]/(num_bots-1)
+        # the total number of turns, and store this rate in coop_entries
+        for bot1_id, bot2_id in tr.get_played_pairs():
+            interactions = tr.get_interactions(bot1_id, bot2_id)
+            total_turns = sum([len(meeting) for meeting in interactions])
+            bot1_coops, bot2_coops = 0.0, 0.0
+            for meeting in interactions:
+                meeting_coops = \
+                 tournament_results.cooperation_counts(meeting)
+                bot1_coops += meeting_coops[0]
+                bot2_coops += meeting_coops[1]
+            bot1_rate = bot1_coops/total_turns
+            bot2_rate = bot2_coops/total_turns
+            coop_entries[(bot1_id, bot2_id)] = bot1_rate
+            coop_entries[(bot2_id, bot1_id)] = bot2_rate
+            # don't include the case where a bot partners with its own clone
+            if bot1_id != bot2_id:
+                num_partners[bot1_id] += 1
+                num_partners[bot2_id] += 1
+                if bot1_rate >= bot2_rate:
+                    big_man_scores[bot1_id] += 1.0
+                if bot2_rate >= bot1_rate:
+                    big_man_scores[bot2_id] += 1.0
+        if tr.is_round_robin():
+            coop_matrix = np.zeros((num_bots, num_bots))
+            for (bot1_id, bot2_id), rate in coop_entries.items():
+                coop_matrix[bot1_id][bot2_id] = rate
+            for bot_id in bot_id_list:
+                bot_coop_rates = coop_matrix[bot_id].tolist()
+                coop_rates[bot_id] = sum(bot_coop_rates)/len(bot_coop_rates)
+        else:
+            coop_matrix = SparseCooperationMatrix(num_bots, coop_entries)
+            row_sums = coop_matrix.row_sums()
+            row_counts = coop_matrix.row_counts()
+            for bot_id in bot_id_list:
+                coop_rates[bot_id] =\
+                 float(row_sums[bot_id]/row_counts[bot_id])
+        for bot_id in bot_id_list:
+            big_man_scores[bot_id] =\
+             big_man_scores[bot_id]/num_partners[bot_id]
         # save these cooperation rates per interaction and the overall
         # cooperation rate for each bot
-        self.cooperation_matrix = np.array(coop_matrix)
+        self.cooperation_matrix = coop_matrix
         self.bigger_man_scores = big_man_scores
         self.cooperation_rates = coop_rates
 
@@ -146,7 +133,7 @@ class MoralityCalculator(object):
 
         ARGS:
         - C: C is a numpy array in [0, 1]^(nxn) where values represent the
-        'votes' between nodes like in PageRank
+        'votes' between nodes like in PageRank (or a SparseCooperationMatrix)
 
         RETURNS:
         - pev: pev is the principal eigenvector of C, representing the end
@@ -186,7 +173,12 @@ class MoralityCalculator(object):
         ## TODO: come up with programmtic way of determining number of iters
         self.eigenjesus_scores =\
          self.principal_eigenvector(self.cooperation_matrix, 100)
-        coop_def_matrix = (self.cooperation_matrix-0.5)*2
+        if isinstance(self.cooperation_matrix, SparseCooperationMatrix):
+            # only the pairs that played cast votes
+            coop_def_matrix =\
+             self.cooperation_matrix.map_values(lambda v: (v-0.5)*2)
+        else:
+            coop_def_matrix = (self.cooperation_matrix-0.5)*2
         self.eigenmoses_scores =\
          self.principal_eigenvector(coop_def_matrix, 100)
 
@@ -234,6 +226,92 @@ class MoralityCalculator(object):
             return self.get_eigenmoses_by_id(bot.tournament_id)
         return sorted(bot_list, key=get_eigenmoses, reverse=True)
 
+    def get_turn_dynamics(self):
+        turn_dynamics = self.tourney_res.get_turn_dynamics()
+        if turn_dynamics is None:
+            raise ValueError("the tournament was played without turn_dynamics")
+        return turn_dynamics
+
+    def get_turn_bin_starts(self):
+        """
+        RETURNS:
+        - numpy array of the first turn of each bin of the curves below
+        """
+        return self.get_turn_dynamics().get_bin_starts()
+
+    def get_cooperation_curve_by_id(self, bot_id):
+        """
+        RETURNS:
+        - numpy array of the bot's cooperation rate at each turn bin, over all
+        its meetings (NaN for bins no meeting lasted into)
+        """
+        return self.get_turn_dynamics().get_cooperation_curve_by_id(bot_id)
+
+    def get_score_curve_by_id(self, bot_id):
+        """
+        RETURNS:
+        - numpy array of the bot's average score per turn at each turn bin,
+        over all its meetings (NaN for bins no meeting lasted into)
+        """
+        return self.get_turn_dynamics().get_score_curve_by_id(bot_id,
+         self.tourney_res.payoffs)
+
+
+class SparseCooperationMatrix(object):
+    """
+    Cooperation matrix of a tournament where only some pairs played, holding
+    an entry for each played pair only. Supports the parts of the numpy array
+    interface that principal_eigenvector needs.
+    """
+    def __init__(self, num_bots, entries):
+        """
+        ARGS:
+        - num_bots: number of bots in the tournament
+        - entries: dictionary of (i, j) => i's cooperation rate with j, or a
+        tuple (rows, cols, vals) of equal length numpy arrays
+        """
+        self.num_bots = num_bots
+        if isinstance(entries, dict):
+            keys = sorted(entries.keys())
+            self.rows = np.array([k[0] for k in keys], dtype=np.intp)
+            self.cols = np.array([k[1] for k in keys], dtype=np.intp)
+            self.vals = np.array([entries[k] for k in keys], dtype=float)
+        else:
+            self.rows, self.cols, self.vals = entries
+        self.shape = (num_bots, num_bots)
+
+    def __len__(self):
+        return self.num_bots
+
+    def dot(self, v):
+        return np.bincount(self.rows, weights=self.vals*v[self.cols],
+         minlength=self.num_bots)
+
+    def map_values(self, f):
+        return SparseCooperationMatrix(self.num_bots,
+         (self.rows, self.cols, f(self.vals)))
+
+    def row_sums(self):
+        return np.bincount(self.rows, weights=self.vals,
+         minlength=self.num_bots)
+
+    def row_counts(self):
+        return np.bincount(self.rows, minlength=self.num_bots).astype(float)
+
+    def get(self, i, j):
+        """
+        i's cooperation rate with j, or None if they did not play
+        """
+        match = np.nonzero((self.rows == i) & (self.cols == j))[0]
+        if len(match) == 0:
+            return None
+        return self.vals[match[0]]
+
+    def toarray(self):
+        dense = np.zeros(self.shape)
+        dense[self.rows, self.cols] = self.vals
+        return dense
+
 
 if __name__ == "__main__":
     pass
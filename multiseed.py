@@ -0,0 +1,313 @@
+########
+##
+## Play one pair under many seeds at once, in lockstep, to get the spread of
+## its scores and cooperation without a separate simulation per seed
+##
+########
+
+
+import random
+
+import numpy as np
+
+import compiled_bots as cb
+
+
+#####
+# Bots over seeds
+#####
+
+class SeedBot(object):
+    """
+    Plays a bot in S independent meetings at once. This plays any bot, with
+    a history per seed and a getNextMove call per seed and turn, the same
+    work as separate simulations; subclasses for bots they can play faster
+    keep whatever the bot remembers as arrays over the seeds instead.
+    """
+    def __init__(self, bot, payoffs, w):
+        self.bot = bot
+        self.payoffs = payoffs
+        self.w = w
+
+    def reset(self, num_seeds):
+        """
+        Start a new meeting in every seed
+        """
+        self.histories = [[] for _ in xrange(num_seeds)]
+
+    def defects(self, turn, draws):
+        """
+        ARGS:
+        - turn: the turn about to be played, the same in every seed
+        - draws: numpy array of S uniform draws for this bot and turn
+
+        RETURNS:
+        - defects: boolean numpy array, whether the bot defects in each seed
+        """
+        # getNextMove draws from random.random, so in each seed that is
+        # stood in for by a generator seeded from the seed's draw
+        real_random = random.random
+        moves = []
+        try:
+            for h, draw in zip(self.histories, draws):
+                random.random = random.Random(int(draw*2**53)).random
+                moves.append(self.bot.getNextMove(h, payoffs=self.payoffs,
+                 w=self.w))
+        finally:
+            random.random = real_random
+        return np.array([move == 'D' for move in moves], dtype=bool)
+
+    def observe(self, my_defects, their_defects, active):
+        """
+        Record the turn just played
+
+        ARGS:
+        - my_defects, their_defects: boolean numpy arrays over the seeds
+        - active: boolean numpy array of the seeds whose meeting is still
+        going
+        """
+        for s in np.nonzero(active)[0]:
+            self.histories[s].append(('CD'[int(my_defects[s])],
+             'CD'[int(their_defects[s])]))
+
+
+class TableSeedBot(SeedBot):
+    """
+    A bot with a memory_depth, compiled to a DecisionTable: its state in
+    each seed is an index into the table
+    """
+    def __init__(self, bot, payoffs, w, samples=10000):
+        SeedBot.__init__(self, bot, payoffs, w)
+        table = cb.compile_bot(bot, payoffs=payoffs, w=w, samples=samples)
+        self.coop_probs = table.coop_probs
+        self.next_state = cb.next_state_table(table.depth)
+
+    def reset(self, num_seeds):
+        self.state = np.zeros(num_seeds, dtype=np.intp)
+
+    def defects(self, turn, draws):
+        return draws >= self.coop_probs[self.state]
+
+    def observe(self, my_defects, their_defects, active):
+        codes = 2*my_defects+their_defects
+        self.state = np.where(active, self.next_state[self.state, codes],
+         self.state)
+
+
+def majority_defects(seed_bot, turn, draws):
+    if turn == 0:
+        return np.zeros(len(draws), dtype=bool)
+    ratio = seed_bot.their_defections/float(turn)
+    if seed_bot.bot.soft:
+        return ratio > 0.5
+    return ratio >= 0.5
+
+def tester_defects(seed_bot, turn, draws):
+    if turn == 0:
+        return np.ones(len(draws), dtype=bool)
+    never = seed_bot.their_defections == 0
+    if turn < 3:
+        untested = np.zeros(len(draws), dtype=bool)
+    else:
+        untested = ~seed_bot.my_last
+    # apologize right after their first defection, then mirror them
+    first_just_now = seed_bot.their_defections_before_last == 0
+    tested = np.where(first_just_now, False, seed_bot.their_last)
+    return np.where(never, untested, tested)
+
+def friedman_defects(seed_bot, turn, draws):
+    return seed_bot.their_defections > 0
+
+def eatherly_defects(seed_bot, turn, draws):
+    if turn == 0:
+        return np.zeros(len(draws), dtype=bool)
+    ratio = seed_bot.their_defections/float(turn)
+    return seed_bot.their_last & (draws < ratio)
+
+def champion_defects(seed_bot, turn, draws):
+    expected_length = 1.0/(1.0-seed_bot.w)
+    if turn <= expected_length/20.0:
+        return np.zeros(len(draws), dtype=bool)
+    if turn < (5.0/40.0)*expected_length:
+        return seed_bot.their_last.copy()
+    ratio = seed_bot.their_defections/float(turn)
+    return seed_bot.their_last & (ratio > np.maximum(0.4, draws))
+
+## bot class name => function(seed_bot, turn, draws) => defects, for bots
+## that look at the whole history but only through these counts
+COUNT_STRATEGIES = {
+    'MAJORITY': majority_defects,
+    'TESTER': tester_defects,
+    'FRIEDMAN': friedman_defects,
+    'EATHERLY': eatherly_defects,
+    'CHAMPION': champion_defects
+}
+
+
+class CountSeedBot(SeedBot):
+    """
+    A bot of COUNT_STRATEGIES: its state in each seed is the last turn and
+    how often the partner has defected
+    """
+    def __init__(self, bot, payoffs, w):
+        SeedBot.__init__(self, bot, payoffs, w)
+        self.strategy = COUNT_STRATEGIES[bot.__class__.__name__]
+
+    def reset(self, num_seeds):
+        self.my_last = np.zeros(num_seeds, dtype=bool)
+        self.their_last = np.zeros(num_seeds, dtype=bool)
+        self.their_defections = np.zeros(num_seeds, dtype=np.int64)
+        self.their_defections_before_last = np.zeros(num_seeds,
+         dtype=np.int64)
+
+    def defects(self, turn, draws):
+        return self.strategy(self, turn, draws)
+
+    def observe(self, my_defects, their_defects, active):
+        self.their_defections_before_last = np.where(active,
+         self.their_defections, self.their_defections_before_last)
+        self.their_defections = self.their_defections+(their_defects & active)
+        self.my_last = np.where(active, my_defects, self.my_last)
+        self.their_last = np.where(active, their_defects, self.their_last)
+
+
+def make_seed_bot(bot, payoffs, w, samples=10000):
+    if bot.memory_depth is not None:
+        return TableSeedBot(bot, payoffs, w, samples=samples)
+    if bot.__class__.__name__ in COUNT_STRATEGIES:
+        return CountSeedBot(bot, payoffs, w)
+    return SeedBot(bot, payoffs, w)
+
+
+#####
+# Results
+#####
+
+class MultiSeedResults(object):
+    """
+    Per seed totals of a pair played under many seeds, and their
+    distributions
+    """
+    def __init__(self, bot1, bot2, counts, turns):
+        """
+        ARGS:
+        - bot1, bot2: the pair
+        - counts: numpy array of shape (S, 4), each seed's (CC, CD, DC, DD)
+        counts over all its meetings, from bot1's point of view
+        - turns: numpy array of shape (S,), each seed's number of turns
+        """
+        self.bot1 = bot1
+        self.bot2 = bot2
+        self.counts = counts
+        self.turns = turns
+        self.num_seeds = len(turns)
+
+    def get_scores(self, payoffs):
+        """
+        RETURNS:
+        - scores: numpy array of shape (S, 2), each bot's total score per seed
+        """
+        scores_1 = np.array([payoffs['R'], payoffs['S'], payoffs['T'],
+         payoffs['P']], dtype=float)
+        scores_2 = np.array([payoffs['R'], payoffs['T'], payoffs['S'],
+         payoffs['P']], dtype=float)
+        return np.column_stack([self.counts.dot(scores_1),
+         self.counts.dot(scores_2)])
+
+    def get_avg_scores(self, payoffs):
+        """
+        RETURNS:
+        - avg_scores: numpy array of shape (S, 2), score per turn per seed
+        """
+        return self.get_scores(payoffs)/self.turns[:, None]
+
+    def get_cooperation_rates(self):
+        """
+        RETURNS:
+        - rates: numpy array of shape (S, 2), each bot's cooperation rate per
+        seed
+        """
+        cc, cd, dc = self.counts[:, 0], self.counts[:, 1], self.counts[:, 2]
+        return np.column_stack([cc+cd, cc+dc])/self.turns[:, None].astype(
+            float
+        )
+
+    def summarize(self, values, percentiles=(2.5, 50, 97.5)):
+        """
+        RETURNS:
+        - summary: dictionary of 'mean', 'std' and each percentile, each an
+        array over the columns of values
+        """
+        summary = {'mean': values.mean(axis=0), 'std': values.std(axis=0,
+         ddof=1)}
+        for p in percentiles:
+            summary['p'+str(p)] = np.percentile(values, p, axis=0)
+        return summary
+
+    def get_summary(self, payoffs):
+        """
+        RETURNS:
+        - summary: dictionary with the distribution summaries of
+        'avg_scores' and 'cooperation_rates', columns (bot1, bot2)
+        """
+        return {
+            'avg_scores': self.summarize(self.get_avg_scores(payoffs)),
+            'cooperation_rates': self.summarize(self.get_cooperation_rates())
+        }
+
+
+#####
+# Engine
+#####
+
+def play_pair_seeds(bot1, bot2, num_seeds, numMeetings=1,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995,
+                    interaction_lengths=None, seed=None, samples=10000):
+    """
+    Play bot1 against bot2 under num_seeds independent seeds in lockstep.
+    Each turn draws one block of num_seeds uniforms per bot, and the bots'
+    memories are arrays over the seeds.
+
+    ARGS:
+    - bot1, bot2: the pair
+    - num_seeds: number of seeds S
+    - numMeetings: meetings per seed
+    - payoffs, w: as for Arena.runTournament
+    - interaction_lengths: optional meeting lengths shared by every seed,
+    default each seed draws its own from w
+    - seed: seed for the draws, default drawn from the global generator
+    - samples: see compile_bot
+
+    RETURNS:
+    - multi_res: MultiSeedResults object
+    """
+    if seed is None:
+        seed = random.randint(0, 2**31-1)
+    rng = np.random.RandomState(seed)
+    seed_bots = (make_seed_bot(bot1, payoffs, w, samples=samples),
+     make_seed_bot(bot2, payoffs, w, samples=samples))
+    counts = np.zeros((num_seeds, 4), dtype=np.int64)
+    turns = np.zeros(num_seeds, dtype=np.int64)
+    seeds = np.arange(num_seeds)
+    for m in xrange(numMeetings):
+        if interaction_lengths is None:
+            lengths = rng.geometric(1-w, size=num_seeds)
+        else:
+            lengths = np.repeat(interaction_lengths[m], num_seeds)
+        turns += lengths
+        for seed_bot in seed_bots:
+            seed_bot.reset(num_seeds)
+        for turn in xrange(int(lengths.max())):
+            active = lengths > turn
+            draws = rng.random_sample((2, num_seeds))
+            defects_1 = seed_bots[0].defects(turn, draws[0])
+            defects_2 = seed_bots[1].defects(turn, draws[1])
+            codes = 2*defects_1+defects_2
+            counts[seeds[active], codes[active]] += 1
+            seed_bots[0].observe(defects_1, defects_2, active)
+            seed_bots[1].observe(defects_2, defects_1, active)
+    return MultiSeedResults(bot1, bot2, counts, turns)
+
+
+if __name__ == "__main__":
+    pass
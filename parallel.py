@@ -0,0 +1,426 @@
+########
+##
+## Play the pairs of a tournament across worker processes, ordered and
+## chunked by their estimated cost so the workers finish together
+##
+########
+
+
+import ctypes
+import json
+import multiprocessing
+import random
+import time
+from multiprocessing import sharedctypes
+
+import numpy as np
+
+import arena
+import history
+import rosters
+
+
+#####
+# Cost model
+#####
+
+class CostModel(object):
+    """
+    Estimates how long a meeting takes from the classes of the two bots and
+    the meeting length. A bot's move on turn t is taken to cost
+    per_move+per_turn*t seconds, so a meeting of length L costs it
+    per_move*L+per_turn*L*(L-1)/2: linear for bots that look at a fixed
+    number of turns, quadratic for bots that scan the whole history.
+    """
+    # guesses for classes that haven't been calibrated, relative to each
+    # other only
+    DEFAULT_PER_MOVE = 1e-6
+    DEFAULT_PER_TURN = 1e-8
+
+    def __init__(self, coefficients=None):
+        """
+        ARGS:
+        - coefficients: dictionary of bot class name => (per_move, per_turn)
+        seconds, e.g. from an earlier calibrate
+        """
+        self.coefficients = dict(coefficients or {})
+
+    def get_coefficients(self, bot_class):
+        name = bot_class.__name__
+        if name in self.coefficients:
+            return self.coefficients[name]
+        if bot_class.memory_depth is not None:
+            return (self.DEFAULT_PER_MOVE, 0.0)
+        return (self.DEFAULT_PER_MOVE, self.DEFAULT_PER_TURN)
+
+    def meeting_cost(self, bot_class, interaction_length):
+        per_move, per_turn = self.get_coefficients(bot_class)
+        L = interaction_length
+        return per_move*L+per_turn*L*(L-1)/2.0
+
+    def pair_cost(self, class_1, class_2, interaction_lengths):
+        """
+        ARGS:
+        - class_1, class_2: the classes of the pair's bots, so no bot needs
+        building to be estimated
+
+        RETURNS:
+        - cost: estimated seconds to play every meeting of the pair
+        """
+        return sum([self.meeting_cost(class_1, L)+
+         self.meeting_cost(class_2, L) for L in interaction_lengths])
+
+    def calibrate(self, botList, history_lengths=(16, 256, 1024),
+                    calls=200, payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+        """
+        Time getNextMove for one bot of every class in botList on random
+        histories of each of history_lengths, and fit per_move and per_turn
+        by least squares
+
+        ARGS:
+        - botList: bots whose classes to calibrate
+        - history_lengths: history lengths to time moves at (at least two
+        different ones)
+        - calls: number of moves timed per history length
+        """
+        by_class = {}
+        for bot in botList:
+            by_class.setdefault(bot.__class__.__name__, bot)
+        rng = random.Random(0)
+        for name, bot in by_class.items():
+            points = []
+            for length in history_lengths:
+                past_moves = [(rng.choice('CD'), rng.choice('CD'))
+                 for _ in xrange(length)]
+                start = time.time()
+                for _ in xrange(calls):
+                    bot.getNextMove(past_moves, payoffs=payoffs, w=w)
+                points.append((length, (time.time()-start)/calls))
+            self.coefficients[name] = fit_line(points)
+
+    def save(self, path):
+        f = open(path, 'w')
+        try:
+            json.dump(self.coefficients, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, path):
+        f = open(path)
+        try:
+            coefficients = json.load(f)
+        finally:
+            f.close()
+        return cls(dict(
+            [(str(k), tuple(v)) for k, v in coefficients.items()]
+        ))
+
+
+def fit_line(points):
+    """
+    Least squares fit of y = a+b*x, clamped so neither coefficient is
+    negative
+
+    ARGS:
+    - points: list of (x, y) tuples
+
+    RETURNS:
+    - (a, b)
+    """
+    n = float(len(points))
+    mean_x = sum([x for x, _ in points])/n
+    mean_y = sum([y for _, y in points])/n
+    var_x = sum([(x-mean_x)**2 for x, _ in points])
+    b = 0.0
+    if var_x > 0:
+        b = sum([(x-mean_x)*(y-mean_y) for x, y in points])/var_x
+    b = max(b, 0.0)
+    a = max(mean_y-b*mean_x, 0.0)
+    return (a, b)
+
+
+def get_bot_class(botList, idx):
+    """
+    The class of bot idx, without building it if botList is a Roster
+    """
+    if isinstance(botList, rosters.Roster):
+        return rosters.BOT_CLASSES[botList.get_spec(idx).class_name]
+    return botList[idx].__class__
+
+
+#####
+# Scheduling
+#####
+
+def make_chunks(pairs, costs, num_workers, chunks_per_worker=4):
+    """
+    Order pairs longest first and group them into chunks that shrink as the
+    work left shrinks (guided self-scheduling): each chunk holds about
+    1/(chunks_per_worker*num_workers) of the remaining cost, and at least one
+    pair. Handed out on demand, the big chunks keep workers busy early and
+    the small ones even out the finish.
+
+    ARGS:
+    - pairs: list of pairs
+    - costs: estimated cost of each pair, in the same order
+    - num_workers: number of workers the chunks will be spread over
+    - chunks_per_worker: how finely to split the remaining work
+
+    RETURNS:
+    - chunks: list of lists of pairs, costliest chunk first
+    """
+    order = sorted(xrange(len(pairs)), key=lambda p: -costs[p])
+    remaining = float(sum(costs))
+    divisor = chunks_per_worker*num_workers
+    chunks = []
+    chunk = []
+    chunk_cost = 0.0
+    for p in order:
+        chunk.append(pairs[p])
+        chunk_cost += costs[p]
+        if chunk_cost >= remaining/divisor:
+            chunks.append(chunk)
+            remaining -= chunk_cost
+            chunk = []
+            chunk_cost = 0.0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+#####
+# Result collection
+#####
+
+class SharedResults(object):
+    """
+    Shared memory buffers that workers write finished pairs into instead of
+    sending them back pickled, laid out by pair index p (the position of the
+    pair in the list being played):
+    - codes: the joint move codes of every meeting of pair p, one byte per
+    turn, back to back from p*turns_per_pair
+    - counts: the (CC, CD, DC, DD) counts of each meeting of pair p, from
+    p*num_meetings*4, from which scores and cooperation counts follow without
+    reading the codes
+    """
+    def __init__(self, num_pairs, interaction_lengths, keep_codes=True):
+        """
+        ARGS:
+        - num_pairs: number of pairs to make room for
+        - interaction_lengths: the meeting lengths every pair plays
+        - keep_codes: whether to keep the turns too, or only the counts
+        """
+        self.num_pairs = num_pairs
+        self.interaction_lengths = list(interaction_lengths)
+        self.num_meetings = len(self.interaction_lengths)
+        self.turns_per_pair = sum(self.interaction_lengths)
+        self.keep_codes = keep_codes
+        # where each meeting starts within its pair's codes
+        self.meeting_starts = [0]
+        for length in self.interaction_lengths:
+            self.meeting_starts.append(self.meeting_starts[-1]+length)
+        num_codes = 0
+        if keep_codes:
+            num_codes = num_pairs*self.turns_per_pair
+        self.codes = sharedctypes.RawArray(ctypes.c_uint8, num_codes)
+        self.counts = sharedctypes.RawArray(ctypes.c_int64,
+         num_pairs*self.num_meetings*4)
+        self.views = None
+
+    def get_views(self):
+        """
+        numpy arrays over the shared buffers, made once per process (views
+        can't be sent to another process, but the buffers can)
+        """
+        if self.views is None:
+            codes = np.frombuffer(self.codes, dtype=np.uint8)
+            counts = np.frombuffer(self.counts, dtype=np.int64).reshape(
+                (self.num_pairs, self.num_meetings, 4)
+            )
+            self.views = (codes, counts)
+        return self.views
+
+    def write_pair(self, p, meetings):
+        """
+        Store the meetings of pair p, as returned by Arena.play_pair
+        """
+        codes, counts = self.get_views()
+        base = p*self.turns_per_pair
+        for m, meeting in enumerate(meetings):
+            if isinstance(meeting, history.MeetingTally):
+                counts[p, m] = meeting.joint_move_counts()
+                continue
+            if isinstance(meeting, history.CompactMeeting):
+                meeting_codes = np.frombuffer(bytes(meeting.codes),
+                 dtype=np.uint8)
+            else:
+                meeting_codes = np.array(
+                    [history.JOINT_CODES[turn] for turn in meeting],
+                    dtype=np.uint8
+                )
+            counts[p, m] = np.bincount(meeting_codes, minlength=4)
+            if self.keep_codes:
+                start = base+self.meeting_starts[m]
+                codes[start:start+len(meeting_codes)] = meeting_codes
+
+    def read_pair(self, p):
+        """
+        RETURNS:
+        - meetings: list of CompactMeetings whose codes are views of the
+        shared buffer (or MeetingTallys, without keep_codes), one per meeting
+        """
+        codes, counts = self.get_views()
+        base = p*self.turns_per_pair
+        meetings = []
+        for m in xrange(self.num_meetings):
+            meeting_counts = tuple(counts[p, m].tolist())
+            if self.keep_codes:
+                start = base+self.meeting_starts[m]
+                meetings.append(history.CompactMeeting(
+                    codes[start:start+self.interaction_lengths[m]],
+                    counts=meeting_counts
+                ))
+            else:
+                meeting = history.MeetingTally()
+                meeting.counts = list(meeting_counts)
+                meeting.num_turns = self.interaction_lengths[m]
+                meetings.append(meeting)
+        return meetings
+
+
+#####
+# Workers
+#####
+
+## what each worker process needs, set once by init_worker
+_worker = {}
+
+def init_worker(botList, windowed_history, keep_history, shared=None,
+                    turn_dynamics=None):
+    _worker['botList'] = botList
+    _worker['arena'] = arena.Arena(windowed_history=windowed_history,
+     keep_history=keep_history, turn_dynamics=turn_dynamics)
+    _worker['shared'] = shared
+
+def play_chunk(args):
+    """
+    Play a chunk of pairs in a worker. Each pair is played from its own seed,
+    so the results don't depend on which worker got it or in what order.
+
+    RETURNS:
+    - list of (pair, meetings, elapsed seconds) tuples, where meetings is
+    None if they were written to the worker's SharedResults instead
+    - the chunk's TurnDynamics, or None if the arena isn't counting them
+    """
+    chunk, indices, seeds, interaction_lengths, payoffs, w = args
+    botList = _worker['botList']
+    worker_arena = _worker['arena']
+    shared = _worker['shared']
+    if worker_arena.turn_dynamics is not None:
+        worker_arena.turn_dynamics.reset()
+    results = []
+    for pair, p, seed in zip(chunk, indices, seeds):
+        random.seed(seed)
+        start = time.time()
+        meetings = worker_arena.play_pair(botList[pair[0]], botList[pair[1]],
+         interaction_lengths, payoffs=payoffs, w=w)
+        if shared is not None:
+            shared.write_pair(p, meetings)
+            meetings = None
+        results.append((pair, meetings, time.time()-start))
+    return results, worker_arena.turn_dynamics
+
+
+class ParallelArena(arena.Arena):
+    """
+    Arena that plays pairs in a pool of worker processes. Pairs are ordered
+    by the cost model's estimate and chunked longest first, and idle workers
+    pull the next chunk as soon as they finish one.
+    """
+    def __init__(self, num_workers=None, cost_model=None,
+                    chunks_per_worker=4, shared_results=True, **kwargs):
+        """
+        ARGS:
+        - num_workers: number of worker processes, default the number of CPUs
+        - cost_model: CostModel used to estimate pair costs, default an
+        uncalibrated one
+        - chunks_per_worker: see make_chunks
+        - shared_results: whether workers hand back meetings through a
+        SharedResults (as CompactMeetings over shared memory) rather than
+        pickled
+        - kwargs: passed on to Arena
+        """
+        arena.Arena.__init__(self, **kwargs)
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if cost_model is None:
+            cost_model = CostModel()
+        self.num_workers = num_workers
+        self.cost_model = cost_model
+        self.chunks_per_worker = chunks_per_worker
+        self.shared_results = shared_results
+        # (pair, estimated cost, elapsed seconds) for every pair played, to
+        # check the cost model against
+        self.pair_timings = []
+
+    def play_pairs(self, botList, pairs, interaction_lengths,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+        interactions = {}
+        if not pairs:
+            return interactions
+        # drawn in pair order from the global generator, so random.seed
+        # still makes tournaments reproducible
+        seeds = dict([(pair, random.randint(0, 2**31-1)) for pair in pairs])
+        classes = dict([(i, get_bot_class(botList, i))
+         for pair in pairs for i in pair])
+        costs = [self.cost_model.pair_cost(classes[i], classes[j],
+         interaction_lengths) for i, j in pairs]
+        estimates = dict(zip(pairs, costs))
+        chunks = make_chunks(pairs, costs, self.num_workers,
+         chunks_per_worker=self.chunks_per_worker)
+        index = dict([(pair, p) for p, pair in enumerate(pairs)])
+        tasks = [(chunk, [index[pair] for pair in chunk],
+         [seeds[pair] for pair in chunk], interaction_lengths, payoffs, w)
+         for chunk in chunks]
+
+        shared = None
+        if self.shared_results:
+            shared = SharedResults(len(pairs), interaction_lengths,
+             keep_codes=self.keep_history or not self.windowed_history)
+        turn_dynamics = None
+        if self.turn_dynamics is not None:
+            turn_dynamics = self.turn_dynamics.empty_copy()
+        worker_bots = botList
+        if isinstance(botList, rosters.Roster):
+            # just the specs, so each worker builds only the bots it plays
+            # (and none that were built here before)
+            worker_bots = rosters.Roster(botList.specs)
+        pool = multiprocessing.Pool(self.num_workers, initializer=init_worker,
+         initargs=(worker_bots, self.windowed_history, self.keep_history, shared,
+         turn_dynamics))
+        try:
+            # chunksize 1, so every chunk goes to whichever worker is free
+            for results, chunk_dynamics in pool.imap_unordered(play_chunk,
+             tasks, 1):
+                if chunk_dynamics is not None:
+                    # counts only add, so the order chunks finish in doesn't
+                    # matter
+                    self.turn_dynamics.merge(chunk_dynamics)
+                for pair, meetings, elapsed in results:
+                    if shared is not None:
+                        meetings = shared.read_pair(index[pair])
+                    interactions[pair] = meetings
+                    self.pair_timings.append(
+                        (pair, estimates[pair], elapsed)
+                    )
+                self.report_pairs_finished(len(results))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return interactions
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,169 @@
+########
+##
+## Report how far a running tournament has got, how fast it is going and when
+## it should finish
+##
+########
+
+
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_memory_bytes():
+    """
+    Peak resident memory of this process so far, or None where the resource
+    module is unavailable
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        return peak
+    return peak*1024
+
+
+class ProgressReporter(object):
+    """
+    Tracks finished pairs and simulated turns of a tournament and emits a
+    snapshot at most once every min_interval seconds to any of a callback,
+    stderr and a Prometheus text-format file
+    """
+    def __init__(self, callback=None, stream=None, prometheus_path=None,
+                    min_interval=1.0):
+        """
+        ARGS:
+        - callback: function called with each snapshot dictionary
+        - stream: file-like object to write a progress line to, e.g.
+        sys.stderr
+        - prometheus_path: file rewritten with each snapshot in Prometheus
+        text exposition format (e.g. for node_exporter's textfile collector)
+        - min_interval: minimum seconds between snapshots
+        """
+        self.callback = callback
+        self.stream = stream
+        self.prometheus_path = prometheus_path
+        self.min_interval = min_interval
+
+        self.total_pairs = 0
+        self.turns_per_pair = 0
+        self.total_turns = 0
+        self.pairs_done = 0
+        self.turns_done = 0
+        self.start_time = time.time()
+        self.last_emit = self.start_time
+
+    def start(self, total_pairs, interaction_lengths):
+        """
+        Begin tracking a tournament
+
+        ARGS:
+        - total_pairs: number of pairs to be played
+        - interaction_lengths: the meeting lengths every pair plays, used for
+        the total number of turns and so for the ETA
+        """
+        self.total_pairs = total_pairs
+        self.turns_per_pair = sum(interaction_lengths)
+        self.total_turns = total_pairs*self.turns_per_pair
+        self.pairs_done = 0
+        self.turns_done = 0
+        self.start_time = time.time()
+        self.last_emit = self.start_time
+        self.emit(self.snapshot(self.start_time))
+
+    def pairs_finished(self, num_pairs):
+        """
+        Count num_pairs more pairs as finished, and emit a snapshot if enough
+        time has passed since the last one
+        """
+        self.pairs_done += num_pairs
+        self.turns_done += num_pairs*self.turns_per_pair
+        now = time.time()
+        if now-self.last_emit >= self.min_interval:
+            self.last_emit = now
+            self.emit(self.snapshot(now))
+
+    def finish(self):
+        self.emit(self.snapshot(time.time()))
+
+    def snapshot(self, now):
+        elapsed = now-self.start_time
+        turns_per_sec = 0.0
+        if elapsed > 0:
+            turns_per_sec = self.turns_done/elapsed
+        eta = None
+        if turns_per_sec > 0:
+            eta = (self.total_turns-self.turns_done)/turns_per_sec
+        return {
+            'pairs_done': self.pairs_done,
+            'total_pairs': self.total_pairs,
+            'turns_done': self.turns_done,
+            'total_turns': self.total_turns,
+            'elapsed_seconds': elapsed,
+            'turns_per_second': turns_per_sec,
+            'eta_seconds': eta,
+            'peak_memory_bytes': peak_memory_bytes()
+        }
+
+    def emit(self, snap):
+        if self.callback is not None:
+            self.callback(snap)
+        if self.stream is not None:
+            self.stream.write(self.format_line(snap)+"\n")
+            self.stream.flush()
+        if self.prometheus_path is not None:
+            self.write_prometheus(snap)
+
+    def format_line(self, snap):
+        eta = "?"
+        if snap['eta_seconds'] is not None:
+            eta = "{0:.0f}s".format(snap['eta_seconds'])
+        memory = "?"
+        if snap['peak_memory_bytes'] is not None:
+            memory = "{0:.1f}MB".format(snap['peak_memory_bytes']/1e6)
+        return "pairs {0}/{1}  {2:.0f} turns/s  eta {3}  peak mem {4}".format(
+            snap['pairs_done'], snap['total_pairs'], snap['turns_per_second'],
+            eta, memory
+        )
+
+    def write_prometheus(self, snap):
+        metrics = [
+            ('ipd_pairs_done', 'Pairs finished', snap['pairs_done']),
+            ('ipd_pairs_total', 'Pairs in the tournament',
+             snap['total_pairs']),
+            ('ipd_turns_done', 'Turns simulated', snap['turns_done']),
+            ('ipd_turns_total', 'Turns in the tournament',
+             snap['total_turns']),
+            ('ipd_turns_per_second', 'Simulation throughput',
+             snap['turns_per_second']),
+            ('ipd_eta_seconds', 'Estimated seconds to finish',
+             snap['eta_seconds']),
+            ('ipd_peak_memory_bytes', 'Peak resident memory',
+             snap['peak_memory_bytes'])
+        ]
+        lines = []
+        for name, help_text, value in metrics:
+            if value is None:
+                continue
+            lines.append("# HELP "+name+" "+help_text)
+            lines.append("# TYPE "+name+" gauge")
+            lines.append(name+" "+repr(float(value)))
+        # write then rename, so readers never see a half written file
+        tmp_path = self.prometheus_path+".tmp"
+        f = open(tmp_path, 'w')
+        try:
+            f.write("\n".join(lines)+"\n")
+        finally:
+            f.close()
+        os.rename(tmp_path, self.prometheus_path)
+
+
+if __name__ == "__main__":
+    pass
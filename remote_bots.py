@@ -0,0 +1,343 @@
+########
+##
+## Host bots outside the arena process behind a local socket, and play them
+## with batched move requests
+##
+########
+
+
+import json
+import socket
+import sys
+import threading
+
+try:
+    import Queue as queue
+    import SocketServer as socketserver
+except ImportError:
+    import queue
+    import socketserver
+
+import arena
+from bot_player import BotPlayer
+
+
+## The protocol is newline-delimited JSON over a unix stream socket, so bots
+## can be served from any runtime. Each request is an object with any of
+## these fields, handled in this order:
+## - "open": [[meeting_key, bot_key, payoffs, w], ...] starts a meeting on
+##   this connection, played by the hosted bot bot_key
+## - "moves": [[meeting_key, last_turn], ...] asks for the next move in each
+##   open meeting, where last_turn is [my_move, their_move] for the previous
+##   turn from that bot's point of view (null on the first turn)
+## - "close": [meeting_key, ...] forgets finished meetings
+## - "decide": [[bot_key, past_moves, payoffs, w], ...] stateless request for
+##   one move given a whole history
+## - "bots": true lists the hosted bots
+## The reply holds "moves" and "decisions" lists in request order (and
+## "bots" if asked for), or "error" with a message.
+
+
+class RemoteBotError(Exception):
+    pass
+
+
+def write_message(wfile, message):
+    wfile.write((json.dumps(message)+"\n").encode('utf-8'))
+    wfile.flush()
+
+def read_message(rfile):
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+#####
+# Server side
+#####
+
+class BotRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one connection. Meetings opened on a connection live only on that
+    connection, so each handler keeps its own meeting state.
+    """
+    def handle(self):
+        # meeting_key => [bot, past_moves, payoffs, w]
+        self.meetings = {}
+        while True:
+            request = read_message(self.rfile)
+            if request is None:
+                break
+            try:
+                reply = self.answer(request)
+            except Exception as e:
+                reply = {'error': repr(e)}
+            write_message(self.wfile, reply)
+
+    def answer(self, request):
+        bots = self.server.bots
+        reply = {}
+        for meeting_key, bot_key, payoffs, w in request.get('open', []):
+            self.meetings[meeting_key] = [bots[bot_key], [], payoffs, w]
+        if 'moves' in request:
+            moves = []
+            for meeting_key, last_turn in request['moves']:
+                bot, past_moves, payoffs, w = self.meetings[meeting_key]
+                if last_turn is not None:
+                    past_moves.append(tuple(last_turn))
+                moves.append(bot.getNextMove(past_moves, payoffs=payoffs, w=w))
+            reply['moves'] = moves
+        for meeting_key in request.get('close', []):
+            self.meetings.pop(meeting_key, None)
+        if 'decide' in request:
+            decisions = []
+            for bot_key, past_moves, payoffs, w in request['decide']:
+                past_moves = [tuple(turn) for turn in past_moves]
+                decisions.append(
+                    bots[bot_key].getNextMove(past_moves, payoffs=payoffs, w=w)
+                )
+            reply['decisions'] = decisions
+        if request.get('bots'):
+            reply['bots'] = dict(
+                [(key, bot.name) for key, bot in bots.items()]
+            )
+        return reply
+
+
+class BotServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Hosts a set of bots on a unix socket, one thread per connection
+    """
+    daemon_threads = True
+
+    def __init__(self, address, bots):
+        """
+        ARGS:
+        - address: path of the unix socket to listen on
+        - bots: dictionary of bot key => BotPlayer object to host
+        """
+        self.bots = bots
+        socketserver.UnixStreamServer.__init__(self, address,
+         BotRequestHandler)
+
+
+#####
+# Client side
+#####
+
+class RemoteConnection(object):
+    """
+    A connection to a BotServer, making one round trip per call
+    """
+    def __init__(self, address):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+
+    def call(self, request):
+        write_message(self.wfile, request)
+        reply = read_message(self.rfile)
+        if reply is None:
+            raise RemoteBotError("bot server closed the connection")
+        if 'error' in reply:
+            raise RemoteBotError(reply['error'])
+        return reply
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+
+class ConnectionPool(object):
+    """
+    Reuses up to size connections to one BotServer
+    """
+    def __init__(self, address, size=4):
+        self.address = address
+        self.size = size
+        self.idle = queue.Queue()
+        self.num_created = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.num_created < self.size:
+                self.num_created += 1
+                return RemoteConnection(self.address)
+        return self.idle.get()
+
+    def release(self, conn):
+        self.idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class RemoteBotPlayer(BotPlayer):
+    """
+    Stands in for a bot hosted by a BotServer. BatchedArena batches its move
+    requests; played by a plain Arena it makes one stateless round trip per
+    move, sending the whole history.
+    """
+    def __init__(self, bot_key, pool, name=None, description=None):
+        """
+        ARGS:
+        - bot_key: key of the bot on the server
+        - pool: ConnectionPool to the server
+        - name, description: as for BotPlayer, name defaults to bot_key
+        """
+        if name is None:
+            name = bot_key
+        BotPlayer.__init__(self, name, description=description)
+        self.bot_key = bot_key
+        self.pool = pool
+
+    def getNextMove(self, pastMoves,\
+                    payoffs={'T': 5,'R': 3,'P': 1,'S': 0}, w=0.995):
+        conn = self.pool.acquire()
+        try:
+            reply = conn.call(
+                {'decide': [[self.bot_key, pastMoves, payoffs, w]]}
+            )
+        finally:
+            self.pool.release(conn)
+        return str(reply['decisions'][0])
+
+
+class BatchedArena(arena.Arena):
+    """
+    Arena that keeps many meetings in flight at once and advances them in
+    lockstep, so each step costs a single round trip to the bot server for
+    every remote bot move of every active meeting
+    """
+    def __init__(self, pool, max_in_flight=1024, **kwargs):
+        """
+        ARGS:
+        - pool: ConnectionPool to the server hosting the RemoteBotPlayers
+        - max_in_flight: number of meetings advanced together
+        - kwargs: passed on to Arena
+        """
+        arena.Arena.__init__(self, **kwargs)
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+
+    def play_pairs(self, botList, pairs, interaction_lengths,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+        interactions = {}
+        # meetings left to finish per pair, for progress reporting
+        meetings_left = {}
+        for pair in pairs:
+            interactions[pair] = [None]*len(interaction_lengths)
+            meetings_left[pair] = len(interaction_lengths)
+        meeting_specs = [(pair, m) for pair in pairs
+         for m in xrange(len(interaction_lengths))]
+        meeting_specs.reverse()
+
+        conn = self.pool.acquire()
+        try:
+            active = []
+            next_key = 0
+            to_close = []
+            while meeting_specs or active:
+                request = {}
+                # start new meetings as finished ones free up their slots
+                while meeting_specs and len(active) < self.max_in_flight:
+                    pair, m = meeting_specs.pop()
+                    bots = (botList[pair[0]], botList[pair[1]])
+                    meeting = {
+                        'pair': pair, 'm': m, 'bots': bots,
+                        'length': interaction_lengths[m],
+                        'histories': ([], []), 'keys': [None, None]
+                    }
+                    for side in (0, 1):
+                        if isinstance(bots[side], RemoteBotPlayer):
+                            meeting['keys'][side] = next_key
+                            request.setdefault('open', []).append(
+                                [next_key, bots[side].bot_key, payoffs, w]
+                            )
+                            next_key += 1
+                    active.append(meeting)
+                if to_close:
+                    request['close'] = to_close
+                    to_close = []
+
+                # ask for every remote move at once, and make the local ones
+                moves = []
+                for meeting in active:
+                    meeting_moves = [None, None]
+                    for side in (0, 1):
+                        history = meeting['histories'][side]
+                        if meeting['keys'][side] is not None:
+                            last_turn = None
+                            if history:
+                                last_turn = history[-1]
+                            request.setdefault('moves', []).append(
+                                [meeting['keys'][side], last_turn]
+                            )
+                        else:
+                            meeting_moves[side] = meeting['bots'][side]\
+                             .getNextMove(history, payoffs=payoffs, w=w)
+                    moves.append(meeting_moves)
+                remote_moves = []
+                if request:
+                    remote_moves = conn.call(request).get('moves', [])
+                remote_moves.reverse()
+
+                still_active = []
+                for meeting, meeting_moves in zip(active, moves):
+                    for side in (0, 1):
+                        if meeting_moves[side] is None:
+                            meeting_moves[side] = str(remote_moves.pop())
+                    bot1_move, bot2_move = meeting_moves
+                    meeting['histories'][0].append((bot1_move, bot2_move))
+                    meeting['histories'][1].append((bot2_move, bot1_move))
+                    if self.turn_dynamics is not None:
+                        self.turn_dynamics.add_turn(meeting['pair'][0],
+                         meeting['pair'][1], len(meeting['histories'][0])-1,
+                         (bot1_move, bot2_move))
+                    if len(meeting['histories'][0]) < meeting['length']:
+                        still_active.append(meeting)
+                    else:
+                        interactions[meeting['pair']][meeting['m']] =\
+                         meeting['histories'][0]
+                        meetings_left[meeting['pair']] -= 1
+                        if meetings_left[meeting['pair']] == 0:
+                            self.report_pairs_finished(1)
+                        to_close.extend(
+                            [k for k in meeting['keys'] if k is not None]
+                        )
+                active = still_active
+            if to_close:
+                conn.call({'close': to_close})
+        finally:
+            self.pool.release(conn)
+        return interactions
+
+
+if __name__ == "__main__":
+
+    import inspect
+    import the_bots
+
+    # serve every bot in the_bots that can be built without arguments, keyed
+    # by name
+    address = sys.argv[1]
+    bots = {}
+    for _, cls in inspect.getmembers(the_bots, inspect.isclass):
+        if issubclass(cls, BotPlayer) and cls is not BotPlayer:
+            bot = cls()
+            bots[bot.name] = bot
+    server = BotServer(address, bots)
+    print("serving "+str(len(bots))+" bots on "+address)
+    server.serve_forever()
@@ -0,0 +1,158 @@
+########
+##
+## Stream the ranked tables of tournament results and morality calculations
+## row by row as text, CSV or JSON lines
+##
+########
+
+
+import csv
+import json
+import sys
+
+
+FORMATS = ['text', 'csv', 'jsonl']
+
+TOURNAMENT_HEADERS = [
+    "Tournament ID",
+    "Bot Name",
+    "Total Score",
+    "Avg Score Per Turn"
+]
+
+MORALITY_HEADERS = [
+    "Tournament ID",
+    "Bot Name",
+    "Cooperation Rate",
+    "Not Worse Partner",
+    "Recursive Jesus",
+    "Recursive Moses"
+]
+
+
+class ReportWriter(object):
+    """
+    Writes the tournament and morality tables to a file-like object one row
+    at a time, sharing a single sort of the roster between the two tables
+    """
+    def __init__(self, tourney_res, morality_calc=None, fmt='text', out=None):
+        """
+        ARGS:
+        - tourney_res: TournamentResults object to report on
+        - morality_calc: MoralityCalculator object built from tourney_res, only
+        needed for the morality table
+        - fmt: one of 'text', 'csv' or 'jsonl'
+        - out: file-like object to write to, defaults to stdout
+        """
+        if fmt not in FORMATS:
+            raise ValueError("fmt must be one of "+str(FORMATS))
+        self.tourney_res = tourney_res
+        self.morality_calc = morality_calc
+        self.fmt = fmt
+        self.out = out
+        if self.out is None:
+            self.out = sys.stdout
+
+        # TournamentResults caches its sorted bot list, so both tables share
+        # the one sort
+        self.sorted_bots = self.tourney_res.get_sorted_bot_list()
+
+
+    #####
+    # Row generators
+    #####
+
+    def tournament_rows(self):
+        """
+        Yield a row per bot, in order of score, for the tournament table
+        """
+        tr = self.tourney_res
+        for bot in self.sorted_bots:
+            t_id = bot.tournament_id
+            yield (t_id, tr.get_name_by_id(t_id), tr.get_score_by_id(t_id),
+             tr.get_avg_score_by_id(t_id))
+
+    def morality_rows(self):
+        """
+        Yield a row per bot, in order of score, for the morality table
+        """
+        tr = self.tourney_res
+        mc = self.morality_calc
+        for bot in self.sorted_bots:
+            t_id = bot.tournament_id
+            yield (t_id, tr.get_name_by_id(t_id),
+             mc.get_coop_rate_by_id(t_id), mc.get_good_partner_by_id(t_id),
+             mc.get_eigenjesus_by_id(t_id), mc.get_eigenmoses_by_id(t_id))
+
+
+    #####
+    # Writing methods
+    #####
+
+    def write_tournament_table(self):
+        if self.fmt == 'text':
+            preamble = "\n***\n"
+            preamble += "Interaction Lengths: "+\
+             str(self.tourney_res.interaction_lengths)
+            preamble += "\n***\n"
+            self.out.write(preamble)
+        self.write_table(TOURNAMENT_HEADERS, self.tournament_rows())
+
+    def write_morality_table(self):
+        if self.morality_calc is None:
+            raise ValueError("a MoralityCalculator is needed for this table")
+        self.write_table(MORALITY_HEADERS, self.morality_rows())
+
+    def write_all(self):
+        self.write_tournament_table()
+        if self.morality_calc is not None:
+            self.write_morality_table()
+
+    def write_table(self, headers, rows):
+        """
+        Write the header and then each row as it is generated
+
+        ARGS:
+        - headers: list of column names
+        - rows: iterable of tuples with one value per column
+        """
+        if self.fmt == 'text':
+            self.write_text_table(headers, rows)
+        elif self.fmt == 'csv':
+            writer = csv.writer(self.out)
+            writer.writerow(headers)
+            for row in rows:
+                writer.writerow(row)
+        elif self.fmt == 'jsonl':
+            for row in rows:
+                record = dict(zip(headers, [self.json_value(v) for v in row]))
+                self.out.write(json.dumps(record, sort_keys=True)+"\n")
+
+    def write_text_table(self, headers, rows):
+        num_cols = len(headers)
+
+        # find a good column width to use for formatting the output
+        long_header = max([len(h) for h in headers])
+        long_name = max([len(bot.name) for bot in self.sorted_bots])+1
+        col = max([long_header, long_name])
+        col_str = str(col)
+        format_str = (("{: <"+col_str+"} ")*num_cols)[:-1]
+        hr = "-"*(num_cols*col)
+
+        headers_str = format_str.format(*headers)
+        self.out.write("\n"+hr+"\n"+headers_str+"\n"+hr+"\n")
+        for row in rows:
+            # every column but the last is shown with str, as the tables
+            # always have been
+            cells = [str(v) for v in row[:-1]]+[row[-1]]
+            self.out.write(format_str.format(*cells)+"\n")
+
+    def json_value(self, v):
+        # numpy scalars are not json serializable, so unwrap them
+        if hasattr(v, 'item'):
+            return v.item()
+        return v
+
+
+if __name__ == "__main__":
+    pass
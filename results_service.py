@@ -0,0 +1,416 @@
+########
+##
+## Serve queries on saved tournament results from a local socket, keeping
+## recently used results in memory as precomputed arrays
+##
+########
+
+
+import collections
+import os
+import pickle
+import socket
+import sys
+import threading
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+import numpy as np
+
+import batch_morality as bm
+import morality_calculator as mc
+import tournament_results as tr
+from remote_bots import read_message, write_message
+
+
+## The protocol is newline-delimited JSON over a unix stream socket, as for
+## remote_bots. Each request is an object naming a results file in the
+## served directory, "results", and a "query", one of:
+## - "info": {"names": [...], "metrics": [...]}
+## - "rank": {"ranking": [[id, name, avg_score], ...]}, best first, the
+##   first "top" of them if given
+## - "score" of "id": {"avg_score", "total", "rank"}, rank counted from 0
+## - "pair" of "ids" [i, j]: {"played", "scores": [i's, j's] average per
+##   turn, "cooperation": [i's, j's] rate}
+## - "metric" named "metric", of "id" if given: {"value"} or {"values"}
+## The reply holds those fields, or "error" with a message. Unplayed pairs
+## and unavailable values come back as null.
+## A results file is a pickled TournamentResults, or an .npz archive written
+## by TournamentResults.save_matrices.
+
+## metric names => MoralityCalculator getters
+METRICS = collections.OrderedDict([
+    ('coop_rate', mc.MoralityCalculator.get_coop_rate_by_id),
+    ('good_partner', mc.MoralityCalculator.get_good_partner_by_id),
+    ('eigenjesus', mc.MoralityCalculator.get_eigenjesus_by_id),
+    ('eigenmoses', mc.MoralityCalculator.get_eigenmoses_by_id)
+])
+
+QUERIES = ['info', 'rank', 'score', 'pair', 'metric']
+
+
+class ResultsServiceError(Exception):
+    pass
+
+
+def json_value(value):
+    """
+    A numpy scalar as a plain number, and nan as None
+    """
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return value
+
+
+#####
+# Summaries
+#####
+
+class ResultsSummary(object):
+    """
+    Everything the queries need from one tournament's results, as arrays
+    indexed by tournament id, so answering a query is a lookup and the
+    TournamentResults and MoralityCalculator needn't be kept around
+    """
+    def __init__(self, names, score_matrix, cooperation_matrix,
+                    played_matrix, avg_scores, totals, metrics):
+        """
+        ARGS:
+        - names: list of bot names
+        - score_matrix, cooperation_matrix, played_matrix: see
+        TournamentResults.calculate_pair_matrices
+        - avg_scores: numpy array of each bot's average score per turn
+        - totals: numpy array of each bot's total score, or None if unknown
+        - metrics: dictionary of METRICS name => numpy array
+        """
+        self.names = list(names)
+        self.score_matrix = score_matrix
+        self.cooperation_matrix = cooperation_matrix
+        self.played_matrix = played_matrix
+        self.avg_scores = avg_scores
+        self.totals = totals
+        self.metrics = metrics
+        self.ranking = np.argsort(-avg_scores, kind='mergesort')
+        self.ranks = np.empty(len(self.ranking), dtype=np.intp)
+        self.ranks[self.ranking] = np.arange(len(self.ranking))
+
+    @classmethod
+    def from_results(cls, tourney_res):
+        n = tourney_res.numBots
+        morality = mc.MoralityCalculator(tourney_res)
+        metrics = dict([(name, np.array([getter(morality, t_id)
+         for t_id in xrange(n)], dtype=float))
+         for name, getter in METRICS.items()])
+        return cls([tourney_res.get_name_by_id(t_id) for t_id in xrange(n)],
+         tourney_res.get_score_matrix(), tourney_res.get_cooperation_matrix(),
+         tourney_res.get_played_matrix(),
+         np.array([tourney_res.get_avg_score_by_id(t_id)
+         for t_id in xrange(n)], dtype=float),
+         np.array([tourney_res.get_score_by_id(t_id)
+         for t_id in xrange(n)], dtype=float),
+         metrics)
+
+    @classmethod
+    def from_matrices(cls, matrices):
+        """
+        ARGS:
+        - matrices: dictionary read by tournament_results.load_matrices from
+        an .npz archive
+
+        Only the matrices were saved, so each bot's average weights its
+        partners equally, and the morality metrics are only there if every
+        pair played
+        """
+        score_matrix = matrices['score_matrix']
+        cooperation_matrix = matrices['cooperation_matrix']
+        played_matrix = matrices['played_matrix']
+        avg_scores = np.where(played_matrix, score_matrix, 0).sum(axis=1)/\
+         played_matrix.sum(axis=1)
+        metrics = {}
+        if played_matrix.all():
+            coop_rates, bigger_man = bm.batched_cooperation_stuff(
+                cooperation_matrix[None]
+            )
+            eigenjesus, eigenmoses =\
+             bm.batched_network_morality(cooperation_matrix[None])
+            metrics = {
+                'coop_rate': coop_rates[0],
+                'good_partner': bigger_man[0],
+                'eigenjesus': eigenjesus[0],
+                'eigenmoses': eigenmoses[0]
+            }
+        return cls([str(name) for name in matrices['names']], score_matrix,
+         cooperation_matrix, played_matrix, avg_scores, None, metrics)
+
+    def get_nbytes(self):
+        """
+        RETURNS:
+        - roughly how many bytes the summary holds, for the cache's budget
+        """
+        arrays = [self.score_matrix, self.cooperation_matrix,
+         self.played_matrix, self.avg_scores, self.ranking, self.ranks]
+        arrays.extend(self.metrics.values())
+        if self.totals is not None:
+            arrays.append(self.totals)
+        return sum([a.nbytes for a in arrays])+\
+         sum([sys.getsizeof(name) for name in self.names])
+
+
+    #####
+    # Queries
+    #####
+
+    def check_id(self, t_id):
+        if not (0 <= t_id < len(self.names)):
+            raise ResultsServiceError("no bot with id "+str(t_id))
+
+    def info(self, request):
+        return {'names': self.names, 'metrics': sorted(self.metrics.keys())}
+
+    def rank(self, request):
+        top = request.get('top', len(self.names))
+        return {'ranking': [[int(t_id), self.names[t_id],
+         json_value(self.avg_scores[t_id])]
+         for t_id in self.ranking[:top]]}
+
+    def score(self, request):
+        t_id = request['id']
+        self.check_id(t_id)
+        total = None
+        if self.totals is not None:
+            total = json_value(self.totals[t_id])
+        return {'avg_score': json_value(self.avg_scores[t_id]),
+         'total': total, 'rank': int(self.ranks[t_id])}
+
+    def pair(self, request):
+        i, j = request['ids']
+        self.check_id(i)
+        self.check_id(j)
+        return {
+            'played': bool(self.played_matrix[i, j]),
+            'scores': [json_value(self.score_matrix[i, j]),
+             json_value(self.score_matrix[j, i])],
+            'cooperation': [json_value(self.cooperation_matrix[i, j]),
+             json_value(self.cooperation_matrix[j, i])]
+        }
+
+    def metric(self, request):
+        name = request['metric']
+        if name not in METRICS:
+            raise ResultsServiceError("metric must be one of "+
+             str(list(METRICS.keys())))
+        if name not in self.metrics:
+            raise ResultsServiceError(name+" is not available for these "+
+             "results")
+        values = self.metrics[name]
+        if 'id' in request:
+            self.check_id(request['id'])
+            return {'value': json_value(values[request['id']])}
+        return {'values': [json_value(v) for v in values]}
+
+
+def load_summary(path):
+    """
+    Read a results file (see the protocol above) into a ResultsSummary
+    """
+    if path.endswith('.npz'):
+        return ResultsSummary.from_matrices(tr.load_matrices(path))
+    f = open(path, 'rb')
+    try:
+        tourney_res = pickle.load(f)
+    finally:
+        f.close()
+    return ResultsSummary.from_results(tourney_res)
+
+
+#####
+# Cache
+#####
+
+class ResultsCache(object):
+    """
+    Least recently used ResultsSummarys, evicted once their total size goes
+    over max_bytes (the most recent one is always kept). Safe to share
+    between threads: a summary is loaded once however many threads ask for
+    it at the same time, and every thread reads the same copy.
+    """
+    def __init__(self, max_bytes=256*2**20, loader=load_summary):
+        """
+        ARGS:
+        - max_bytes: budget for the summaries held
+        - loader: function of a cache key (a path) => ResultsSummary
+        """
+        self.max_bytes = max_bytes
+        self.loader = loader
+        # key => (summary, nbytes), least recently used first
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        # key => threading.Event set when its load in progress finishes
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load_key=None):
+        """
+        ARGS:
+        - key: what the summary is cached under
+        - load_key: what the loader is called with, default key
+
+        RETURNS:
+        - summary: ResultsSummary
+        """
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    entry = self.entries.pop(key)
+                    self.entries[key] = entry
+                    self.hits += 1
+                    return entry[0]
+                event = self.loading.get(key)
+                if event is None:
+                    self.misses += 1
+                    event = self.loading[key] = threading.Event()
+                    break
+            # another thread is loading it; look again once it's done
+            event.wait()
+        summary = None
+        try:
+            summary = self.loader(load_key if load_key is not None else key)
+        finally:
+            with self.lock:
+                del self.loading[key]
+                if summary is not None:
+                    self.add(key, summary)
+            event.set()
+        return summary
+
+    def add(self, key, summary):
+        # called with the lock held
+        nbytes = summary.get_nbytes()
+        self.entries[key] = (summary, nbytes)
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, old_nbytes) = self.entries.popitem(last=False)
+            self.total_bytes -= old_nbytes
+
+    def get_stats(self):
+        with self.lock:
+            return {'entries': len(self.entries),
+             'bytes': self.total_bytes, 'hits': self.hits,
+             'misses': self.misses}
+
+
+#####
+# Server side
+#####
+
+class ResultsRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one connection, one request at a time
+    """
+    def handle(self):
+        while True:
+            request = read_message(self.rfile)
+            if request is None:
+                break
+            try:
+                reply = self.server.answer(request)
+            except ResultsServiceError as e:
+                reply = {'error': str(e)}
+            except Exception as e:
+                reply = {'error': repr(e)}
+            write_message(self.wfile, reply)
+
+
+class ResultsServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    """
+    Answers queries on the results files of one directory on a unix socket,
+    one thread per connection, all sharing one ResultsCache
+    """
+    daemon_threads = True
+
+    def __init__(self, address, directory, max_bytes=256*2**20):
+        """
+        ARGS:
+        - address: path of the unix socket to listen on
+        - directory: the directory results files are named relative to
+        - max_bytes: see ResultsCache
+        """
+        self.directory = os.path.abspath(directory)
+        self.cache = ResultsCache(max_bytes=max_bytes)
+        socketserver.UnixStreamServer.__init__(self, address,
+         ResultsRequestHandler)
+
+    def get_summary(self, name):
+        if os.path.basename(name) != name or name.startswith('.'):
+            raise ResultsServiceError("results must name a file in the "+
+             "served directory")
+        path = os.path.join(self.directory, name)
+        # keyed by modification time too, so a rewritten file is reloaded
+        key = (path, os.stat(path).st_mtime)
+        return self.cache.get(key, load_key=path)
+
+    def answer(self, request):
+        query = request.get('query')
+        if query not in QUERIES:
+            raise ResultsServiceError("query must be one of "+str(QUERIES))
+        summary = self.get_summary(request['results'])
+        return getattr(summary, query)(request)
+
+
+#####
+# Client side
+#####
+
+class ResultsClient(object):
+    """
+    A connection to a ResultsServer, making one round trip per query
+    """
+    def __init__(self, address):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+
+    def query(self, results, query, **kwargs):
+        """
+        ARGS:
+        - results: name of the results file
+        - query: one of QUERIES
+        - kwargs: the query's other fields, e.g. id=3
+
+        RETURNS:
+        - reply: dictionary of the query's fields
+        """
+        request = dict(kwargs)
+        request['results'] = results
+        request['query'] = query
+        write_message(self.wfile, request)
+        reply = read_message(self.rfile)
+        if reply is None:
+            raise ResultsServiceError("results server closed the connection")
+        if 'error' in reply:
+            raise ResultsServiceError(reply['error'])
+        return reply
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+
+if __name__ == "__main__":
+
+    # serve the results files of a directory, e.g.
+    # python results_service.py /tmp/results.sock results/
+    address = sys.argv[1]
+    directory = sys.argv[2]
+    server = ResultsServer(address, directory)
+    print("serving results in "+directory+" on "+address)
+    server.serve_forever()
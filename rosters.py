@@ -0,0 +1,230 @@
+########
+##
+## Rosters described in a file, as bot classes and parameter grids, whose
+## bots are only built when first used
+##
+########
+
+
+import inspect
+import itertools
+import json
+
+try:
+    import tomllib as toml_parser
+except ImportError:
+    try:
+        import toml as toml_parser
+    except ImportError:
+        toml_parser = None
+
+import the_bots
+from bot_player import BotPlayer
+
+
+## A roster file is JSON (or TOML, where a parser is installed) holding a
+## list "bots" of entries like:
+##   {"class": "MAJORITY", "params": {"soft": false}}
+##   {"class": "GENEROUS_TIT_FOR_TAT",
+##    "grid": {"p_generous": {"start": 0, "stop": 1, "step": 0.01}}}
+##   {"class": "JOSS", "grid": {"p_sneaky": [0.1, 0.3]}, "count": 2}
+## "params" are passed to every bot of the entry, "grid" gives a list (or an
+## inclusive start/stop/step range) of values per parameter and makes one
+## bot per combination, and "count" repeats each bot.
+
+
+#####
+# Registry
+#####
+
+## class name => BotPlayer subclass, for every bot in the_bots
+BOT_CLASSES = dict([(name, cls) for name, cls
+ in inspect.getmembers(the_bots, inspect.isclass)
+ if issubclass(cls, BotPlayer) and cls is not BotPlayer])
+
+def register(cls, name=None):
+    """
+    Make a BotPlayer subclass from outside the_bots usable in roster files
+    """
+    if not (inspect.isclass(cls) and issubclass(cls, BotPlayer)):
+        raise ValueError("only BotPlayer subclasses can be registered")
+    BOT_CLASSES[name or cls.__name__] = cls
+
+
+#####
+# Roster
+#####
+
+class BotSpec(object):
+    """
+    What it takes to build one bot: its class name and keyword arguments.
+    Cheap to keep and to send to another process.
+    """
+    __slots__ = ('class_name', 'params')
+
+    def __init__(self, class_name, params=None):
+        if class_name not in BOT_CLASSES:
+            raise ValueError("unknown bot class "+repr(class_name))
+        self.class_name = class_name
+        self.params = params or {}
+
+    def __getstate__(self):
+        return (self.class_name, self.params)
+
+    def __setstate__(self, state):
+        self.class_name, self.params = state
+
+    def __repr__(self):
+        return "BotSpec("+repr(self.class_name)+", "+repr(self.params)+")"
+
+    def build(self):
+        return BOT_CLASSES[self.class_name](**self.params)
+
+    def to_dict(self):
+        return {'class': self.class_name, 'params': self.params}
+
+
+class Roster(object):
+    """
+    A list of bots given by BotSpecs. Indexing or iterating builds a bot the
+    first time it is reached, with its tournament id set to its position, so
+    a roster costs next to nothing until its bots are played. Pickling keeps
+    only the specs, so worker processes build just the bots they play.
+    """
+    def __init__(self, specs):
+        """
+        ARGS:
+        - specs: list of BotSpec objects
+        """
+        self.specs = list(specs)
+        self.bots = {}
+        # descriptions are the same for every bot of a class, so keep one
+        self.descriptions = {}
+
+    def __getstate__(self):
+        return {'specs': self.specs}
+
+    def __setstate__(self, state):
+        self.__init__(state['specs'])
+
+    def __len__(self):
+        return len(self.specs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self.specs)
+        bot = self.bots.get(idx)
+        if bot is None:
+            bot = self.specs[idx].build()
+            bot.description = self.descriptions.setdefault(
+                bot.__class__.__name__, bot.description
+            )
+            bot.tournament_id = idx
+            self.bots[idx] = bot
+        return bot
+
+    def __iter__(self):
+        for idx in xrange(len(self.specs)):
+            yield self[idx]
+
+    def get_spec(self, idx):
+        return self.specs[idx]
+
+    def get_num_built(self):
+        return len(self.bots)
+
+    def to_dict(self):
+        """
+        RETURNS:
+        - a roster file's contents listing every bot on its own
+        """
+        return {'bots': [spec.to_dict() for spec in self.specs]}
+
+
+#####
+# Roster files
+#####
+
+def grid_values(values):
+    """
+    ARGS:
+    - values: a list of values, or a dictionary with start, stop and step of
+    an inclusive range
+
+    RETURNS:
+    - list of values
+    """
+    if isinstance(values, dict):
+        start, stop, step = values['start'], values['stop'], values['step']
+        if step <= 0:
+            raise ValueError("grid step must be positive")
+        num_steps = int(round((stop-start)/float(step)))
+        # rounded so steps like 0.01 give 0.07 and not 0.07000000000000001
+        return [round(start+i*step, 10) for i in xrange(num_steps+1)]
+    return list(values)
+
+def expand_entry(entry):
+    """
+    RETURNS:
+    - list of BotSpecs for one entry of a roster file
+    """
+    class_name = str(entry['class'])
+    params = dict([(str(k), v) for k, v in entry.get('params', {}).items()])
+    grid = entry.get('grid', {})
+    names = sorted(grid.keys())
+    specs = []
+    for combo in itertools.product(*[grid_values(grid[n]) for n in names]):
+        bot_params = dict(params)
+        bot_params.update(zip([str(n) for n in names], combo))
+        specs.extend(
+            [BotSpec(class_name, bot_params)]*int(entry.get('count', 1))
+        )
+    return specs
+
+def parse_roster(data):
+    """
+    ARGS:
+    - data: the parsed contents of a roster file
+
+    RETURNS:
+    - roster: Roster object
+    """
+    specs = []
+    for entry in data['bots']:
+        specs.extend(expand_entry(entry))
+    return Roster(specs)
+
+def load_roster(path):
+    """
+    Read a roster file, JSON or (with a .toml extension) TOML
+
+    RETURNS:
+    - roster: Roster object
+    """
+    if path.endswith('.toml'):
+        if toml_parser is None:
+            raise ValueError("reading TOML rosters needs tomllib or toml")
+        f = open(path, 'rb' if toml_parser.__name__ == 'tomllib' else 'r')
+    else:
+        f = open(path)
+    try:
+        if path.endswith('.toml'):
+            data = toml_parser.load(f)
+        else:
+            data = json.load(f)
+    finally:
+        f.close()
+    return parse_roster(data)
+
+def save_roster(roster, path):
+    f = open(path, 'w')
+    try:
+        json.dump(roster.to_dict(), f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+
+
+if __name__ == "__main__":
+    pass
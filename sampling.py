@@ -0,0 +1,117 @@
+########
+##
+## Choose which bot pairs play in a sampled (partial round-robin) tournament
+##
+########
+
+
+import random
+
+
+ALLOCATIONS = ['even', 'proportional']
+
+
+def get_stratum_key(stratify):
+    """
+    Turn the stratify argument of sample_opponent_pairs into a function
+    from bot to stratum
+    """
+    if stratify == 'class':
+        return lambda bot: bot.__class__.__name__
+    return stratify
+
+def allocate_draws(num_draws, strata_sizes, allocation):
+    """
+    Decide how many opponents to draw from each stratum
+
+    ARGS:
+    - num_draws: total number of opponents to draw
+    - strata_sizes: dictionary of stratum key => number of available bots
+    - allocation: 'even' spreads the draws equally over the strata,
+    'proportional' spreads them according to the size of each stratum
+
+    RETURNS:
+    - draws: dictionary of stratum key => number of opponents to draw
+    """
+    keys = list(strata_sizes.keys())
+    random.shuffle(keys)
+    draws = dict([(key, 0) for key in keys])
+    if allocation == 'proportional':
+        total = float(sum(strata_sizes.values()))
+        shares = [(num_draws*strata_sizes[key]/total, key) for key in keys]
+        for share, key in shares:
+            draws[key] = min(int(share), strata_sizes[key])
+        # hand out what is left over by largest remainder
+        shares.sort(key=lambda sk: sk[0]-int(sk[0]), reverse=True)
+        keys = [key for _, key in shares]
+    # deal the remaining draws one at a time to the strata with room left
+    remaining = num_draws-sum(draws.values())
+    while remaining > 0:
+        for key in keys:
+            if remaining > 0 and draws[key] < strata_sizes[key]:
+                draws[key] += 1
+                remaining -= 1
+    return draws
+
+def sample_opponent_pairs(botList, numOpponents, stratify=None,
+                    allocation='even', include_self=False):
+    """
+    Pair each bot with numOpponents randomly chosen other bots
+
+    ARGS:
+    - botList: list of bots, where the index of a bot is its tournament id
+    - numOpponents: number of opponents sampled for each bot
+    - stratify: None for simple random sampling, 'class' to stratify the
+    opponents by strategy class, or a function from bot to a stratum key
+    - allocation: how the draws are spread over the strata, one of
+    ALLOCATIONS (ignored when not stratifying)
+    - include_self: whether each bot also plays its own clone
+
+    RETURNS:
+    - pairs: sorted list of (i, j) index tuples with i <= j, each pair
+    appearing once even if both bots sampled each other
+    """
+    num_bots = len(botList)
+    stratum_key = get_stratum_key(stratify)
+    strata = {}
+    stratum_by_idx = []
+    position_by_idx = []
+    for idx, bot in enumerate(botList):
+        key = None
+        if stratum_key is not None:
+            key = stratum_key(bot)
+        members = strata.setdefault(key, [])
+        stratum_by_idx.append(key)
+        position_by_idx.append(len(members))
+        members.append(idx)
+
+    pairs = set()
+    for i in xrange(num_bots):
+        if include_self:
+            pairs.add((i, i))
+        # a bot is never its own sampled opponent, so its stratum has one
+        # fewer candidate
+        sizes = {}
+        for key, members in strata.items():
+            size = len(members)
+            if key == stratum_by_idx[i]:
+                size -= 1
+            if size > 0:
+                sizes[key] = size
+        draws = allocate_draws(numOpponents, sizes, allocation)
+        for key, num_draws in draws.items():
+            members = strata[key]
+            own_position = None
+            if key == stratum_by_idx[i]:
+                own_position = position_by_idx[i]
+            for pos in random.sample(xrange(sizes[key]), num_draws):
+                # skip over the bot's own position in its stratum
+                if own_position is not None and pos >= own_position:
+                    pos += 1
+                j = members[pos]
+                pairs.add((min(i, j), max(i, j)))
+    return sorted(pairs)
+
+
+if __name__ == "__main__":
+    pass
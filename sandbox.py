@@ -0,0 +1,303 @@
+########
+##
+## Run untrusted bots in worker processes with per-move and per-meeting time
+## budgets
+##
+########
+
+
+import multiprocessing
+import random
+import time
+
+import arena
+
+
+POLICIES = ['defect', 'disqualify']
+
+
+def worker_loop(conn, botList):
+    """
+    Body of a worker process. Keeps each open meeting's history from the
+    playing bot's point of view and answers move requests for it. Each
+    meeting draws from its own random stream, started from the seed it came
+    with, so its moves don't depend on which worker plays it or on what else
+    that worker played.
+
+    Messages received:
+    - ('move', meeting_key, bot_id, new_turns, payoffs, w, seed): append
+    new_turns to the meeting's history and reply with ('ok', move) or
+    ('error', msg)
+    - ('close', meeting_key): forget the meeting
+    - None: exit
+    """
+    histories = {}
+    # meeting_key => the meeting's random state between its moves
+    rng_states = {}
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        if msg[0] == 'close':
+            histories.pop(msg[1], None)
+            rng_states.pop(msg[1], None)
+            continue
+        _, meeting_key, bot_id, new_turns, payoffs, w, seed = msg
+        if meeting_key in rng_states:
+            random.setstate(rng_states[meeting_key])
+        else:
+            random.seed(seed)
+        history = histories.setdefault(meeting_key, [])
+        history.extend(new_turns)
+        try:
+            move = botList[bot_id].getNextMove(history, payoffs=payoffs, w=w)
+            conn.send(('ok', move))
+        except Exception as e:
+            conn.send(('error', repr(e)))
+        rng_states[meeting_key] = random.getstate()
+
+
+class BotWorker(object):
+    """
+    A worker process hosting the whole roster, plus what the parent knows
+    about the meeting histories it holds
+    """
+    def __init__(self, botList):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_loop,
+         args=(child_conn, botList))
+        self.process.daemon = True
+        self.process.start()
+        # meeting_key => number of turns of that meeting the worker has seen
+        self.synced = {}
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(1.0)
+
+    def shutdown(self):
+        try:
+            self.conn.send(None)
+        except (IOError, EOFError):
+            pass
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.kill()
+
+
+class BotWorkerPool(object):
+    """
+    Pre-warmed worker processes for a roster. Bots are spread over the active
+    workers by tournament id, and a worker that has to be killed is replaced
+    at once by a spare that was started ahead of time.
+    """
+    def __init__(self, botList, num_workers=1, num_spares=1):
+        """
+        ARGS:
+        - botList: roster to host, indexed by tournament id
+        - num_workers: number of workers playing moves
+        - num_spares: number of idle workers kept ready to replace a killed
+        one
+        """
+        self.botList = botList
+        self.num_spares = num_spares
+        self.workers = [BotWorker(botList) for _ in xrange(num_workers)]
+        self.spares = [BotWorker(botList) for _ in xrange(num_spares)]
+        self.num_restarts = 0
+
+    def request_move(self, bot_id, meeting_key, history, payoffs, w,
+                    timeout, seed):
+        """
+        Ask the worker hosting bot_id for its next move, waiting at most
+        timeout seconds
+
+        ARGS:
+        - bot_id: tournament id of the bot to move
+        - meeting_key: key identifying this side of the meeting
+        - history: the full history so far from the bot's point of view (only
+        the turns the worker hasn't seen are sent)
+        - timeout: seconds to wait
+        - seed: seed of the meeting side's random stream
+
+        RETURNS:
+        - (status, move_or_message, elapsed) where status is 'ok', 'timeout'
+        or 'error'
+        """
+        idx = bot_id % len(self.workers)
+        worker = self.workers[idx]
+        seen = worker.synced.get(meeting_key, 0)
+        start = time.time()
+        worker.conn.send(
+            ('move', meeting_key, bot_id, history[seen:], payoffs, w, seed)
+        )
+        worker.synced[meeting_key] = len(history)
+        if worker.conn.poll(max(timeout, 0)):
+            status, value = worker.conn.recv()
+            return status, value, time.time()-start
+        # the bot is stuck (or just too slow): swap in a spare and kill it
+        self.replace_worker(idx)
+        return 'timeout', None, time.time()-start
+
+    def close_meeting(self, bot_id, meeting_key):
+        worker = self.workers[bot_id % len(self.workers)]
+        if worker.synced.pop(meeting_key, None) is not None:
+            worker.conn.send(('close', meeting_key))
+
+    def replace_worker(self, idx):
+        self.workers[idx].kill()
+        if not self.spares:
+            self.spares.append(BotWorker(self.botList))
+        self.workers[idx] = self.spares.pop(0)
+        # start the next spare now so it is warm by the time it is needed
+        while len(self.spares) < self.num_spares:
+            self.spares.append(BotWorker(self.botList))
+        self.num_restarts += 1
+
+    def shutdown(self):
+        for worker in self.workers+self.spares:
+            worker.shutdown()
+        self.workers = []
+        self.spares = []
+
+
+class SandboxedArena(arena.Arena):
+    """
+    Arena that plays every move in a BotWorkerPool, so a bot that hangs or
+    crashes costs only its own moves instead of the whole tournament
+    """
+    def __init__(self, move_budget=1.0, meeting_budget=None,
+                    policy='defect', num_workers=1, num_spares=1, **kwargs):
+        """
+        ARGS:
+        - move_budget: seconds a bot may take for one move
+        - meeting_budget: seconds a bot may take over a whole meeting, or None
+        for no limit
+        - policy: what happens to a bot that runs over a budget (or raises):
+            'defect' => the move counts as a defection (for the rest of the
+            meeting if it was the meeting budget)
+            'disqualify' => the bot defects for the rest of the tournament
+            without being asked again
+        - num_workers, num_spares: see BotWorkerPool
+        - kwargs: passed on to Arena
+        """
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of "+str(POLICIES))
+        arena.Arena.__init__(self, **kwargs)
+        self.move_budget = move_budget
+        self.meeting_budget = meeting_budget
+        self.policy = policy
+        self.num_workers = num_workers
+        self.num_spares = num_spares
+
+        self.pool = None
+        self.timeouts = []
+        self.disqualified = set()
+        self.meeting_counter = 0
+
+    def play_pairs(self, botList, pairs, interaction_lengths,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995):
+        # warm the workers once per roster, not once per pair
+        if self.pool is None or self.pool.botList is not botList:
+            self.close()
+            self.pool = BotWorkerPool(botList, num_workers=self.num_workers,
+             num_spares=self.num_spares)
+        return arena.Arena.play_pairs(self, botList, pairs,
+         interaction_lengths, payoffs=payoffs, w=w)
+
+    def start_tournament(self):
+        arena.Arena.start_tournament(self)
+        self.timeouts = []
+        self.disqualified = set()
+
+    def build_results(self, botList, interactions, payoffs, **kwargs):
+        kwargs['timeouts'] = list(self.timeouts)
+        return arena.Arena.build_results(self, botList, interactions,
+         payoffs, **kwargs)
+
+    def close(self):
+        """
+        Shut down the worker processes
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def bot_interaction(self, bot1, bot2, interaction_length,
+                    payoffs={'T': 5,'R': 3,'P': 1,'S': 0}, w=0.995):
+        """
+        Same as Arena.bot_interaction, but each move is requested from the
+        worker pool under the time budgets, and any timeouts are recorded in
+        self.timeouts
+        """
+        meeting_id = self.meeting_counter
+        self.meeting_counter += 1
+        bots = (bot1, bot2)
+        # drawn from the global generator, so random.seed still makes
+        # tournaments reproducible (the workers' own generators aren't)
+        seeds = [random.randint(0, 2**31-1) for side in (0, 1)]
+        histories = ([], [])
+        # seconds used so far this meeting, and whether each side has been
+        # cut off for the rest of the meeting
+        used = [0.0, 0.0]
+        cut_off = [False, False]
+        i = 0
+        while i < interaction_length:
+            moves = [None, None]
+            for side in (0, 1):
+                moves[side] = self.sandboxed_move(bots[side], bots[1-side],
+                 (meeting_id, side), histories[side], i, used, cut_off, side,
+                 payoffs, w, seeds[side])
+            histories[0].append((moves[0], moves[1]))
+            histories[1].append((moves[1], moves[0]))
+            if self.turn_dynamics is not None:
+                self.turn_dynamics.add_turn(bot1.tournament_id,
+                 bot2.tournament_id, i, histories[0][-1])
+            i += 1
+        # even a disqualified bot's worker may still hold the meeting
+        for side in (0, 1):
+            self.pool.close_meeting(bots[side].tournament_id,
+             (meeting_id, side))
+        return histories[0]
+
+    def sandboxed_move(self, bot, partner, meeting_key, history, turn, used,
+                    cut_off, side, payoffs, w, seed):
+        bot_id = bot.tournament_id
+        if bot_id in self.disqualified or cut_off[side]:
+            return 'D'
+        timeout = self.move_budget
+        kind = 'move'
+        if self.meeting_budget is not None and \
+         self.meeting_budget-used[side] < timeout:
+            timeout = self.meeting_budget-used[side]
+            kind = 'meeting'
+        if timeout <= 0:
+            # the meeting budget is already spent, so don't even ask (a
+            # request that can't wait would get a healthy worker killed)
+            status, move, elapsed = 'timeout', None, 0.0
+        else:
+            status, move, elapsed = self.pool.request_move(bot_id,
+             meeting_key, history, payoffs, w, timeout, seed)
+        used[side] += elapsed
+        if status == 'ok':
+            return move
+        if status == 'error':
+            kind = 'error'
+        self.timeouts.append({
+            'bot_id': bot_id,
+            'partner_id': partner.tournament_id,
+            'meeting': meeting_key[0],
+            'turn': turn,
+            'kind': kind,
+            'elapsed': elapsed,
+            'message': move,
+            'policy': self.policy
+        })
+        if self.policy == 'disqualify':
+            self.disqualified.add(bot_id)
+        elif kind == 'meeting':
+            cut_off[side] = True
+        return 'D'
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,386 @@
+########
+##
+## Spatial and network games: bots on the nodes of a lattice or graph play
+## their neighbors every generation and copy better-scoring neighbors
+##
+########
+
+
+import random
+
+import numpy as np
+
+import arena
+import compiled_bots as cb
+import history
+
+
+UPDATE_RULES = ['imitate_best', 'fermi']
+NEIGHBORHOODS = ['von_neumann', 'moore']
+
+
+#####
+# Networks
+#####
+
+class Network(object):
+    """
+    An undirected graph stored as arrays: the edge list, plus each node's
+    neighbors back to back (compressed sparse rows)
+    """
+    def __init__(self, num_nodes, edges):
+        """
+        ARGS:
+        - num_nodes: number of nodes, numbered from 0
+        - edges: sequence of (node_1, node_2) pairs, each undirected edge
+        listed once
+        """
+        edges = np.asarray(edges, dtype=np.intp).reshape((-1, 2))
+        self.num_nodes = num_nodes
+        self.edge_u = edges[:, 0].copy()
+        self.edge_v = edges[:, 1].copy()
+        # every edge in both directions, sorted by source, so node n's
+        # neighbors are neighbors[offsets[n]:offsets[n+1]]
+        src = np.concatenate([self.edge_u, self.edge_v])
+        dst = np.concatenate([self.edge_v, self.edge_u])
+        order = np.argsort(src, kind='mergesort')
+        self.src = src[order]
+        self.neighbors = dst[order]
+        self.degrees = np.bincount(src, minlength=num_nodes)
+        self.offsets = np.concatenate([[0], np.cumsum(self.degrees)])
+
+    def get_num_edges(self):
+        return len(self.edge_u)
+
+    def get_neighbors(self, node):
+        return self.neighbors[self.offsets[node]:self.offsets[node+1]]
+
+
+def lattice(rows, cols, neighborhood='von_neumann', periodic=True):
+    """
+    Square lattice network, nodes numbered row by row
+
+    ARGS:
+    - rows, cols: size of the lattice
+    - neighborhood: 'von_neumann' (4 neighbors) or 'moore' (8 neighbors)
+    - periodic: whether the edges wrap around (a torus)
+
+    RETURNS:
+    - network: Network of rows*cols nodes
+    """
+    if neighborhood not in NEIGHBORHOODS:
+        raise ValueError("neighborhood must be one of "+str(NEIGHBORHOODS))
+    r, c = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+    r = r.ravel()
+    c = c.ravel()
+    # half of the neighborhood, so each edge comes up once
+    offsets = [(0, 1), (1, 0)]
+    if neighborhood == 'moore':
+        offsets += [(1, 1), (1, -1)]
+    edges = []
+    for dr, dc in offsets:
+        r2 = r+dr
+        c2 = c+dc
+        if periodic:
+            r2 = r2 % rows
+            c2 = c2 % cols
+            keep = np.ones(len(r), dtype=bool)
+        else:
+            keep = (r2 >= 0) & (r2 < rows) & (c2 >= 0) & (c2 < cols)
+        edges.append(np.column_stack([(r*cols+c)[keep], (r2*cols+c2)[keep]]))
+    edges = np.concatenate(edges)
+    # tiny periodic lattices wrap onto themselves
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    return Network(rows*cols, edges)
+
+
+#####
+# Results
+#####
+
+class SpatialResults(object):
+    """
+    What happened over the generations of a SpatialTournament
+    """
+    def __init__(self, strategies, strategy_counts, cooperation_rates,
+                    final_strategies, final_payoffs):
+        """
+        ARGS:
+        - strategies: the strategy bots, indexed like the counts
+        - strategy_counts: numpy array of shape (generations+1, S), how many
+        nodes held each strategy before each generation and at the end
+        - cooperation_rates: fraction of cooperative moves in each
+        generation's games
+        - final_strategies: strategy index of every node at the end
+        - final_payoffs: payoff of every node in the last generation
+        """
+        self.strategies = strategies
+        self.strategy_counts = strategy_counts
+        self.cooperation_rates = cooperation_rates
+        self.final_strategies = final_strategies
+        self.final_payoffs = final_payoffs
+
+    def get_strategy_shares(self):
+        """
+        RETURNS:
+        - shares: numpy array like strategy_counts, as fractions of nodes
+        """
+        return self.strategy_counts/float(self.strategy_counts[0].sum())
+
+    def get_final_counts_by_name(self):
+        return dict([(bot.name, int(n))
+         for bot, n in zip(self.strategies, self.strategy_counts[-1])])
+
+    def __str__(self):
+        lines = []
+        shares = self.get_strategy_shares()
+        for g in xrange(len(self.cooperation_rates)):
+            lines.append(
+                "generation {0}: cooperation {1:.3f}  ".format(
+                    g, self.cooperation_rates[g]
+                )+"  ".join(["{0} {1:.3f}".format(bot.name, share)
+                 for bot, share in zip(self.strategies, shares[g])
+                 if share > 0])
+            )
+        return "\n".join(lines)
+
+
+#####
+# Tournament
+#####
+
+class SpatialTournament(object):
+    """
+    Every generation, each edge of the network plays num_meetings meetings
+    between the strategies at its ends, each node's payoff is the sum over
+    its edges, and then every node updates its strategy at once from its
+    neighbors' payoffs.
+
+    Strategies with a memory_depth are compiled (see compiled_bots), so all
+    edge games of a generation run together in one TableEngine. Edges
+    between strategies involving any other bot are played the usual way,
+    once per generation for a pair that draws no random numbers (as every
+    edge between them would play the same game) and once per edge otherwise.
+    """
+    def __init__(self, network, strategies,
+                    payoffs={'T':5,'R':3,'P':1,'S':0}, w=0.995,
+                    num_meetings=1, update_rule='imitate_best',
+                    temperature=0.1, samples=10000, seed=None):
+        """
+        ARGS:
+        - network: Network the strategies live on
+        - strategies: list of bots, one per strategy
+        - payoffs: defines the scores for each Prisoner's Dilemma situation
+        - w: probability of interaction continuing at each step
+        - num_meetings: meetings per edge per generation
+        - update_rule:
+            'imitate_best' => each node takes the strategy of the best
+            scoring node among itself and its neighbors
+            'fermi' => each node picks a random neighbor and takes its
+            strategy with probability 1/(1+exp((P_self-P_neighbor)/K))
+        - temperature: K of the Fermi rule
+        - samples: see compile_bot
+        - seed: seed for the tournament's random draws, default drawn from
+        the global generator
+        """
+        if update_rule not in UPDATE_RULES:
+            raise ValueError("update_rule must be one of "+str(UPDATE_RULES))
+        self.network = network
+        self.strategies = strategies
+        self.payoffs = payoffs
+        self.w = w
+        self.num_meetings = num_meetings
+        self.update_rule = update_rule
+        self.temperature = temperature
+        if seed is None:
+            seed = random.randint(0, 2**31-1)
+        self.rng = np.random.RandomState(seed)
+
+        self.arena = arena.Arena()
+        # bots that compile_bot has to sample draw from random.random, so
+        # that draws from this tournament's generator meanwhile
+        real_random = random.random
+        random.random = random.Random(self.rng.randint(2**31-1)).random
+        try:
+            tables = [cb.compile_bot(bot, payoffs=payoffs, w=w,
+             samples=samples) for bot in strategies]
+        finally:
+            random.random = real_random
+        self.compiled = np.array([t is not None for t in tables])
+        placeholder = cb.DecisionTable(0, np.ones(1))
+        self.engine = cb.TableEngine(
+            [t if t is not None else placeholder for t in tables],
+            seed=self.rng.randint(2**31-1)
+        )
+        # score of each joint move code for the first and second bot
+        self.scores_1 = np.array([payoffs['R'], payoffs['S'], payoffs['T'],
+         payoffs['P']], dtype=float)
+        self.scores_2 = np.array([payoffs['R'], payoffs['T'], payoffs['S'],
+         payoffs['P']], dtype=float)
+
+    def interaction_length(self):
+        # same distribution as Arena.generate_interaction_lengths
+        return int(self.rng.geometric(1-self.w))
+
+    def play_edges(self, strategies):
+        """
+        Play every edge's meetings for one generation
+
+        ARGS:
+        - strategies: strategy index of every node
+
+        RETURNS:
+        - counts: numpy array of shape (num_edges, 4), the edge's (CC, CD,
+        DC, DD) counts from the point of view of its first node
+        """
+        s_u = strategies[self.network.edge_u]
+        s_v = strategies[self.network.edge_v]
+        counts = np.zeros((len(s_u), 4), dtype=np.int64)
+        both_compiled = self.compiled[s_u] & self.compiled[s_v]
+        compiled_edges = np.nonzero(both_compiled)[0]
+        other_edges = np.nonzero(~both_compiled)[0]
+        interaction_lengths = [self.interaction_length()
+         for _ in xrange(self.num_meetings)]
+        for interaction_length in interaction_lengths:
+            if len(compiled_edges):
+                counts[compiled_edges] += self.engine.play_meeting_counts(
+                    s_u[compiled_edges], s_v[compiled_edges],
+                    interaction_length
+                )
+        if len(other_edges):
+            lo = np.minimum(s_u[other_edges], s_v[other_edges])
+            hi = np.maximum(s_u[other_edges], s_v[other_edges])
+            pair_keys = lo*len(self.strategies)+hi
+            for key in np.unique(pair_keys):
+                a, b = divmod(int(key), len(self.strategies))
+                edges = other_edges[pair_keys == key]
+                pair_counts, draws =\
+                 self.play_pair_counts(a, b, interaction_lengths)
+                if draws == 0:
+                    # deterministic, so one game stands for all its edges
+                    edge_counts = np.tile(pair_counts, (len(edges), 1))
+                else:
+                    edge_counts = np.array([pair_counts]+[
+                        self.play_pair_counts(a, b, interaction_lengths)[0]
+                        for _ in xrange(len(edges)-1)
+                    ])
+                swapped = s_u[edges] != a
+                edge_counts[swapped] = edge_counts[swapped][:, cb.SWAPPED_CODES]
+                counts[edges] += edge_counts
+        return counts
+
+    def play_pair_counts(self, a, b, interaction_lengths):
+        """
+        Play strategies a and b against each other the usual way
+
+        RETURNS:
+        - pair_counts: numpy array of the (CC, CD, DC, DD) counts from a's
+        point of view
+        - draws: number of random numbers the bots drew
+        """
+        # the bots draw from random.random, so that is stood in for by a
+        # stream from this tournament's generator, counting its draws
+        real_random = random.random
+        stream = random.Random(self.rng.randint(2**31-1))
+        draws = [0]
+        def counting_random():
+            draws[0] += 1
+            return stream.random()
+        random.random = counting_random
+        try:
+            meetings = self.arena.play_pair(self.strategies[a],
+             self.strategies[b], interaction_lengths,
+             payoffs=self.payoffs, w=self.w)
+        finally:
+            random.random = real_random
+        pair_counts = np.zeros(4, dtype=np.int64)
+        for meeting in meetings:
+            for turn in meeting:
+                pair_counts[history.JOINT_CODES[turn]] += 1
+        return pair_counts, draws[0]
+
+    def node_payoffs(self, counts):
+        """
+        RETURNS:
+        - payoffs: numpy array with the total payoff of every node over its
+        edges
+        """
+        n = self.network.num_nodes
+        net = self.network
+        return np.bincount(net.edge_u, weights=counts.dot(self.scores_1),
+         minlength=n)+np.bincount(net.edge_v,
+         weights=counts.dot(self.scores_2), minlength=n)
+
+    def imitate_best(self, strategies, node_payoffs):
+        net = self.network
+        best = node_payoffs.copy()
+        np.maximum.at(best, net.src, node_payoffs[net.neighbors])
+        # directed edges whose far end is a strictly better best, shuffled so
+        # ties between equally good neighbors break at random
+        better = np.nonzero(
+            (node_payoffs[net.neighbors] == best[net.src]) &
+            (best[net.src] > node_payoffs[net.src])
+        )[0]
+        better = better[self.rng.permutation(len(better))]
+        new_strategies = strategies.copy()
+        new_strategies[net.src[better]] = strategies[net.neighbors[better]]
+        return new_strategies
+
+    def fermi(self, strategies, node_payoffs):
+        net = self.network
+        has_neighbors = np.nonzero(net.degrees > 0)[0]
+        picks = net.offsets[has_neighbors]+(
+            self.rng.random_sample(len(has_neighbors))*\
+             net.degrees[has_neighbors]
+        ).astype(np.intp)
+        models = net.neighbors[picks]
+        diff = (node_payoffs[has_neighbors]-node_payoffs[models])/\
+         self.temperature
+        adopt_prob = 1.0/(1.0+np.exp(np.clip(diff, -500, 500)))
+        adopt = self.rng.random_sample(len(has_neighbors)) < adopt_prob
+        new_strategies = strategies.copy()
+        new_strategies[has_neighbors[adopt]] = strategies[models[adopt]]
+        return new_strategies
+
+    def run(self, generations, initial=None):
+        """
+        ARGS:
+        - generations: number of generations to play
+        - initial: strategy index of every node to start from, default
+        uniformly random
+
+        RETURNS:
+        - spatial_res: SpatialResults object
+        """
+        num_strategies = len(self.strategies)
+        if initial is None:
+            strategies = self.rng.randint(num_strategies,
+             size=self.network.num_nodes)
+        else:
+            strategies = np.array(initial, dtype=np.intp)
+        strategy_counts = [np.bincount(strategies, minlength=num_strategies)]
+        cooperation_rates = []
+        node_payoffs = np.zeros(self.network.num_nodes)
+        for _ in xrange(generations):
+            counts = self.play_edges(strategies)
+            totals = counts.sum(axis=0)
+            moves = 2.0*totals.sum()
+            rate = 0.0
+            if moves:
+                rate = (2*totals[0]+totals[1]+totals[2])/moves
+            cooperation_rates.append(float(rate))
+            node_payoffs = self.node_payoffs(counts)
+            if self.update_rule == 'imitate_best':
+                strategies = self.imitate_best(strategies, node_payoffs)
+            else:
+                strategies = self.fermi(strategies, node_payoffs)
+            strategy_counts.append(
+                np.bincount(strategies, minlength=num_strategies)
+            )
+        return SpatialResults(self.strategies, np.array(strategy_counts),
+         cooperation_rates, strategies, node_payoffs)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,97 @@
+########
+##
+## Crashing and resuming checkpointed tournaments
+##
+########
+
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import arena
+import checkpoint
+import the_bots
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingArena(arena.Arena):
+    """
+    Arena that crashes when it is about to play its crash_at'th pair
+    """
+    def __init__(self, crash_at, **kwargs):
+        arena.Arena.__init__(self, **kwargs)
+        self.crash_at = crash_at
+        self.pairs_played = 0
+
+    def play_pair(self, *args, **kwargs):
+        self.pairs_played += 1
+        if self.pairs_played == self.crash_at:
+            raise Crash()
+        return arena.Arena.play_pair(self, *args, **kwargs)
+
+
+def make_roster():
+    return [the_bots.TIT_FOR_TAT(), the_bots.RANDOM(0.3), the_bots.TESTER(),
+     the_bots.JOSS(0.2), the_bots.MAJORITY(), the_bots.PAVLOV()]
+
+def tear_last_record(path):
+    """
+    Cut the checkpoint off halfway through its last record, as a crash in
+    the middle of a write would
+    """
+    f = open(path, 'rb')
+    try:
+        lines = f.readlines()
+    finally:
+        f.close()
+    f = open(path, 'wb')
+    try:
+        f.write(''.join(lines[:-1])+lines[-1][:len(lines[-1])//2])
+    finally:
+        f.close()
+
+
+class CheckpointResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'checkpoint.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_crash_resume_crash_keeps_finished_pairs(self):
+        random.seed(7)
+        expected = arena.Arena().runTournament(make_roster(), 2, w=0.95)
+
+        random.seed(7)
+        self.assertRaises(Crash, CrashingArena(9).runTournament,
+         make_roster(), 2, w=0.95, checkpoint_path=self.path,
+         checkpoint_every=1)
+        tear_last_record(self.path)
+        finished = checkpoint.read_checkpoint(self.path)[1]
+        self.assertEqual(len(finished), 7)
+
+        self.assertRaises(Crash, CrashingArena(6).resumeTournament,
+         self.path, make_roster(), checkpoint_every=1)
+        tear_last_record(self.path)
+        finished_again = checkpoint.read_checkpoint(self.path)[1]
+        self.assertEqual(len(finished_again), 7+4)
+        for pair, meetings in finished.items():
+            self.assertEqual(finished_again[pair], meetings)
+
+        random.seed(99)
+        results = arena.Arena().resumeTournament(self.path, make_roster(),
+         checkpoint_every=1)
+        self.assertEqual(results.interactions, expected.interactions)
+        self.assertEqual(len(checkpoint.read_checkpoint(self.path)[1]), 21)
+
+
+if __name__ == "__main__":
+    unittest.main()
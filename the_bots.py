@@ -12,6 +12,8 @@ from bot_player import BotPlayer
 
 
 class ALL_D(BotPlayer):
+    memory_depth = 0
+
     def __init__(self):
         d = "ALL_D defects unconditionally."
         BotPlayer.__init__(self, "ALL_D", description=d)
@@ -24,6 +26,8 @@ class ALL_D(BotPlayer):
         return 'D'
 
 class ALL_C(BotPlayer):
+    memory_depth = 0
+
     def __init__(self):
         d = "ALL_C cooperates unconditionally."
         BotPlayer.__init__(self, "ALL_C", description=d)
@@ -36,6 +40,8 @@ class ALL_C(BotPlayer):
         return 'C'
 
 class RANDOM(BotPlayer):
+    memory_depth = 0
+
     def __init__(self, p_cooperate=0.5):
         d = "RANDOM chooses randomly between cooperation and defection with "+\
         "some specified probability for each, independent of its partner's "+\
@@ -56,6 +62,8 @@ class RANDOM(BotPlayer):
             return 'D'
 
 class PAVLOV(BotPlayer):
+    memory_depth = 1
+
     def __init__(self):
         d = "PAVLOV defaults to cooperation on the first turn, and "+\
         "thereafter cooperates if and only if both players made the same "+\
@@ -83,6 +91,8 @@ class PAVLOV(BotPlayer):
                 return 'D'
 
 class TIT_FOR_TAT(BotPlayer):
+    memory_depth = 1
+
     def __init__(self):
         d = "TIT_FOR_TAT defaults to cooperation on the first turn, and "+\
         "thereafter mirrors its partner's previous move."
@@ -102,6 +112,8 @@ class TIT_FOR_TAT(BotPlayer):
             return their_last_move
 
 class TIT_FOR_TWO_TATS(BotPlayer):
+    memory_depth = 2
+
     def __init__(self):
         d = "TIT_FOR_TWO_TATS defects if and only if its partner has "+\
         "defected for the past two turns."
@@ -124,6 +136,8 @@ class TIT_FOR_TWO_TATS(BotPlayer):
                 return 'C'
 
 class TWO_TITS_FOR_TAT(BotPlayer):
+    memory_depth = 2
+
     def __init__(self):
         d = "TWO_TITS_FOR_TAT cooperates unless its partner defects in which "+\
         "case TWO_TITS_FOR_TAT retaliates with two defections."
@@ -150,6 +164,8 @@ class TWO_TITS_FOR_TAT(BotPlayer):
                     return 'C'
 
 class SUSPICIOUS_TIT_FOR_TAT(BotPlayer):
+    memory_depth = 1
+
     def __init__(self):
         d = "SUSPICIOUS_TIT_FOR_TAT defaults to defection on the first turn, "+\
         "and thereafter mirrors its partner's previous move."
@@ -169,6 +185,8 @@ class SUSPICIOUS_TIT_FOR_TAT(BotPlayer):
             return their_last_move
 
 class GENEROUS_TIT_FOR_TAT(BotPlayer):
+    memory_depth = 1
+
     def __init__(self, p_generous=0.1):
         d = "GENEROUS_TIT_FOR_TAT defaults to cooperation on the first turn, "+\
         "and thereafter mirrors its partner's previous move, except after "+\
@@ -200,6 +218,8 @@ class GENEROUS_TIT_FOR_TAT(BotPlayer):
             return action
 
 class JOSS(BotPlayer):
+    memory_depth = 1
+
     def __init__(self, p_sneaky=0.1):
         d = "JOSS defaults to cooperation on the first turn, and "+\
         "thereafter mirrors its partner's previous move, except after its "+\
@@ -406,6 +426,38 @@ class CHAMPION(BotPlayer):
                 # at least one condition failed
                 return 'C'
 
+class MEMORY_ONE(BotPlayer):
+    memory_depth = 1
+
+    def __init__(self, p_first=1.0, p_cc=1.0, p_cd=0.0, p_dc=1.0, p_dd=0.0):
+        d = "MEMORY_ONE cooperates on the first turn with some probability, "+\
+        "and thereafter with a probability that depends only on what it and "+\
+        "its partner did last turn. Many strategies are special cases, e.g. "+\
+        "the defaults make it TIT_FOR_TAT."
+        self.probs = (p_first, p_cc, p_cd, p_dc, p_dd)
+        name = "MEMORY_ONE_"+"_".join([str(p) for p in self.probs])
+        BotPlayer.__init__(self, name, description=d)
+
+    def getNextMove(self, pastMoves,\
+                    payoffs={'T': 5,'R': 3,'P': 1,'S': 0}, w=0.995):
+        """
+        Cooperate with the probability for this turn's situation: p_first on
+        the first turn, otherwise p_cc, p_cd, p_dc or p_dd for the last turn's
+        (my move, their move)
+        """
+        if not pastMoves:
+            p = self.probs[0]
+        else:
+            my_last_move, their_last_move = pastMoves[-1]
+            p = self.probs[
+                1+2*(my_last_move == 'D')+(their_last_move == 'D')
+            ]
+        r = random.random()
+        if r < p:
+            return 'C'
+        else:
+            return 'D'
+
 
 ## TODO: design and implement more bots
 
@@ -5,11 +5,132 @@
 ########
 
 
+import os
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
+
+import history
+import history_index
+import report_writers as rw
+
+
+def cooperation_counts(meeting):
+    """
+    Count each bot's cooperations in a meeting
+
+    ARGS:
+    - meeting: list of (bot1_move, bot2_move) tuples, or an object with a
+    joint_move_counts method like history.CompactMeeting
+
+    RETURNS:
+    - (bot1_coops, bot2_coops)
+    """
+    if hasattr(meeting, 'joint_move_counts'):
+        cc, cd, dc, dd = meeting.joint_move_counts()
+        return cc+cd, cc+dc
+    bot1_coops, bot2_coops = 0, 0
+    for turn in meeting:
+        if turn[0] == 'C':
+            bot1_coops += 1
+        if turn[1] == 'C':
+            bot2_coops += 1
+    return bot1_coops, bot2_coops
+
+def score_meeting(meeting, payoffs):
+    """
+    Score a meeting
+
+    ARGS:
+    - meeting: list of (bot1_move, bot2_move) tuples, or an object with a
+    joint_move_counts method like history.CompactMeeting
+
+    RETURNS:
+    - scores: the total score for each bot (bot1_score, bot2_score)
+    """
+    if hasattr(meeting, 'joint_move_counts'):
+        cc, cd, dc, dd = meeting.joint_move_counts()
+    else:
+        counts = [0, 0, 0, 0]
+        for turn in meeting:
+            counts[history.JOINT_CODES[tuple(turn)]] += 1
+        cc, cd, dc, dd = counts
+    R, S, T, P = [payoffs[k] for k in ('R', 'S', 'T', 'P')]
+    return (cc*R+cd*S+dc*T+dd*P, cc*R+cd*T+dc*S+dd*P)
+
+def meeting_stats(scores, lengths):
+    """
+    ARGS:
+    - scores: a bot's score in each of its meetings with one partner
+    - lengths: the length of each of those meetings
+
+    RETURNS:
+    - the running sums ratio_stderr takes, over those meetings
+    """
+    stats = [0, 0, 0, 0, 0, 0]
+    for score, length in zip(scores, lengths):
+        stats[0] += 1
+        stats[1] += score
+        stats[2] += length
+        stats[3] += score*score
+        stats[4] += length*length
+        stats[5] += score*length
+    return stats
+
+def ratio_stderr(meeting_stats):
+    """
+    Standard error of an average score per turn sum(s)/sum(l), treating each
+    meeting as a sample
+
+    ARGS:
+    - meeting_stats: running sums over meetings
+    [meetings, sum(s), sum(l), sum(s*s), sum(l*l), sum(s*l)]
+    where s is a score in a meeting and l is the meeting length
+
+    RETURNS:
+    - stderr: the standard error, infinite with fewer than two meetings
+    """
+    n, sum_s, sum_l, sum_ss, sum_ll, sum_sl = meeting_stats
+    if n < 2:
+        return float('inf')
+    r = sum_s/float(sum_l)
+    mean_l = sum_l/float(n)
+    residual_ss = max(sum_ss-2*r*sum_sl+r*r*sum_ll, 0.0)
+    return (residual_ss/(n*(n-1)))**0.5/mean_l
+
+def partner_average(partner_stats):
+    """
+    A bot's average score per turn weighting every partner equally, and its
+    standard error, from its meetings with each partner (the partners'
+    averages are independent, so their variances add)
+
+    ARGS:
+    - partner_stats: list of running sums, as taken by ratio_stderr, one
+    per partner
+
+    RETURNS:
+    - (average, stderr)
+    """
+    num_partners = float(len(partner_stats))
+    average = sum([stats[1]/float(stats[2])
+     for stats in partner_stats])/num_partners
+    variance = sum([ratio_stderr(stats)**2
+     for stats in partner_stats])/num_partners**2
+    return average, variance**0.5
+
+
 class TournamentResults(object):
     """
     Calculates and wraps results of tournaments
     """
-    def __init__(self, botList, interactions, payoffs):
+    def __init__(self, botList, interactions, payoffs,
+                    interaction_lengths=None, schedule_info=None,
+                    timeouts=None, run_length=False, turn_dynamics=None,
+                    interaction_scores=None):
         """
         Calculate the scores of the interactions and the total scores for the
         bots using the specified payoffs.
@@ -30,11 +151,33 @@ class TournamentResults(object):
             ],
             ...
         }
+        Pairs that did not play (as in a sampled tournament) are simply left
+        out of interactions.
         - payoffs: defines the scores for each Prisoner's Dilemma situation,
         which TournamentResults needs to correctly score each interaction
+        - interaction_lengths: the meeting lengths the tournament drew, only
+        needed when pairs met different numbers of times (otherwise they are
+        read off the interactions)
+        - schedule_info: optional dictionary describing how the pairs were
+        scheduled, e.g. why an adaptive tournament stopped
+        - timeouts: optional list of dictionaries, one per move or meeting in
+        which a sandboxed bot ran over its time budget
+        - run_length: whether to store every meeting run-length encoded (as
+        history.RunLengthMeetings), which is much smaller for histories of
+        long streaks and lets get_history_index work run by run (meetings
+        that are only tallies are kept as they are)
+        - turn_dynamics: optional dynamics.TurnDynamics counted while the
+        tournament was played
+        - interaction_scores: optional scores of every meeting already worked
+        out while playing (as an AdaptiveScheduler does), keyed like
+        interactions, so the meetings needn't be scored again
         """
         self.botList = botList
         self.interactions = interactions
+        if run_length:
+            self.interactions = dict([(pair, [m if isinstance(m,
+             history.MeetingTally) else history.run_length_encode(m)
+             for m in meetings]) for pair, meetings in interactions.items()])
         self.payoffs = payoffs
 
         self.numBots = len(self.botList)
@@ -43,59 +186,60 @@ class TournamentResults(object):
         self.bot_info_by_id = {}
         for bot in botList:
             self.bot_info_by_id[bot.tournament_id] =\
-            {'name': bot.name, 'description': bot.description, 'total': 0}
+            {'name': bot.name, 'description': bot.description, 'total': 0,
+             'turns': 0, 'partners': 0, 'partner_avg_sum': 0.0,
+             'partner_var_sum': 0.0}
+
+        # running sums over each bot's meetings, used for the standard error
+        # of its average score per turn:
+        # [meetings, sum(s), sum(l), sum(s*s), sum(l*l), sum(s*l)]
+        # where s is the bot's score in a meeting and l is the meeting length
+        self.meeting_stats_by_id = {}
+        for bot in botList:
+            self.meeting_stats_by_id[bot.tournament_id] = [0, 0, 0, 0, 0, 0]
 
-        self.interaction_lengths = []
-        some_pair = self.interactions.keys()[0]
-        for interaction in self.interactions[some_pair]:
-            self.interaction_lengths.append(len(interaction))
+        self.schedule_info = schedule_info
+        self.timeouts = timeouts
+        if self.timeouts is None:
+            self.timeouts = []
 
-        self.total_interactions = float(
-            self.numBots*sum(self.interaction_lengths)
-        )
+        self.turn_dynamics = turn_dynamics
+
+        self.interaction_lengths = interaction_lengths
+        if self.interaction_lengths is None:
+            self.interaction_lengths = []
+            some_pair = self.interactions.keys()[0]
+            for interaction in self.interactions[some_pair]:
+                self.interaction_lengths.append(len(interaction))
+
+        # if pairs met different numbers of times (as in an adaptive
+        # tournament), each bot's average weights its partners equally instead
+        # of weighting them by the number of turns played together
+        meeting_counts = set([len(m) for m in self.interactions.values()])
+        self.uneven_meetings = len(meeting_counts) > 1
 
         # to be filled with scores for each bot in each interaction
         self.interaction_scores = {}
+        self.known_scores = interaction_scores
+
+        # bots sorted by score, computed once on first request
+        self.sorted_bot_list = None
+
+        # HistoryIndex of the meetings, built on first request
+        self.history_index = None
+
+        # dense per-pair matrices, built on first request
+        self.score_matrix = None
+        self.cooperation_matrix = None
+        self.played_matrix = None
 
         # calculate and store interaction and total scores
         self.calculate_scores()
 
     def __str__(self):
-        # sort the bots for printing output
-        def get_score(bot):
-            return self.bot_info_by_id[bot.tournament_id]['total']
-        sorted_bots = sorted(self.botList, key=get_score, reverse=True)
-
-        headers = [
-            "Tournament ID",
-            "Bot Name",
-            "Total Score",
-            "Avg Score Per Turn"
-        ]
-        num_cols = len(headers)
-
-        # find a good column width to use for formatting the output
-        long_header = max([len(h) for h in headers])
-        long_name = max([len(bot.name) for bot in self.botList])+1
-        col = max([long_header, long_name])
-        col_str = str(col)
-        format_str = (("{: <"+col_str+"} ")*num_cols)[:-1]
-        hr = "-"*(num_cols*col)
-
-        # construct output string
-        output = "\n***\n"
-        output += "Interaction Lengths: "+str(self.interaction_lengths)
-        output += "\n***\n"
-        headers_str = format_str.format(*headers)
-        output += "\n"+hr+"\n"+headers_str+"\n"+hr+"\n"
-        for bot in sorted_bots:
-            t_id = bot.tournament_id
-            name = self.get_name_by_id(t_id)
-            score = self.get_score_by_id(t_id)
-            avg = self.get_avg_score_by_id(t_id)
-            row = format_str.format(str(t_id), name, str(score), avg)
-            output += row+"\n"
-        return output
+        output = StringIO()
+        rw.ReportWriter(self, out=output).write_tournament_table()
+        return output.getvalue()
 
 
     ## TODO: make pretty printing for interactions
@@ -147,25 +291,65 @@ class TournamentResults(object):
         """
         for bot_pair in self.interactions:
             self.interaction_scores[bot_pair] = []
-            for meeting in self.interactions[bot_pair]:
-                meeting_scores = [0, 0]
-                for turn in meeting:
-                    turn_scores = self.score_turn(turn)
-                    # accumulate scores for meeting
-                    meeting_scores[0] += turn_scores[0]
-                    meeting_scores[1] += turn_scores[1]
-                meeting_scores = tuple(meeting_scores)
+            known_scores = None
+            if self.known_scores is not None:
+                known_scores = self.known_scores[bot_pair]
+            for m, meeting in enumerate(self.interactions[bot_pair]):
+                if known_scores is not None:
+                    meeting_scores = tuple(known_scores[m])
+                else:
+                    meeting_scores = score_meeting(meeting, self.payoffs)
                 # add scores for meeting to list of meeting scores for this pair
                 self.interaction_scores[bot_pair].append(meeting_scores)
                 # also add to total for each bot, but only once if this is a bot
                 # paired with its clone
                 if bot_pair[0] == bot_pair[1]:
-                    self.bot_info_by_id[bot_pair[0]]['total']\
-                     += meeting_scores[0]
+                    self.add_meeting_score(bot_pair[0], meeting_scores[0],
+                     len(meeting))
                 else:
                     for idx, bot_id in enumerate(bot_pair):
-                        self.bot_info_by_id[bot_id]['total']\
-                         += meeting_scores[idx]
+                        self.add_meeting_score(bot_id, meeting_scores[idx],
+                         len(meeting))
+            self.add_partner_average(bot_pair)
+
+    def add_partner_average(self, bot_pair):
+        """
+        Add each bot's average score per turn against its partner in bot_pair
+        to its running sum of per-partner averages
+        """
+        pair_scores = self.interaction_scores[bot_pair]
+        lengths = [len(meeting) for meeting in self.interactions[bot_pair]]
+        pair_turns = float(sum(lengths))
+        bot_ids = bot_pair
+        if bot_pair[0] == bot_pair[1]:
+            bot_ids = bot_pair[:1]
+        for idx, bot_id in enumerate(bot_ids):
+            scores = [meeting_scores[idx] for meeting_scores in pair_scores]
+            info = self.bot_info_by_id[bot_id]
+            info['partners'] += 1
+            info['partner_avg_sum'] += sum(scores)/pair_turns
+            # variance of this partner's average, for get_score_stderr_by_id
+            info['partner_var_sum'] +=\
+             ratio_stderr(meeting_stats(scores, lengths))**2
+
+    def add_meeting_score(self, bot_id, score, length):
+        """
+        Add a bot's score in one meeting to its total and its running sums
+
+        ARGS:
+        - bot_id: tournament id of the bot
+        - score: the bot's total score in the meeting
+        - length: number of turns in the meeting
+        """
+        self.bot_info_by_id[bot_id]['total'] += score
+        self.bot_info_by_id[bot_id]['turns'] += length
+        stats = self.meeting_stats_by_id[bot_id]
+        stats[0] += 1
+        stats[1] += score
+        stats[2] += length
+        stats[3] += score*score
+        stats[4] += length*length
+        stats[5] += score*length
 
 
     #####
@@ -181,12 +365,32 @@ class TournamentResults(object):
     def get_score_by_id(self, t_id):
         return self.bot_info_by_id[t_id]['total']
 
+    def get_turns_by_id(self, t_id):
+        return self.bot_info_by_id[t_id]['turns']
+
     def get_avg_score_by_id(self, t_id):
-        return self.get_score_by_id(t_id)/self.total_interactions
+        if self.uneven_meetings:
+            info = self.bot_info_by_id[t_id]
+            return info['partner_avg_sum']/info['partners']
+        # in a full round-robin every bot plays the same number of turns
+        return self.get_score_by_id(t_id)/float(self.get_turns_by_id(t_id))
+
+    def get_score_stderr_by_id(self, t_id):
+        """
+        Standard error of the bot's average score per turn, treating each of
+        its meetings as a sample (ratio estimator over meetings). When pairs
+        met different numbers of times it is the standard error of the
+        per-partner average instead (see partner_average), to match
+        get_avg_score_by_id.
+        """
+        if self.uneven_meetings:
+            info = self.bot_info_by_id[t_id]
+            return info['partner_var_sum']**0.5/info['partners']
+        return ratio_stderr(self.meeting_stats_by_id[t_id])
 
     def get_winning_id(self):
         id_list = [bot.tournament_id for bot in self.botList]
-        return max(id_list, key=self.get_score_by_id)
+        return max(id_list, key=self.get_avg_score_by_id)
 
     def get_winning_name(self):
         return self.get_name_by_id(self.get_winning_id())
@@ -203,13 +407,212 @@ class TournamentResults(object):
     def get_interactions(self, id_1, id_2):
         return self.interactions[(id_1, id_2)]
 
+    def get_timeouts(self):
+        return self.timeouts
+
+    def get_turn_dynamics(self):
+        return self.turn_dynamics
+
+    def get_timeouts_by_id(self, t_id):
+        return [t for t in self.timeouts if t['bot_id'] == t_id]
+
+    def get_num_meetings(self, id_1, id_2):
+        return len(self.interactions[(id_1, id_2)])
+
+    def get_played_pairs(self):
+        return self.interactions.keys()
+
+    def is_round_robin(self):
+        # every pair, including each bot with its clone, played
+        return len(self.interactions) == self.numBots*(self.numBots+1)//2
+
+    def get_history_index(self):
+        """
+        RETURNS:
+        - history_index: HistoryIndex answering questions like first
+        defections, cooperation streaks and retaliations per pair
+        """
+        if self.history_index is None:
+            self.history_index = history_index.HistoryIndex(self)
+        return self.history_index
+
     def get_bot_list(self):
         return self.botList
 
+
+    #####
+    # Pair matrices
+    #####
+
+    def calculate_pair_matrices(self):
+        """
+        Build the dense per-pair matrices, indexed by tournament id
+
+        STORES:
+        - score_matrix: numpy array, score_matrix[i][j] is i's average score
+        per turn against j (nan if they didn't play)
+        - cooperation_matrix: numpy array, cooperation_matrix[i][j] is i's
+        cooperation rate against j (nan if they didn't play)
+        - played_matrix: boolean numpy array of which pairs played
+        """
+        n = self.numBots
+        score_matrix = np.full((n, n), np.nan)
+        cooperation_matrix = np.full((n, n), np.nan)
+        for (id_1, id_2), meetings in self.interactions.items():
+            turns = float(sum([len(meeting) for meeting in meetings]))
+            scores = self.interaction_scores[(id_1, id_2)]
+            coops = [cooperation_counts(meeting) for meeting in meetings]
+            # for a bot paired with its clone, the score is the first bot's
+            # (as counted in its total) and the cooperation rate the second
+            # bot's (as in MoralityCalculator)
+            score_matrix[id_2, id_1] = sum([s[1] for s in scores])/turns
+            score_matrix[id_1, id_2] = sum([s[0] for s in scores])/turns
+            cooperation_matrix[id_1, id_2] = sum([c[0] for c in coops])/turns
+            cooperation_matrix[id_2, id_1] = sum([c[1] for c in coops])/turns
+        self.score_matrix = score_matrix
+        self.cooperation_matrix = cooperation_matrix
+        self.played_matrix = ~np.isnan(score_matrix)
+
+    def get_score_matrix(self):
+        if self.score_matrix is None:
+            self.calculate_pair_matrices()
+        return self.score_matrix
+
+    def get_cooperation_matrix(self):
+        if self.cooperation_matrix is None:
+            self.calculate_pair_matrices()
+        return self.cooperation_matrix
+
+    def get_played_matrix(self):
+        if self.played_matrix is None:
+            self.calculate_pair_matrices()
+        return self.played_matrix
+
+    def save_matrices(self, path):
+        """
+        Save the pair matrices: a .npy path gets the score matrix alone, any
+        other path an .npz archive of score_matrix, cooperation_matrix,
+        played_matrix and names (read it back with load_matrices)
+
+        RETURNS:
+        - path: the file written, with .npz added to an archive's path that
+        lacked it (as numpy does anyway)
+        """
+        if path.endswith('.npy'):
+            np.save(path, self.get_score_matrix())
+            return path
+        if not path.endswith('.npz'):
+            path += '.npz'
+        np.savez(path, score_matrix=self.get_score_matrix(),
+         cooperation_matrix=self.get_cooperation_matrix(),
+         played_matrix=self.get_played_matrix(),
+         names=np.array([self.get_name_by_id(t_id)
+         for t_id in xrange(self.numBots)]))
+        return path
+
+    def get_beats_matrix(self):
+        """
+        RETURNS:
+        - beats: boolean numpy array, beats[i][j] is whether i averaged more
+        per turn against j than j did against i
+        """
+        score_matrix = np.nan_to_num(self.get_score_matrix())
+        return (score_matrix > score_matrix.T) & self.get_played_matrix()
+
+    def get_ids_beaten_by(self, t_id):
+        return np.nonzero(self.get_beats_matrix()[t_id])[0].tolist()
+
+    def get_ids_beating(self, t_id):
+        return np.nonzero(self.get_beats_matrix()[:, t_id])[0].tolist()
+
+    def get_win_counts(self):
+        """
+        RETURNS:
+        - wins: numpy array of how many partners each bot beat head to head
+        """
+        return self.get_beats_matrix().sum(axis=1)
+
+    def get_pair_average_scores(self):
+        """
+        RETURNS:
+        - averages: numpy array of each bot's score per turn averaged over
+        its partners, weighting every partner equally
+        """
+        score_matrix = self.get_score_matrix()
+        played = self.get_played_matrix()
+        return np.where(played, score_matrix, 0).sum(axis=1)/\
+         played.sum(axis=1)
+
+    def get_matrix_ranking(self, by='average'):
+        """
+        RETURNS:
+        - ranking: list of tournament ids, best first, by 'average' (see
+        get_pair_average_scores) or 'wins' (see get_win_counts)
+        """
+        if by == 'average':
+            values = self.get_pair_average_scores()
+        elif by == 'wins':
+            values = self.get_win_counts()
+        else:
+            raise ValueError("by must be 'average' or 'wins'")
+        return np.argsort(-values, kind='mergesort').tolist()
+
+    def get_dominance_matrix(self):
+        """
+        RETURNS:
+        - dominates: boolean numpy array, dominates[i][j] is whether i scored
+        at least as well as j against every partner both played, and better
+        against at least one
+        """
+        score_matrix = self.get_score_matrix()
+        played = self.get_played_matrix()
+        n = self.numBots
+        dominates = np.zeros((n, n), dtype=bool)
+        # a row at a time keeps memory at O(N^2)
+        for i in xrange(n):
+            common = played[i][None, :] & played
+            diff = np.where(common, score_matrix[i][None, :]-score_matrix,
+             0.0)
+            dominates[i] = common.any(axis=1) & (diff >= 0).all(axis=1) &\
+             (diff > 0).any(axis=1)
+        return dominates
+
+    def get_dominated_ids(self):
+        """
+        RETURNS:
+        - list of tournament ids of bots dominated by some other bot
+        """
+        return np.nonzero(self.get_dominance_matrix().any(axis=0))[0].tolist()
+
     def get_sorted_bot_list(self):
-        def get_score(bot):
-            return self.get_score_by_id(bot.tournament_id)
-        return sorted(self.botList, key=get_score, reverse=True)
+        if self.sorted_bot_list is None:
+            # average score ranks the same as total score in a full
+            # round-robin, and stays fair when bots play different numbers of
+            # turns
+            def get_score(bot):
+                return self.get_avg_score_by_id(bot.tournament_id)
+            self.sorted_bot_list =\
+             sorted(self.botList, key=get_score, reverse=True)
+        return self.sorted_bot_list
+
+
+def load_matrices(path):
+    """
+    Read pair matrices saved by TournamentResults.save_matrices, from the
+    same path it was given (.npz is added if that's where the archive is)
+
+    RETURNS:
+    - dictionary of name => numpy array ('score_matrix' alone for a .npy)
+    """
+    if path.endswith('.npy'):
+        return {'score_matrix': np.load(path)}
+    if not os.path.exists(path) and os.path.exists(path+'.npz'):
+        path += '.npz'
+    archive = np.load(path)
+    try:
+        return dict([(key, archive[key]) for key in archive.files])
+    finally:
+        archive.close()
 
 
 if __name__ == "__main__":